@@ -0,0 +1,115 @@
+"""
+Compare the vectorized comma-cell parser with the original per-cell parser
+
+Also checks that comma cells are averaged in text columns of either dtype and
+in streamed chunks written to Parquet or Feather:
+
+    python benchmarks/bench_comma_parser.py --proteins 10 50 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import importlib.util
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import NON_NUMERICAL_COLUMNS, _average_comma_cells
+from synthetic import make_feature_table
+
+
+def average_comma_cells_reference(df, columns):
+    # Original implementation from preprocess_data, kept as the reference
+    df = df.copy()
+
+    def process_cell(cell):
+        if isinstance(cell, str) and "," in cell:
+            numbers = cell.split(',')
+            return [float(number.strip()) for number in numbers]
+        return [float(cell)]
+
+    comma_columns = [col for col in columns if df[col].astype(str).str.contains(',').any()]
+    for col in comma_columns:
+        df[col] = df[col].astype(str).apply(process_cell)
+        df[col] = df[col].apply(lambda x: sum(x) / len(x) if len(x) > 1 else x[0])
+
+    return df
+
+
+def check_text_dtypes():
+    # Comma cells are averaged whether text is stored as object or, as pandas 3
+    # reads it, as StringDtype; missing cells stay NaN
+    expected = np.array([0.9, 3.0, np.nan])
+    for dtype in (object, "string"):
+        df = pd.DataFrame({"HBond": ["2,-0.2", "3", np.nan]}).astype(dtype)
+        actual = _average_comma_cells(df, ["HBond"])["HBond"].to_numpy(dtype=np.float64)
+        if not np.allclose(actual, expected, equal_nan=True):
+            sys.exit(f"Comma cells of a {dtype} column are not averaged: {actual}")
+
+
+def check_streamed_chunks():
+    # A later CSV chunk may hold comma cells in a column that the first chunk,
+    # and so the Parquet/Feather schema, typed as numeric
+    if importlib.util.find_spec("pyarrow") is None:
+        return
+    from prediction_stream import ChunkWriter
+    from table_io import read_table
+
+    chunks = [pd.DataFrame({"HBond": [0.5, 1.0]})]
+    chunks += [pd.DataFrame({"HBond": ["0.1,0.3", "2", np.nan]}).astype(dtype) for dtype in (object, "string")]
+    expected = np.array([0.5, 1.0, 0.2, 2.0, np.nan, 0.2, 2.0, np.nan])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for extension in (".parquet", ".feather"):
+            path = os.path.join(temp_dir, "predictions" + extension)
+            writer = ChunkWriter(path, promote_integers=True)
+            for chunk in chunks:
+                writer.append(chunk)
+            writer.close()
+            actual = read_table(path)["HBond"].to_numpy(dtype=np.float64)
+            if not np.allclose(actual, expected, equal_nan=True):
+                sys.exit(f"Comma cells of a later chunk are not averaged in {extension} output: {actual}")
+
+
+def best_time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the comma-separated cell parser")
+    parser.add_argument("--proteins", type=int, nargs="+", default=[10, 50, 200],
+                        help="Numbers of 235-residue proteins to generate")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats (best is reported)")
+    args = parser.parse_args()
+
+    check_text_dtypes()
+    check_streamed_chunks()
+
+    print(f"{'rows':>8} {'reference (s)':>14} {'vectorized (s)':>15} {'speedup':>8}  identical")
+    for n_proteins in args.proteins:
+        df = make_feature_table(n_proteins=n_proteins, seed=n_proteins)
+        columns = df.columns.difference(NON_NUMERICAL_COLUMNS)
+
+        reference_time, reference = best_time(lambda: average_comma_cells_reference(df, columns), args.repeats)
+        vectorized_time, vectorized = best_time(lambda: _average_comma_cells(df, columns), args.repeats)
+
+        expected = reference[columns].to_numpy(dtype=np.float64)
+        actual = vectorized[columns].to_numpy(dtype=np.float64)
+        identical = np.array_equal(expected, actual, equal_nan=True)
+
+        print(f"{len(df):>8} {reference_time:>14.3f} {vectorized_time:>15.3f} "
+              f"{reference_time / vectorized_time:>7.1f}x  {identical}")
+
+        if not identical:
+            sys.exit("Vectorized parser output differs from the reference implementation")
+
+
+if __name__ == "__main__":
+    main()
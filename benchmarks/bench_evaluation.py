@@ -0,0 +1,125 @@
+"""
+Parity and speed of the vectorized evaluation engine
+
+Draws bootstrap resamples of synthetic predictions and computes every metric
+of the report for each of them, once with one scikit-learn call per metric
+and resample and once with the sorted-array engine in evaluation.py. The
+metrics must agree within --tolerance; per-protein metrics are checked the
+same way:
+
+    python benchmarks/bench_evaluation.py --residues 20000 --bootstrap 1000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from sklearn.metrics import (accuracy_score, roc_auc_score, matthews_corrcoef, f1_score, recall_score,
+                             precision_score, confusion_matrix, average_precision_score)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from evaluation import METRICS, SortedScores, evaluate_predictions, per_protein_metrics
+
+
+def make_predictions(n_residues, n_proteins, seed):
+    # Probabilities rounded to 2 decimals so that ties are exercised
+    rng = np.random.default_rng(seed)
+    y = (rng.random(n_residues) < 0.15).astype(int)
+    y_prob = np.round(np.clip(0.35 * y + 0.65 * rng.random(n_residues), 0, 1), 2)
+    groups = rng.integers(0, n_proteins, n_residues).astype(str)
+    return y, y_prob, groups
+
+
+def sklearn_metrics(y, y_prob, threshold=0.5):
+    y_pred = (y_prob > threshold).astype(int)
+    tn, fp, fn, tp = confusion_matrix(y, y_pred, labels=[0, 1]).ravel()
+    return {
+        "Accuracy": accuracy_score(y, y_pred),
+        "AUC": roc_auc_score(y, y_prob),
+        "AUPRC": average_precision_score(y, y_prob),
+        "MCC": matthews_corrcoef(y, y_pred),
+        "F1": f1_score(y, y_pred, zero_division=0),
+        "Recall": recall_score(y, y_pred, zero_division=0),
+        "Precision": precision_score(y, y_pred, zero_division=0),
+        "Specificity": tn / (tn + fp)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized evaluation engine against scikit-learn")
+    parser.add_argument("--residues", type=int, default=20000, help="Synthetic residues")
+    parser.add_argument("--proteins", type=int, default=100, help="Synthetic proteins")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="Allowed metric difference")
+    parser.add_argument("--json", help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    y, y_prob, groups = make_predictions(args.residues, args.proteins, seed=0)
+    draws = np.random.default_rng(1).integers(0, len(y), size=(args.bootstrap, len(y)))
+
+    start_time = time.perf_counter()
+    reference = {name: np.empty(args.bootstrap) for name in METRICS}
+    for index, draw in enumerate(draws):
+        for name, value in sklearn_metrics(y[draw], y_prob[draw]).items():
+            reference[name][index] = value
+    sklearn_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    scores = SortedScores(y, y_prob)
+    position = np.empty(len(y), dtype=int)
+    position[scores.order] = np.arange(len(y))
+    engine = {name: [] for name in METRICS}
+    for start in range(0, args.bootstrap, 100):
+        block = draws[start:start + 100]
+        offsets = (np.arange(len(block)) * len(y))[:, None]
+        weights = np.bincount((position[block] + offsets).ravel(),
+                              minlength=len(block) * len(y)).reshape(len(block), len(y))
+        for name, values in scores.metrics(0.5, scores.cumulative_counts(weights)).items():
+            engine[name].append(values)
+    engine = {name: np.concatenate(values) for name, values in engine.items()}
+    engine_seconds = time.perf_counter() - start_time
+
+    difference = max(float(np.nanmax(np.abs(engine[name] - reference[name]))) for name in METRICS)
+    print(f"{args.bootstrap} bootstrap resamples of {len(y)} residues, {len(METRICS)} metrics each")
+    print(f"scikit-learn: {sklearn_seconds:8.2f}s")
+    print(f"engine:       {engine_seconds:8.2f}s ({sklearn_seconds / engine_seconds:.0f}x), "
+          f"max |difference| {difference:.2e}")
+
+    start_time = time.perf_counter()
+    evaluate_predictions(y, y_prob, groups=groups, n_bootstrap=args.bootstrap)
+    full_seconds = time.perf_counter() - start_time
+    print(f"Full evaluation (metrics, protein bootstrap, sweep, per protein): {full_seconds:.2f}s")
+
+    per_protein = per_protein_metrics(y, y_prob, groups).set_index('ProteinID')
+    protein_difference = 0.0
+    for protein in per_protein.index:
+        rows = groups == protein
+        if y[rows].min() == y[rows].max():
+            continue
+        expected = sklearn_metrics(y[rows], y_prob[rows])
+        protein_difference = max(protein_difference, *(abs(per_protein.loc[protein, name] - expected[name])
+                                                        for name in ("MCC", "AUC", "AUPRC")))
+    print(f"Per-protein MCC/AUC/AUPRC: max |difference| {protein_difference:.2e}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "residues": len(y),
+                "bootstrap": args.bootstrap,
+                "sklearn_seconds": sklearn_seconds,
+                "engine_seconds": engine_seconds,
+                "full_evaluation_seconds": full_seconds,
+                "max_difference": difference,
+                "max_protein_difference": protein_difference
+            }, f, indent=2)
+
+    if max(difference, protein_difference) > args.tolerance:
+        sys.exit(f"FAIL: metrics differ by {max(difference, protein_difference):.2e}, "
+                 f"tolerance is {args.tolerance:.0e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Wall time and selected features of the Boruta backends
+
+Runs the current selection (BorutaPy with a 200-tree RandomForest) and the
+LightGBM backend with early stopping on the same oversampled training matrix,
+reports their wall times and how far the selected feature sets agree, and
+times a rerun of the select stage that is served from the stage cache:
+
+    python benchmarks/bench_feature_selection.py --proteins 6
+    python benchmarks/bench_feature_selection.py --train-file ./train.xlsx --json boruta.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from synthetic import make_feature_table
+from caching import StageCache
+from preprocessing import load_data, fit_preprocessor, preprocess_data, oversample_data, feature_selection
+
+
+def timed_selection(X, y, feature_names, backend, max_iter, cache_dir):
+    # The matrix is the same for every call, so the parameters key the stage
+    stages = StageCache(("select",), cache_dir)
+    start_time = time.perf_counter()
+    _, selected_features, _ = stages.run(
+        "select", stages.key("select", backend, max_iter),
+        lambda: feature_selection(X, y, feature_names, backend=backend, max_iter=max_iter)
+    )
+    return time.perf_counter() - start_time, set(selected_features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Boruta feature selection backends")
+    parser.add_argument("--train-file", help="Training table (default: synthetic proteins with template labels)")
+    parser.add_argument("--proteins", type=int, default=6, help="Synthetic proteins (235 residues each)")
+    parser.add_argument("--max-iter", type=int, default=100, help="Boruta iterations")
+    parser.add_argument("--backends", nargs="+", default=["rf", "lightgbm"], help="Backends to compare")
+    parser.add_argument("--json", help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    df_train = load_data(args.train_file) if args.train_file else \
+        make_feature_table(n_proteins=args.proteins, seed=1, template_labels=True)
+    X_train, y_train, feature_names = preprocess_data(df_train, preprocessor=fit_preprocessor(df_train))
+    X_res, y_res = oversample_data(X_train, y_train)
+    print(f"Oversampled matrix: {X_res.shape[0]} residues x {X_res.shape[1]} features")
+
+    results = {"residues": int(X_res.shape[0]), "features": int(X_res.shape[1]), "backends": {}}
+    selections = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for backend in args.backends:
+            seconds, selected = timed_selection(X_res, y_res, feature_names, backend, args.max_iter, cache_dir)
+            cached_seconds, cached_selected = timed_selection(X_res, y_res, feature_names, backend,
+                                                              args.max_iter, cache_dir)
+            if cached_selected != selected:
+                sys.exit(f"FAIL: cached {backend} selection differs from the fresh one")
+
+            selections[backend] = selected
+            results["backends"][backend] = {
+                "seconds": seconds,
+                "cached_seconds": cached_seconds,
+                "selected": sorted(selected)
+            }
+            print(f"{backend:>8}: {seconds:8.2f}s, {len(selected)} features selected, "
+                  f"cached rerun {cached_seconds:.3f}s")
+
+    reference = args.backends[0]
+    for backend in args.backends[1:]:
+        shared = selections[reference] & selections[backend]
+        union = selections[reference] | selections[backend]
+        jaccard = len(shared) / len(union) if union else 1.0
+        speedup = results["backends"][reference]["seconds"] / results["backends"][backend]["seconds"]
+        results["backends"][backend].update({"jaccard_vs_" + reference: jaccard, "speedup_vs_" + reference: speedup})
+        print(f"\n{backend} vs {reference}: {speedup:.1f}x faster, Jaccard overlap {jaccard:.2f} "
+              f"({len(shared)} shared)")
+        print(f"  only {reference}: {', '.join(sorted(selections[reference] - shared)) or '-'}")
+        print(f"  only {backend}: {', '.join(sorted(selections[backend] - shared)) or '-'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Parity and speed of the Python GNM dynamics
+
+Runs gnm.py on feature extraction/protein_information/1WQW_A.pdb and compares
+msf, NTE5 and NTE15 with the MATLAB output in feature extraction/matlab/1WQW_A.xlsx
+within --tolerance. In that file the NTE5 sign of the 40 residues labelled
+allosteric in SNFA/1WQW_A_allfeature.xlsx is inverted, which no step of
+MAIN_gnmte_zjl.m does, so NTE5 is compared in magnitude and may differ in sign
+on exactly those residues. Then the cutoff selection and the dynamics are
+timed on synthetic proteins made of copies of 1WQW_A. The cutoffs are
+selected both by rebuilding and decomposing the Kirchhoff matrix per cutoff
+and then once more at the chosen one, as the MATLAB code does, and by the
+parallel sweep over sorted contacts (sweep_cutoffs), which must choose the
+same cutoff. The NTE columns are computed both as one set of full n x n
+matrices per tau (transfer_entropy) and in shared residue-pair tiles for all
+taus (net_transfer_entropy):
+
+    python benchmarks/bench_gnm.py --residues 250 500 1000 2000
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+import argparse
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURE_DIR = os.path.join(REPO_ROOT, "feature extraction")
+sys.path.insert(0, os.path.join(FEATURE_DIR, "gnm"))
+
+from gnm import (CUTOFFS, TAUS, bfactor_correlation, gnm_dynamics, gnm_modes, kirchhoff_matrix,
+                 mean_square_fluctuations, net_transfer_entropy, read_ca_atoms, sweep_cutoffs, transfer_entropy)
+
+PDB_PATH = os.path.join(FEATURE_DIR, "protein_information", "1WQW_A.pdb")
+# Offset of consecutive copies of 1WQW_A in the synthetic proteins, in units
+# of its extent along x, so that neighbouring copies are in contact
+DOMAIN_OFFSET = 0.8
+# Largest |netTE| below which NTE<tau> is normalized rounding noise and the
+# two routines are not compared (NTE15 of a single 250-residue domain)
+NTE_NOISE = 1e-12
+
+
+def make_protein(n_residues):
+    # Chain of 1WQW_A domains in contact, which keeps the soft modes of real
+    # proteins (uniform globules are so stiff that every mode has decayed by
+    # tau = 15 and netTE is rounding noise)
+    residues = read_ca_atoms(PDB_PATH)
+    domain = residues[['x', 'y', 'z']].to_numpy()
+    domain = domain - domain.mean(axis=0)
+    offset = DOMAIN_OFFSET * np.ptp(domain[:, 0])
+    n_domains = -(-n_residues // len(domain))
+    coordinates = np.vstack([domain + [index * offset, 0, 0] for index in range(n_domains)])
+    bfactors = np.tile(residues['bfactor'].to_numpy(), n_domains)
+    return coordinates[:n_residues], bfactors[:n_residues]
+
+
+def measured(function, *args):
+    # Result, seconds and peak traced memory (MB) of function(*args)
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def rebuilt_cutoffs(coordinates, bfactors):
+    # GNM_sel_zjl.m and MAIN_gnmte_zjl.m: one Kirchhoff matrix and eigh per
+    # cutoff, then both again at the chosen cutoff
+    correlations = {}
+    for cutoff in CUTOFFS:
+        eigenvalues, eigenvectors = gnm_modes(kirchhoff_matrix(coordinates, cutoff))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlations[cutoff] = bfactor_correlation(mean_square_fluctuations(eigenvalues, eigenvectors),
+                                                       bfactors)
+    # NaN correlations (unconnected residues) never win
+    cutoff = max(reversed(CUTOFFS), key=lambda cutoff: np.nan_to_num(correlations[cutoff], nan=-1.0))
+    return cutoff, correlations, gnm_modes(kirchhoff_matrix(coordinates, cutoff))
+
+
+def full_matrices(eigenvalues, eigenvectors):
+    # NTE<tau> and the largest netTE of every tau
+    results = {}
+    for tau in TAUS:
+        norm_ave, net_te, _ = transfer_entropy(eigenvalues, eigenvectors, tau)
+        results[tau] = norm_ave, net_te.max()
+    return results
+
+
+def check_parity(tolerance):
+    reference = pd.read_excel(os.path.join(FEATURE_DIR, "matlab", "1WQW_A.xlsx"))
+    labels = pd.read_excel(os.path.join(FEATURE_DIR, "SNFA", "1WQW_A_allfeature.xlsx"))['label'].to_numpy()
+    result = gnm_dynamics(PDB_PATH)
+
+    failures = []
+    if not (result['ResidueInfo'].tolist() == reference['ResidueInfo'].tolist()
+            and result['ResidueIndex'].tolist() == reference['ResidueIndex'].tolist()):
+        failures.append("residues")
+        return failures
+
+    for column in ['msf'] + [f'NTE{tau}' for tau in TAUS]:
+        actual, expected = result[column].to_numpy(), reference[column].to_numpy()
+        flipped = np.sign(actual) != np.sign(expected)
+        expected_flips = labels == 1 if column == 'NTE5' else np.zeros_like(flipped)
+        if column == 'NTE5':
+            actual, expected = np.abs(actual), np.abs(expected)
+        error = np.max(np.abs(actual - expected)) / np.max(np.abs(expected))
+        print(f"{column:>6}: max relative error {error:.2e}, sign differences {int(flipped.sum())}")
+        if error > tolerance or not np.array_equal(flipped, expected_flips):
+            failures.append(column)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the Python GNM dynamics against the MATLAB output")
+    parser.add_argument("--residues", type=int, nargs="+", default=[250, 500, 1000, 2000],
+                        help="Synthetic protein sizes")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="Maximum relative error")
+    parser.add_argument("--jobs", type=int, help="Threads of the cutoff sweep (default: number of CPUs)")
+    parser.add_argument("--json", help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    failures = check_parity(args.tolerance)
+
+    print(f"\n{'residues':>9} {'rebuilt cutoffs s':>18} {'sweep s':>8} {'full NTE s':>11} {'MB':>6} "
+          f"{'tiled NTE s':>12} {'MB':>6} {'max rel diff':>13}")
+    results = []
+    for n_residues in args.residues:
+        coordinates, bfactors = make_protein(n_residues)
+        start_time = time.perf_counter()
+        cutoff, correlations, _ = rebuilt_cutoffs(coordinates, bfactors)
+        rebuilt_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        sweep = sweep_cutoffs(coordinates, bfactors, n_jobs=args.jobs)
+        sweep_seconds = time.perf_counter() - start_time
+        eigenvalues, eigenvectors = sweep['eigenvalues'], sweep['eigenvectors']
+        if sweep['cutoff'] != cutoff or not np.allclose(list(sweep['correlations'].values()),
+                                                       list(correlations.values()), rtol=1e-9, equal_nan=True):
+            failures.append(f"cutoff sweep ({n_residues} residues)")
+
+        full, full_seconds, full_mb = measured(full_matrices, eigenvalues, eigenvectors)
+        tiled, tiled_seconds, tiled_mb = measured(net_transfer_entropy, eigenvalues, eigenvectors, TAUS)
+        difference = max((np.max(np.abs(tiled[tau] - full[tau][0])) / np.max(np.abs(full[tau][0]))
+                          for tau in TAUS if full[tau][1] > NTE_NOISE), default=np.nan)
+
+        print(f"{n_residues:>9} {rebuilt_seconds:18.3f} {sweep_seconds:8.3f} {full_seconds:11.3f} {full_mb:6.0f} "
+              f"{tiled_seconds:12.3f} {tiled_mb:6.0f} {difference:13.1e}")
+        results.append({"residues": n_residues, "cutoff": cutoff, "rebuilt_cutoffs_seconds": rebuilt_seconds,
+                        "sweep_seconds": sweep_seconds, "full_nte_seconds": full_seconds, "full_nte_mb": full_mb,
+                        "tiled_nte_seconds": tiled_seconds, "tiled_nte_mb": tiled_mb,
+                        "max_relative_difference": difference})
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"tolerance": args.tolerance, "parity_failures": failures, "results": results}, f, indent=2)
+
+    if failures:
+        sys.exit(f"FAIL: the Python GNM differs from the reference for {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
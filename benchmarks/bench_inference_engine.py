@@ -0,0 +1,145 @@
+"""
+Parity and throughput of the compiled inference engine
+
+Compares the array-backed engine against the sklearn VotingClassifier on the
+same residues: the soft-vote probabilities must agree within --tolerance and
+the labels must be identical (apart from residues whose probability is within
+the tolerance of 0.5). Throughput is reported in residues per second for the
+old path (predict + predict_proba) and for the engine's single pass:
+
+    python benchmarks/bench_inference_engine.py --proteins 200 --threads 4
+    python benchmarks/bench_inference_engine.py --model ./models/trained_model.pkl --selector ./models/feature_selector.pkl
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from synthetic import make_feature_table
+from preprocessing import fit_preprocessor, preprocess_data
+from inference_engine import compile_ensemble
+
+
+def train_synthetic_model():
+    from modeling import build_models
+
+    df_train = make_feature_table(n_proteins=4, seed=1)
+    preprocessor = fit_preprocessor(df_train)
+    X_train, y_train, _ = preprocess_data(df_train, preprocessor=preprocessor)
+    model = build_models()["ensemble"]
+    model.fit(X_train.values, y_train)
+    return model, None, preprocessor
+
+
+def load_model(model_path, selector_path):
+    import joblib
+
+    preprocessor_path = os.path.join(os.path.dirname(selector_path), "preprocessor.pkl")
+    preprocessor = joblib.load(preprocessor_path) if os.path.exists(preprocessor_path) else None
+    return joblib.load(model_path), joblib.load(selector_path), preprocessor
+
+
+def best_time(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
+
+
+def check_parity(name, proba, labels, reference_proba, reference_labels, tolerance):
+    difference = float(np.abs(proba - reference_proba).max()) if len(proba) else 0.0
+    near_tie = np.abs(reference_proba[:, 1] - 0.5) <= tolerance
+    mismatched = int(np.sum((labels != reference_labels) & ~near_tie))
+    print(f"{name}: max |probability difference| {difference:.2e}, label mismatches {mismatched}")
+
+    failures = []
+    if difference > tolerance:
+        failures.append(f"{name} probabilities differ by {difference:.2e}, tolerance is {tolerance:.0e}")
+    if mismatched:
+        failures.append(f"{name} labels differ on {mismatched} residues")
+    return difference, mismatched, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled inference engine against VotingClassifier")
+    parser.add_argument("--model", help="Trained model (default: train a small model on synthetic data)")
+    parser.add_argument("--selector", help="Feature selector saved with --model")
+    parser.add_argument("--proteins", type=int, default=100, help="Synthetic proteins to score (235 residues each)")
+    parser.add_argument("--threads", type=int, help="Engine threads (default: number of CPUs)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs, the best is reported")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="Allowed probability difference")
+    parser.add_argument("--numpy-rows", type=int, default=2000,
+                        help="Residues used to check the numpy fallback (it is much slower than numba)")
+    parser.add_argument("--json", help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    if args.model:
+        if not args.selector:
+            sys.exit("--selector is required with --model")
+        model, selector, preprocessor = load_model(args.model, args.selector)
+    else:
+        model, selector, preprocessor = train_synthetic_model()
+
+    df_input = make_feature_table(n_proteins=args.proteins, seed=3)
+    X_input, _, _ = preprocess_data(df_input, has_labels=False, preprocessor=preprocessor)
+    X_input = X_input.values if selector is None else selector.transform(X_input.values)
+    n_rows = len(X_input)
+
+    start_time = time.perf_counter()
+    engine = compile_ensemble(model, n_jobs=args.threads)
+    compile_seconds = time.perf_counter() - start_time
+    # Warm up numba before timing
+    engine.predict_proba(X_input[:2])
+    print(f"Compiled {engine.n_trees} trees ({len(engine.value)} nodes) in {compile_seconds:.2f}s, "
+          f"backend {engine.backend}")
+
+    sklearn_seconds, (reference_labels, reference_proba) = best_time(
+        lambda: (model.predict(X_input), model.predict_proba(X_input)), args.repeats)
+    engine_seconds, (labels, proba) = best_time(lambda: engine.predict_with_proba(X_input), args.repeats)
+
+    print(f"VotingClassifier predict + predict_proba: {sklearn_seconds:.3f}s, "
+          f"{n_rows / sklearn_seconds:,.0f} residues/s")
+    print(f"Compiled engine ({engine.backend}):           {engine_seconds:.3f}s, "
+          f"{n_rows / engine_seconds:,.0f} residues/s ({sklearn_seconds / engine_seconds:.1f}x)")
+
+    difference, _, failures = check_parity(engine.backend, proba, labels, reference_proba, reference_labels,
+                                  args.tolerance)
+    results = {
+        "residues": n_rows,
+        "trees": engine.n_trees,
+        "backend": engine.backend,
+        "compile_seconds": compile_seconds,
+        "sklearn_seconds": sklearn_seconds,
+        "engine_seconds": engine_seconds,
+        "sklearn_residues_per_second": n_rows / sklearn_seconds,
+        "engine_residues_per_second": n_rows / engine_seconds,
+        "max_probability_difference": difference,
+    }
+
+    if engine.backend == "numba" and args.numpy_rows > 0:
+        engine.use_numba = False
+        rows = slice(0, min(args.numpy_rows, n_rows))
+        numpy_labels, numpy_proba = engine.predict_with_proba(X_input[rows])
+        _, _, numpy_failures = check_parity("numpy", numpy_proba, numpy_labels, reference_proba[rows],
+                                            reference_labels[rows], args.tolerance)
+        failures.extend(numpy_failures)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Wall time, peak memory and throughput of every training and prediction stage
+
+Generates synthetic residue tables with the 1WQW_A_allfeature schema at
+several scales and times preprocess_data, oversample_data, feature_selection,
+grouped cross-validation, the ensemble fit, predict_single_file and
+evaluate_model. Every stage runs in a fresh worker process, so its peak RSS
+is not inflated by earlier stages; its outputs are handed to the next stage.
+Results are written as JSON and can be compared with an earlier run:
+
+    python benchmarks/bench_pipeline.py --proteins 4 16 64 --json bench_pipeline.json
+    python benchmarks/bench_pipeline.py --proteins 4 16 64 --compare baseline.json --max-slowdown 1.25
+    python benchmarks/bench_pipeline.py --compare baseline.json bench_pipeline.json
+
+With --lean the features are float32 arrays throughout (main.py --lean); the
+cross-validation and evaluation MCC are recorded so that a lean run can be
+compared with a default one for memory and metrics.
+"""
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ("preprocess", "oversample", "feature_selection", "cv", "fit", "predict", "evaluate")
+
+
+def _rss_mb():
+    # Current resident set size; /proc is Linux only, elsewhere ru_maxrss is the best we have
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    import resource
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _measured(function, args):
+    # Runs in the worker process
+    import resource
+    sys.path[:0] = [REPO_ROOT, os.path.dirname(os.path.abspath(__file__))]
+    baseline = _rss_mb()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Silence the stage, including LightGBM's C++ log and library warnings
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        os.dup2(devnull.fileno(), 2)
+        output = function(*args)
+    seconds = time.perf_counter() - start_time
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_seconds = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return output, {
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "baseline_rss_mb": baseline,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_stage(function, *args):
+    """
+    Run function(*args) in a new process and return (output, measurements)
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_measured, (function, args))
+
+
+def stage_preprocess(df, lean):
+    from preprocessing import fit_preprocessor, preprocess_data
+    preprocessor = fit_preprocessor(df, lean=lean)
+    X, y, feature_names = preprocess_data(df, preprocessor=preprocessor)
+    return preprocessor, X, y, feature_names
+
+
+def stage_oversample(X, y):
+    from preprocessing import oversample_data
+    return oversample_data(X, y)
+
+
+def stage_feature_selection(X_res, y_res, feature_names, backend, max_iter):
+    from preprocessing import feature_selection
+    return feature_selection(X_res, y_res, feature_names, backend=backend, max_iter=max_iter)
+
+
+def stage_cv(X_selected, y, groups, final_data):
+    # Grouped folds oversampled inside, plus the final fit, as in training
+    from modeling import build_models, cross_validate_grouped
+    from preprocessing import oversample_data
+    result = cross_validate_grouped(build_models()["ensemble"], X_selected, y, groups,
+                                    resample=oversample_data, final_data=final_data)
+    return float(result['fold_mcc'].mean())
+
+
+def stage_fit(X_train, y_train):
+    from modeling import build_models
+    model = build_models()["ensemble"]
+    model.fit(X_train, y_train)
+    return model
+
+
+def stage_predict(model_path, selector_path, input_file, output_file):
+    from main import predict_single_file
+    predict_single_file(model_path, selector_path, input_file, output_file)
+    return os.path.exists(output_file)
+
+
+def stage_evaluate(model, X, y, groups):
+    from evaluation import evaluate_model
+    result = evaluate_model(model, X, y, io.StringIO(), "Benchmark", groups=groups)
+    return result['metrics']['MCC']
+
+
+def benchmark_scale(n_proteins, residues_per_protein, backend, max_iter, work_dir, log, lean=False):
+    import joblib
+    import numpy as np
+    from synthetic import make_feature_table
+
+    df_train = make_feature_table(n_proteins=n_proteins, residues_per_protein=residues_per_protein,
+                                  seed=1, template_labels=True)
+    df_test = make_feature_table(n_proteins=n_proteins, residues_per_protein=residues_per_protein,
+                                 seed=2, template_labels=True)
+    n_residues = len(df_train)
+    results = []
+
+    def record(stage, rows, measurements, score=None):
+        measurements.update({
+            "stage": stage,
+            "proteins": n_proteins,
+            "residues": n_residues,
+            "rows": rows,
+            "rows_per_second": rows / measurements["seconds"] if measurements["seconds"] > 0 else None,
+            "mcc": score
+        })
+        results.append(measurements)
+        log(f"{n_proteins:>5} proteins  {stage:<18} {measurements['seconds']:9.2f}s "
+            f"{measurements['peak_rss_mb']:8.0f} MB peak  {measurements['rows_per_second'] or 0:12,.0f} rows/s")
+
+    (preprocessor, X_train, y_train, feature_names), measurements = run_stage(stage_preprocess, df_train, lean)
+    record("preprocess", n_residues, measurements)
+
+    (X_res, y_res), measurements = run_stage(stage_oversample, X_train, y_train)
+    record("oversample", n_residues, measurements)
+
+    (X_selected_res, _, selector), measurements = run_stage(stage_feature_selection, X_res, y_res,
+                                                            feature_names, backend, max_iter)
+    record("feature_selection", len(X_res), measurements)
+
+    X_selected = selector.transform(np.asarray(X_train))
+    groups = df_train['ProteinID'].astype(str).values
+    cv_mcc, measurements = run_stage(stage_cv, X_selected, y_train, groups, (X_selected_res, y_res))
+    record("cv", n_residues, measurements, cv_mcc)
+
+    model, measurements = run_stage(stage_fit, X_selected_res, y_res)
+    record("fit", len(X_res), measurements)
+
+    model_path = os.path.join(work_dir, "trained_model.pkl")
+    selector_path = os.path.join(work_dir, "feature_selector.pkl")
+    joblib.dump(model, model_path)
+    joblib.dump(selector, selector_path)
+    joblib.dump(preprocessor, os.path.join(work_dir, "preprocessor.pkl"))
+    input_file = os.path.join(work_dir, f"input_{n_proteins}.csv")
+    df_test.to_csv(input_file, index=False)
+    _, measurements = run_stage(stage_predict, model_path, selector_path, input_file,
+                                os.path.join(work_dir, f"predictions_{n_proteins}.csv"))
+    record("predict", len(df_test), measurements)
+
+    from preprocessing import preprocess_data
+    X_test, y_test, _ = preprocess_data(df_test, preprocessor=preprocessor)
+    test_mcc, measurements = run_stage(stage_evaluate, model, selector.transform(np.asarray(X_test)), y_test,
+                                       df_test['ProteinID'].astype(str).values)
+    record("evaluate", len(df_test), measurements, float(test_mcc))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, max_slowdown=None):
+    """
+    Print the time and memory ratio of every stage and scale present in both runs
+
+    Returns:
+        List of (stage, proteins, ratio) slower than max_slowdown
+    """
+    def index(run):
+        return {(entry["stage"], entry["proteins"]): entry for entry in run["results"]}
+
+    old, new = index(baseline), index(current)
+    def label(run):
+        return f"{run['meta'].get('commit') or '?'}{' (lean)' if run['meta'].get('lean') else ''}"
+
+    print(f"\nBaseline {label(baseline)} -> current {label(current)}")
+    print(f"{'stage':<18} {'proteins':>8} {'old s':>9} {'new s':>9} {'time':>7} {'old MB':>8} {'new MB':>8}")
+    regressions = []
+    for key in sorted(set(old) & set(new), key=lambda key: (STAGES.index(key[0]), key[1])):
+        ratio = new[key]["seconds"] / old[key]["seconds"] if old[key]["seconds"] > 0 else float("inf")
+        flag = ""
+        if max_slowdown is not None and ratio > max_slowdown:
+            regressions.append((key[0], key[1], ratio))
+            flag = "  SLOWER"
+        scores = ""
+        if old[key].get("mcc") is not None and new[key].get("mcc") is not None:
+            scores = f"  MCC {old[key]['mcc']:.4f} -> {new[key]['mcc']:.4f}"
+        print(f"{key[0]:<18} {key[1]:>8} {old[key]['seconds']:9.2f} {new[key]['seconds']:9.2f} {ratio:6.2f}x "
+              f"{old[key]['peak_rss_mb']:8.0f} {new[key]['peak_rss_mb']:8.0f}{flag}{scores}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the training and prediction pipeline stages")
+    parser.add_argument("--proteins", type=int, nargs="+", default=[4, 16, 64],
+                        help="Scales to run, in synthetic proteins")
+    parser.add_argument("--residues", type=int, default=235, help="Residues per synthetic protein")
+    parser.add_argument("--selection-backend", default="lightgbm", help="Boruta backend (rf is much slower)")
+    parser.add_argument("--max-iter", type=int, default=30, help="Boruta iterations")
+    parser.add_argument("--lean", action="store_true", help="Use float32 feature arrays (main.py --lean)")
+    parser.add_argument("--json", help="Write the measurements to this JSON file")
+    parser.add_argument("--compare", nargs="+", metavar="RUN",
+                        help="Baseline JSON to compare this run with, or two JSON files to compare without running")
+    parser.add_argument("--max-slowdown", type=float, help="With --compare, fail if a stage is this much slower")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        sys.exit("--compare takes a baseline file and optionally a second run")
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+    else:
+        current = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "residues_per_protein": args.residues,
+                "selection_backend": args.selection_backend,
+                "max_iter": args.max_iter,
+                "lean": args.lean
+            },
+            "results": []
+        }
+        with tempfile.TemporaryDirectory() as work_dir:
+            for n_proteins in args.proteins:
+                current["results"].extend(benchmark_scale(n_proteins, args.residues, args.selection_backend,
+                                                          args.max_iter, work_dir, print, args.lean))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(current, f, indent=2)
+        baseline = None
+        if args.compare:
+            with open(args.compare[0]) as f:
+                baseline = json.load(f)
+
+    if args.compare:
+        regressions = compare(baseline, current, args.max_slowdown)
+        if regressions:
+            for stage, proteins, ratio in regressions:
+                print(f"FAIL: {stage} at {proteins} proteins is {ratio:.2f}x slower")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
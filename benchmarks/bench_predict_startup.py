@@ -0,0 +1,142 @@
+"""
+Startup time and peak memory of `main.py --mode predict`
+
+Trains a small ensemble on a synthetic table in a temporary directory, then
+runs the prediction command in fresh processes and reports wall time and peak
+RSS, once with the separate pickles and once with the model bundle. The run fails if importing main.py loads a training- or plotting-only
+dependency, or if the optional limits are exceeded:
+
+    python benchmarks/bench_predict_startup.py --max-seconds 10 --max-rss-mb 800
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Modules that only training or SHAP plots need
+FORBIDDEN_MODULES = ['tensorflow', 'keras', 'shap', 'matplotlib', 'boruta', 'imblearn']
+
+IMPORT_PROBE = f"""
+import sys, json
+sys.path.insert(0, {REPO_ROOT!r})
+import main
+print(json.dumps(sorted(m for m in {FORBIDDEN_MODULES!r} if m in sys.modules)))
+"""
+
+
+def run_measured(command, cwd):
+    """
+    Run a command and return (wall seconds, peak RSS in MB, exit code, output)
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return elapsed, usage.ru_maxrss / scale, process.returncode, output.decode("utf-8", "replace")
+
+
+def prepare_model(work_dir):
+    import joblib
+    from preprocessing import fit_preprocessor, preprocess_data, FeatureMask
+    from modeling import build_models
+    from model_bundle import save_bundle
+    from synthetic import make_feature_table
+
+    df_train = make_feature_table(n_proteins=4, seed=1)
+    preprocessor = fit_preprocessor(df_train)
+    X_train, y_train, _ = preprocess_data(df_train, preprocessor=preprocessor)
+
+    model = build_models()["ensemble"]
+    model.fit(X_train.values, y_train)
+
+    models_dir = os.path.join(work_dir, "models")
+    os.makedirs(models_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(models_dir, "trained_model.pkl"))
+    joblib.dump(FeatureMask([True] * X_train.shape[1]), os.path.join(models_dir, "feature_selector.pkl"))
+    joblib.dump(preprocessor, os.path.join(models_dir, "preprocessor.pkl"))
+    save_bundle(os.path.join(models_dir, "bundle"), model, FeatureMask([True] * X_train.shape[1]), preprocessor)
+
+    input_file = os.path.join(work_dir, "input_allfeature.csv")
+    make_feature_table(n_proteins=1, seed=2).to_csv(input_file, index=False)
+    return input_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prediction startup time and memory")
+    parser.add_argument("--repeats", type=int, default=3, help="Prediction runs (best time, max RSS reported)")
+    parser.add_argument("--max-seconds", type=float, help="Fail if the best prediction run is slower")
+    parser.add_argument("--max-rss-mb", type=float, help="Fail if peak RSS of a prediction run is higher")
+    parser.add_argument("--json", help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    failures = []
+
+    import_seconds, import_rss, returncode, output = run_measured([sys.executable, "-c", IMPORT_PROBE], REPO_ROOT)
+    if returncode != 0:
+        sys.exit(f"Importing main.py failed:\n{output}")
+    loaded = json.loads(output.strip().splitlines()[-1])
+    print(f"import main: {import_seconds:.2f}s, peak RSS {import_rss:.0f} MB")
+    if loaded:
+        failures.append(f"importing main.py loads training/plotting modules: {', '.join(loaded)}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_file = prepare_model(work_dir)
+        command = [sys.executable, os.path.join(REPO_ROOT, "main.py"), "--mode", "predict",
+                   "--input", input_file, "--output", os.path.join(work_dir, "predictions.csv")]
+
+        def measure(command):
+            timings, peaks = [], []
+            for _ in range(args.repeats):
+                elapsed, rss, returncode, output = run_measured(command, work_dir)
+                if returncode != 0 or "Error" in output:
+                    sys.exit(f"Prediction run failed:\n{output}")
+                timings.append(elapsed)
+                peaks.append(rss)
+            return timings, peaks
+
+        timings, peaks = measure(command)
+        # The first bundle run also compiles the numba kernel for read-only arrays when numba is installed
+        run_measured(command + ["--model", "models/bundle"], work_dir)
+        bundle_timings, bundle_peaks = measure(command + ["--model", "models/bundle"])
+
+    print(f"main.py --mode predict: best {min(timings):.2f}s, peak RSS {max(peaks):.0f} MB "
+          f"over {args.repeats} runs")
+    print(f"main.py --mode predict --model models/bundle: best {min(bundle_timings):.2f}s, "
+          f"peak RSS {max(bundle_peaks):.0f} MB over {args.repeats} runs")
+
+    if args.max_seconds is not None and min(timings) > args.max_seconds:
+        failures.append(f"prediction took {min(timings):.2f}s, limit is {args.max_seconds:.2f}s")
+    if args.max_rss_mb is not None and max(peaks) > args.max_rss_mb:
+        failures.append(f"prediction peak RSS {max(peaks):.0f} MB, limit is {args.max_rss_mb:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "import_seconds": import_seconds,
+                "import_peak_rss_mb": import_rss,
+                "predict_seconds": timings,
+                "predict_peak_rss_mb": peaks,
+                "bundle_predict_seconds": bundle_timings,
+                "bundle_predict_peak_rss_mb": bundle_peaks,
+                "forbidden_modules_loaded": loaded
+            }, f, indent=2)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Speed and parity of the SNFA neighbourhood means
+
+Builds synthetic proteins of several sizes (residues at protein density in a
+globule, coordinates rounded like PDB files, so equal distances occur) and
+computes the space_<feature>_7nn means with the per-residue full sort of the
+original script and with the KD-tree engine. The two must be identical; the
+example protein 1WQW_A is checked the same way. Then all neighbourhoods of
+--ks, --radii and every aggregator are computed in one pass and compared with
+one pass per neighbourhood. Finally a table of --proteins proteins goes
+through add_spatial_features in this process and with --jobs worker processes:
+
+    python benchmarks/bench_snfa.py --residues 250 1000 4000 16000 --ks 7 14 28 --radii 8 12 --jobs 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNFA_DIR = os.path.join(REPO_ROOT, "feature extraction", "SNFA")
+sys.path.insert(0, SNFA_DIR)
+
+from SNFA import (AGGREGATORS, FEATURE_COLUMNS, add_spatial_features, neighbor_means, neighbor_means_loop,
+                  spatial_aggregates)
+
+# Volume per residue in a folded protein, cubic Angstrom
+RESIDUE_VOLUME = 130.0
+
+
+def make_protein(n_residues, decimals, seed):
+    # Residues uniformly in a sphere holding n_residues at protein density
+    rng = np.random.default_rng(seed)
+    radius = (3 * n_residues * RESIDUE_VOLUME / (4 * np.pi)) ** (1 / 3)
+    directions = rng.normal(size=(n_residues, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    coordinates = np.round(directions * radius * rng.random((n_residues, 1)) ** (1 / 3), decimals)
+    return coordinates, rng.normal(size=(n_residues, len(FEATURE_COLUMNS)))
+
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the KD-tree SNFA engine against the per-residue sort")
+    parser.add_argument("--residues", type=int, nargs="+", default=[250, 1000, 4000, 16000],
+                        help="Synthetic protein sizes")
+    parser.add_argument("--decimals", type=int, default=3, help="Coordinate decimals (PDB files have 3)")
+    parser.add_argument("--neighbors", type=int, default=7, help="Neighbours averaged")
+    parser.add_argument("--ks", type=int, nargs="+", default=[7, 14, 28], help="k of the one-pass comparison")
+    parser.add_argument("--radii", type=float, nargs="+", default=[8.0, 12.0],
+                        help="Radii (Angstrom) of the one-pass comparison")
+    parser.add_argument("--proteins", type=int, default=200,
+                        help="Proteins of 100 to 1000 residues in the table benchmark")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--json", help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    mismatches = []
+    print(f"{'residues':>9} {'loop s':>9} {'kd-tree s':>10} {'speedup':>8}  identical")
+    for n_residues in args.residues:
+        coordinates, features = make_protein(n_residues, args.decimals, seed=n_residues)
+        expected, loop_seconds = timed(neighbor_means_loop, coordinates, features, args.neighbors)
+        actual, tree_seconds = timed(neighbor_means, coordinates, features, args.neighbors)
+        identical = np.array_equal(expected, actual)
+        if not identical:
+            mismatches.append(f"{n_residues} residues")
+        print(f"{n_residues:>9} {loop_seconds:9.3f} {tree_seconds:10.4f} {loop_seconds / tree_seconds:7.0f}x  {identical}")
+        results.append({"residues": n_residues, "loop_seconds": loop_seconds, "kd_tree_seconds": tree_seconds,
+                        "identical": identical})
+
+    example = os.path.join(SNFA_DIR, "1WQW_A_allfeature.xlsx")
+    if os.path.exists(example):
+        df = pd.read_excel(example)
+        columns = [col for col in FEATURE_COLUMNS if col in df.columns]
+        coordinates = df[['x', 'y', 'z']].values
+        features = df[columns].apply(pd.to_numeric, errors='coerce').fillna(0).values
+        identical = np.array_equal(neighbor_means_loop(coordinates, features, args.neighbors),
+                                   neighbor_means(coordinates, features, args.neighbors))
+        if not identical:
+            mismatches.append("1WQW_A")
+        print(f"1WQW_A ({len(df)} residues, 1-decimal coordinates): identical {identical}")
+
+    n_statistics = (len(args.ks) + len(args.radii)) * len(AGGREGATORS)
+    print(f"\n{n_statistics} neighbourhood statistics (k {args.ks}, radii {args.radii}, {', '.join(AGGREGATORS)})")
+    print(f"{'residues':>9} {'one pass s':>11} {'per neighbourhood s':>20} {'largest only s':>15}")
+    one_pass_results = []
+    for n_residues in args.residues:
+        coordinates, features = make_protein(n_residues, args.decimals, seed=n_residues)
+        _, one_pass = timed(spatial_aggregates, coordinates, features, args.ks, args.radii, AGGREGATORS)
+        start_time = time.perf_counter()
+        for k in args.ks:
+            spatial_aggregates(coordinates, features, (k,), (), AGGREGATORS)
+        for radius in args.radii:
+            spatial_aggregates(coordinates, features, (), (radius,), AGGREGATORS)
+        separate = time.perf_counter() - start_time
+        # The single largest neighbourhood with one statistic, the floor of the one-pass cost
+        _, largest = timed(spatial_aggregates, coordinates, features, (), (max(args.radii),), ('mean',))
+        print(f"{n_residues:>9} {one_pass:11.3f} {separate:20.3f} {largest:15.3f}")
+        one_pass_results.append({"residues": n_residues, "one_pass_seconds": one_pass,
+                                 "separate_seconds": separate, "largest_only_seconds": largest})
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for index, n_residues in enumerate(rng.integers(100, 1000, size=args.proteins)):
+        coordinates, features = make_protein(int(n_residues), args.decimals, seed=index)
+        frame = pd.DataFrame(features, columns=FEATURE_COLUMNS)
+        frame[['x', 'y', 'z']] = coordinates
+        frame.insert(0, 'ProteinID', f"P{index}")
+        frames.append(frame)
+    table = pd.concat(frames, ignore_index=True)
+    settings = dict(ks=args.ks, radii=args.radii, aggregators=AGGREGATORS)
+    sequential, sequential_seconds = timed(lambda: add_spatial_features(table, n_jobs=1, **settings))
+    parallel, parallel_seconds = timed(lambda: add_spatial_features(table, n_jobs=args.jobs, **settings))
+    table_identical = sequential.equals(parallel)
+    if not table_identical:
+        mismatches.append("the worker pool table")
+    print(f"\nTable of {args.proteins} proteins, {len(table)} residues: {sequential_seconds:.2f} s in process, "
+          f"{parallel_seconds:.2f} s with {args.jobs} workers, identical {table_identical}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"neighbors": args.neighbors, "decimals": args.decimals, "results": results,
+                       "ks": args.ks, "radii": args.radii, "one_pass": one_pass_results,
+                       "table": {"proteins": args.proteins, "residues": len(table), "jobs": args.jobs,
+                                 "sequential_seconds": sequential_seconds, "parallel_seconds": parallel_seconds,
+                                 "identical": table_identical}}, f, indent=2)
+
+    if mismatches:
+        sys.exit(f"FAIL: the KD-tree means differ from the per-residue sort for {', '.join(mismatches)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import functools
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_PATH = os.path.join(REPO_ROOT, "feature extraction", "SNFA", "1WQW_A_allfeature.xlsx")
+
+# Columns copied from the template as they are instead of being jittered
+FIXED_COLUMNS = ['ProteinID', 'Residue Number', 'ResidueInfo', 'label', 'STRUCTURE']
+
+
+@functools.lru_cache(maxsize=1)
+def load_template():
+    return pd.read_excel(TEMPLATE_PATH)
+
+
+def make_feature_table(n_proteins=10, residues_per_protein=235, seed=0, template_labels=False):
+    """
+    Synthetic residue table with the 1WQW_A_allfeature column schema
+
+    Rows are resampled from the bundled 1WQW_A example, numeric features get
+    Gaussian noise scaled to each column's spread and text columns (STRUCTURE,
+    the comma-separated hydrogen bond energies) are kept as sampled. Labels are
+    random unless template_labels is set, which keeps the label of each sampled
+    row so the features carry real signal.
+    """
+    template = load_template()
+    rng = np.random.default_rng(seed)
+    n_rows = n_proteins * residues_per_protein
+
+    df = template.iloc[rng.integers(0, len(template), n_rows)].reset_index(drop=True)
+
+    numeric_columns = [col for col in df.columns
+                       if col not in FIXED_COLUMNS and pd.api.types.is_numeric_dtype(df[col])]
+    spread = template[numeric_columns].std().fillna(0).to_numpy()
+    noise = rng.normal(0.0, 0.05, size=(n_rows, len(numeric_columns))) * spread
+    df[numeric_columns] = df[numeric_columns].to_numpy(dtype=np.float64) + noise
+
+    df['ProteinID'] = np.repeat([f"SYN{i:05d}_A" for i in range(n_proteins)], residues_per_protein)
+    df['Residue Number'] = np.tile(np.arange(1, residues_per_protein + 1), n_proteins)
+
+    # Keep roughly the allosteric rate of the template
+    if not template_labels:
+        df['label'] = (rng.random(n_rows) < template['label'].mean()).astype(int)
+
+    return df
@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import functools
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Results of slow training steps are stored under this directory by default
+DEFAULT_CACHE_DIR = "cache"
+
+
+def _update_hash(digest, obj):
+    # Feed a stable description of obj into the hash
+    if isinstance(obj, pd.DataFrame):
+        _update_hash(digest, list(map(str, obj.columns)))
+        _update_hash(digest, obj.to_numpy())
+    elif isinstance(obj, pd.Series):
+        _update_hash(digest, obj.to_numpy())
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            obj = obj.astype(str)
+        array = np.ascontiguousarray(obj)
+        digest.update(f"ndarray:{array.dtype.str}:{array.shape}".encode())
+        digest.update(array.tobytes())
+    elif isinstance(obj, (list, tuple)):
+        digest.update(f"{type(obj).__name__}:{len(obj)}".encode())
+        for item in obj:
+            _update_hash(digest, item)
+    elif isinstance(obj, dict):
+        digest.update(f"dict:{len(obj)}".encode())
+        for key in sorted(obj, key=str):
+            _update_hash(digest, str(key))
+            _update_hash(digest, obj[key])
+    elif hasattr(obj, "get_params"):
+        # Estimators are described by their class and (nested) parameters
+        params = obj.get_params(deep=False)
+        digest.update(f"estimator:{type(obj).__module__}.{type(obj).__name__}".encode())
+        _update_hash(digest, params)
+    elif isinstance(obj, functools.partial):
+        _update_hash(digest, [obj.func, list(obj.args), obj.keywords])
+    elif callable(obj):
+        digest.update(f"callable:{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', repr(obj))}".encode())
+    else:
+        digest.update(json.dumps(obj, sort_keys=True, default=repr).encode())
+
+
+def fingerprint(*objects):
+    """
+    Hash arrays, tables, estimators and plain parameters into a cache key
+
+    Returns:
+        Hex digest that changes whenever any of the objects changes
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        _update_hash(digest, obj)
+    return digest.hexdigest()[:32]
+
+
+def cache_path(cache_dir, stage, key):
+    return os.path.join(cache_dir, stage, f"{key}.joblib")
+
+
+def load_cached(cache_dir, stage, key):
+    """
+    Load a cached result, or return None when caching is off or there is no entry
+    """
+    if cache_dir is None:
+        return None
+    path = cache_path(cache_dir, stage, key)
+    if not os.path.exists(path):
+        return None
+
+    import joblib
+    try:
+        return joblib.load(path)
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable cache entry {path}: {str(e)}")
+        return None
+
+
+def save_cached(cache_dir, stage, key, value):
+    """
+    Store a result in the cache; written to a temporary file first so an
+    interrupted run never leaves a truncated entry behind
+    """
+    if cache_dir is None:
+        return None
+
+    import joblib
+    path = cache_path(cache_dir, stage, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        joblib.dump(value, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+def file_fingerprint(path, block_size=1 << 20):
+    """
+    Hash the name and contents of a file, so a changed input invalidates its stages
+    """
+    digest = hashlib.sha256()
+    digest.update(os.path.basename(path).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+class StageCache:
+    """
+    Run the named stages of a pipeline, reusing outputs cached under their key
+
+    A stage's key is a hash of its inputs and parameters, normally including
+    the key of the stage it reads from, so a change anywhere invalidates every
+    stage downstream of it. Stages before from_stage must come from the cache,
+    from_stage and everything after it are recomputed, and the pipeline stops
+    after until_stage. Stages run with key None produce files rather than
+    values and are never cached. Bump version when the outputs of the stages
+    change shape, so older cache entries are not reused.
+    """
+
+    def __init__(self, stages, cache_dir=None, from_stage=None, until_stage=None, version=1):
+        for stage in (from_stage, until_stage):
+            if stage is not None and stage not in stages:
+                raise ValueError(f"Unknown stage '{stage}', expected one of {', '.join(stages)}")
+        if from_stage is not None and cache_dir is None:
+            raise ValueError("Resuming from a stage needs the cache directory")
+        self.stages = tuple(stages)
+        self.cache_dir = cache_dir
+        self.from_index = self.stages.index(from_stage) if from_stage is not None else 0
+        self.until_stage = until_stage
+        self.version = version
+        # stage -> (status, key, seconds) in the order the stages ran
+        self.status = {}
+
+    def key(self, stage, *inputs):
+        # Version 1 keys match the keys written before stages were versioned
+        if self.version == 1:
+            return fingerprint(stage, *inputs)
+        return fingerprint(stage, self.version, *inputs)
+
+    def run(self, stage, key, compute):
+        """
+        Return the cached output of stage under key, or compute and cache it
+
+        Returns None for file-producing stages skipped before from_stage.
+        """
+        from instrumentation import span
+        with span(f"stage:{stage}"):
+            return self._run(stage, key, compute)
+
+    def _run(self, stage, key, compute):
+        start_time = time.perf_counter()
+        before_start = self.stages.index(stage) < self.from_index
+        if key is None:
+            if before_start:
+                self.status[stage] = ("skipped", None, 0.0)
+                return None
+            value = compute()
+            self.status[stage] = ("ran", None, time.perf_counter() - start_time)
+            return value
+
+        if not before_start and self.from_index > 0:
+            value = None
+        else:
+            value = load_cached(self.cache_dir, stage, key)
+        if value is not None:
+            self.status[stage] = ("cached", key, time.perf_counter() - start_time)
+            return value
+        if before_start:
+            raise ValueError(f"Stage '{stage}' has no cached result for these inputs, "
+                             f"cannot resume from '{self.stages[self.from_index]}'")
+
+        value = compute()
+        save_cached(self.cache_dir, stage, key, value)
+        self.status[stage] = ("computed", key, time.perf_counter() - start_time)
+        return value
+
+    def stop_after(self, stage):
+        return stage == self.until_stage
+
+    def report(self):
+        # One line per stage that was reached, e.g. "select: cached [3f2a...] 0.05s"
+        lines = []
+        for stage in self.stages:
+            if stage not in self.status:
+                lines.append(f"{stage}: not run")
+                continue
+            status, key, seconds = self.status[stage]
+            key_text = f" [{key[:12]}]" if key else ""
+            lines.append(f"{stage}: {status}{key_text} {seconds:.2f}s")
+        return lines
@@ -1,32 +1,317 @@
-from sklearn.metrics import (accuracy_score, roc_auc_score, matthews_corrcoef,
-                             f1_score, recall_score, precision_score,
-                             confusion_matrix, classification_report,
-                             average_precision_score)
-
-
-def evaluate_model(model, X, y, file_obj, set_name="Dataset"):
-    y_pred = model.predict(X)
-    y_prob = model.predict_proba(X)[:, 1]
-
-    metrics = {
-        "Accuracy": accuracy_score(y, y_pred),
-        "AUC": roc_auc_score(y, y_prob),
-        "AUPRC": average_precision_score(y, y_prob),
-        "MCC": matthews_corrcoef(y, y_pred),
-        "F1": f1_score(y, y_pred),
-        "Recall": recall_score(y, y_pred),
-        "Precision": precision_score(y, y_pred)
+import os
+import json
+import importlib.util
+import numpy as np
+import pandas as pd
+from sklearn.metrics import classification_report
+from instrumentation import traced
+
+# Metrics of the text report, in order
+METRICS = ("Accuracy", "AUC", "AUPRC", "MCC", "F1", "Recall", "Precision", "Specificity")
+PROTEIN_METRICS = ("MCC", "AUC", "AUPRC", "F1", "Recall", "Precision")
+
+
+def predict_probabilities(model, X):
+    """
+    Predicted labels and class 1 probabilities from a single pass over X
+    """
+    if hasattr(model, 'predict_with_proba'):
+        labels, proba = model.predict_with_proba(X)
+    else:
+        proba = model.predict_proba(X)
+        labels = model.classes_[np.argmax(proba, axis=1)]
+    return np.asarray(labels), np.asarray(proba)[:, 1]
+
+
+def _divide(numerator, denominator):
+    # Elementwise ratio that is 0 where the denominator is 0, like sklearn's zero_division
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float),
+                                                 np.asarray(denominator, dtype=float))
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator != 0)
+
+
+def count_metrics(tp, fp, tn, fn):
+    """
+    Threshold metrics from confusion counts (scalars or arrays of any shape)
+    """
+    tp, fp, tn, fn = (np.asarray(count, dtype=float) for count in (tp, fp, tn, fn))
+    mcc_denominator = np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+    return {
+        "Accuracy": _divide(tp + tn, tp + fp + tn + fn),
+        "MCC": _divide(tp * tn - fp * fn, mcc_denominator),
+        "F1": _divide(2 * tp, 2 * tp + fp + fn),
+        "Recall": _divide(tp, tp + fn),
+        "Precision": _divide(tp, tp + fp),
+        "Specificity": _divide(tn, tn + fp)
+    }
+
+
+class SortedScores:
+    """
+    Labels in order of decreasing probability, shared by every metric
+
+    With the scores sorted once, predicting "positive above a threshold" marks
+    a prefix of the array, so confusion counts at any threshold, ROC AUC and
+    average precision all follow from cumulative sums of the (weighted)
+    positives and negatives. Weights are bootstrap counts per position.
+    """
+
+    def __init__(self, y_true, y_prob):
+        order = np.argsort(-np.asarray(y_prob, dtype=float), kind='mergesort')
+        self.order = order
+        self.scores = np.asarray(y_prob, dtype=float)[order]
+        self.labels = np.asarray(y_true).astype(int)[order]
+        # Last position of every run of tied scores
+        self.tie_ends = np.flatnonzero(np.r_[self.scores[1:] != self.scores[:-1], True])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def cumulative_counts(self, weights=None):
+        # (..., n + 1) cumulative positives and negatives, starting at 0
+        labels = self.labels.astype(float)
+        weights = np.ones(len(labels)) if weights is None else np.asarray(weights, dtype=float)
+        positives = np.cumsum(weights * labels, axis=-1)
+        negatives = np.cumsum(weights * (1 - labels), axis=-1)
+        zeros = np.zeros(positives.shape[:-1] + (1,))
+        return np.concatenate([zeros, positives], axis=-1), np.concatenate([zeros, negatives], axis=-1)
+
+    def n_above(self, thresholds):
+        # Number of residues predicted positive (probability > threshold)
+        return np.searchsorted(-self.scores, -np.asarray(thresholds, dtype=float), side='left')
+
+    def confusion_counts(self, thresholds, cumulative=None):
+        positives, negatives = cumulative if cumulative is not None else self.cumulative_counts()
+        k = self.n_above(thresholds)
+        tp, fp = positives[..., k], negatives[..., k]
+        total_positive, total_negative = positives[..., -1:], negatives[..., -1:]
+        if np.ndim(thresholds) == 0:
+            total_positive, total_negative = total_positive[..., 0], total_negative[..., 0]
+        return tp, fp, total_negative - fp, total_positive - tp
+
+    def ranking_metrics(self, cumulative=None):
+        """
+        ROC AUC (trapezoidal, ties counted half) and average precision; NaN
+        when the labels hold a single class
+        """
+        positives, negatives = cumulative if cumulative is not None else self.cumulative_counts()
+        tp = positives[..., self.tie_ends + 1]
+        fp = negatives[..., self.tie_ends + 1]
+        previous_tp = np.concatenate([np.zeros(tp.shape[:-1] + (1,)), tp[..., :-1]], axis=-1)
+        previous_fp = np.concatenate([np.zeros(fp.shape[:-1] + (1,)), fp[..., :-1]], axis=-1)
+        total_positive, total_negative = tp[..., -1], fp[..., -1]
+
+        area = np.sum((fp - previous_fp) * (tp + previous_tp) / 2, axis=-1)
+        precision = _divide(tp, tp + fp)
+        average_precision = np.sum((tp - previous_tp) * precision, axis=-1)
+        defined = (total_positive > 0) & (total_negative > 0)
+        auc = np.where(defined, _divide(area, total_positive * total_negative), np.nan)
+        auprc = np.where(total_positive > 0, _divide(average_precision, total_positive), np.nan)
+        return {"AUC": auc, "AUPRC": auprc}
+
+    def metrics(self, threshold=0.5, cumulative=None):
+        cumulative = cumulative if cumulative is not None else self.cumulative_counts()
+        values = count_metrics(*self.confusion_counts(threshold, cumulative))
+        values.update(self.ranking_metrics(cumulative))
+        return {name: values[name] for name in METRICS}
+
+
+def threshold_sweep(sorted_scores, thresholds=None):
+    """
+    Confusion counts and metrics at every threshold, from one cumulative pass
+
+    Returns:
+        DataFrame with one row per threshold
+    """
+    thresholds = np.round(np.linspace(0, 1, 101), 2) if thresholds is None else np.asarray(thresholds)
+    tp, fp, tn, fn = sorted_scores.confusion_counts(thresholds)
+    sweep = pd.DataFrame({'Threshold': thresholds, 'TP': tp.astype(int), 'FP': fp.astype(int),
+                          'TN': tn.astype(int), 'FN': fn.astype(int)})
+    for name, values in count_metrics(tp, fp, tn, fn).items():
+        sweep[name] = values
+    return sweep
+
+
+@traced("per_protein_metrics", rows=lambda y_true, *args, **kwargs: len(y_true))
+def per_protein_metrics(y_true, y_prob, groups, threshold=0.5):
+    """
+    MCC, AUC, AUPRC and the threshold metrics of every protein
+
+    One lexicographic sort orders the residues by protein and decreasing
+    probability, after which every protein is a contiguous sorted segment.
+    """
+    y_true = np.asarray(y_true).astype(int)
+    y_prob = np.asarray(y_prob, dtype=float)
+    proteins, codes = np.unique(np.asarray(groups).astype(str), return_inverse=True)
+    order = np.lexsort((-y_prob, codes))
+    boundaries = np.searchsorted(codes[order], np.arange(len(proteins) + 1))
+
+    rows = []
+    for index, protein in enumerate(proteins):
+        segment = order[boundaries[index]:boundaries[index + 1]]
+        scores = SortedScores(y_true[segment], y_prob[segment])
+        values = scores.metrics(threshold)
+        row = {'ProteinID': protein, 'Residues': len(segment), 'Positives': int(y_true[segment].sum())}
+        row.update({name: float(values[name]) for name in PROTEIN_METRICS})
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['ProteinID', 'Residues', 'Positives'] + list(PROTEIN_METRICS))
+
+
+@traced("bootstrap_metrics", rows=lambda sorted_scores, *args, **kwargs: len(sorted_scores))
+def bootstrap_metrics(sorted_scores, threshold=0.5, groups=None, n_bootstrap=1000, block_size=100,
+                      random_state=42):
+    """
+    Bootstrap distribution of every metric, computed a block of resamples at a time
+
+    A resample is a vector of counts over the sorted residues, so each block
+    is a single (block_size x residues) cumulative sum instead of thousands of
+    metric calls. With groups, whole proteins are resampled (residues of a
+    protein are not independent); otherwise single residues.
+
+    Returns:
+        Dict of metric name -> array of n_bootstrap values
+    """
+    rng = np.random.default_rng(random_state)
+    n = len(sorted_scores)
+    if groups is not None:
+        _, codes = np.unique(np.asarray(groups).astype(str)[sorted_scores.order], return_inverse=True)
+        n_units = codes.max() + 1
+    else:
+        codes, n_units = None, n
+
+    samples = {name: [] for name in METRICS}
+    for start in range(0, n_bootstrap, block_size):
+        block = min(block_size, n_bootstrap - start)
+        draws = rng.integers(0, n_units, size=(block, n_units))
+        offsets = (np.arange(block) * n_units)[:, None]
+        counts = np.bincount((draws + offsets).ravel(), minlength=block * n_units).reshape(block, n_units)
+        weights = counts if codes is None else counts[:, codes]
+        values = sorted_scores.metrics(threshold, sorted_scores.cumulative_counts(weights))
+        for name in METRICS:
+            samples[name].append(values[name])
+    return {name: np.concatenate(values) for name, values in samples.items()}
+
+
+def evaluate_predictions(y_true, y_prob, groups=None, threshold=0.5, n_bootstrap=1000, confidence=0.95,
+                         random_state=42):
+    """
+    Every evaluation output from one set of probabilities
+
+    Returns:
+        Dict with metrics, confusion_matrix, confidence_intervals, best_threshold,
+        threshold_sweep (DataFrame) and per_protein (DataFrame, None without groups)
+    """
+    y_true = np.asarray(y_true).astype(int)
+    scores = SortedScores(y_true, y_prob)
+    cumulative = scores.cumulative_counts()
+    metrics = {name: float(value) for name, value in scores.metrics(threshold, cumulative).items()}
+    tp, fp, tn, fn = (int(count) for count in scores.confusion_counts(threshold, cumulative))
+
+    intervals = {}
+    if n_bootstrap:
+        samples = bootstrap_metrics(scores, threshold, groups, n_bootstrap, random_state=random_state)
+        tail = (1 - confidence) / 2 * 100
+        for name, values in samples.items():
+            low, high = np.nanpercentile(values, [tail, 100 - tail]) if np.any(~np.isnan(values)) \
+                else (np.nan, np.nan)
+            intervals[name] = [float(low), float(high)]
+
+    sweep = threshold_sweep(scores)
+    best = sweep.loc[sweep['MCC'].idxmax()]
+    return {
+        'threshold': threshold,
+        'metrics': metrics,
+        'confusion_matrix': [[tn, fp], [fn, tp]],
+        'confidence': confidence,
+        'n_bootstrap': n_bootstrap,
+        'bootstrap_unit': 'protein' if groups is not None else 'residue',
+        'confidence_intervals': intervals,
+        'best_threshold': {'Threshold': float(best['Threshold']), 'MCC': float(best['MCC'])},
+        'threshold_sweep': sweep,
+        'per_protein': per_protein_metrics(y_true, y_prob, groups, threshold) if groups is not None else None
     }
 
-    tn, fp, fn, tp = confusion_matrix(y, y_pred).ravel()
-    metrics["Specificity"] = tn / (tn + fp)
+
+def save_evaluation(result, output_prefix):
+    """
+    Write <prefix>.json with the metrics and intervals, and the per-protein
+    metrics and threshold sweep as <prefix>_per_protein / <prefix>_thresholds
+    tables (Parquet, or CSV when pyarrow is not installed)
+    """
+    from table_io import write_table
+    os.makedirs(os.path.dirname(output_prefix) or '.', exist_ok=True)
+    extension = '.parquet' if importlib.util.find_spec('pyarrow') is not None else '.csv'
+
+    summary = {key: value for key, value in result.items() if key not in ('threshold_sweep', 'per_protein')}
+    per_protein = result['per_protein']
+    if per_protein is not None:
+        summary['per_protein_mean'] = {name: float(np.nanmean(per_protein[name])) if per_protein[name].notna().any()
+                                       else None for name in PROTEIN_METRICS}
+        write_table(per_protein, output_prefix + "_per_protein" + extension)
+    write_table(result['threshold_sweep'], output_prefix + "_thresholds" + extension)
+
+    with open(output_prefix + ".json", "w") as f:
+        json.dump(_replace_nan(summary), f, indent=2)
+    return output_prefix + ".json"
+
+
+def _replace_nan(value):
+    # NaN (e.g. the AUC of a protein without allosteric residues) is not valid JSON
+    if isinstance(value, dict):
+        return {key: _replace_nan(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_nan(item) for item in value]
+    return None if isinstance(value, float) and np.isnan(value) else value
+
+
+@traced("evaluate_model", rows=lambda model, X, *args, **kwargs: len(X))
+def evaluate_model(model, X, y, file_obj, set_name="Dataset", groups=None, output_prefix=None,
+                   n_bootstrap=1000):
+    """
+    Evaluate a model and write the text report
+
+    Probabilities are computed once; pooled metrics, bootstrap confidence
+    intervals (resampling proteins when groups are given), the threshold sweep
+    and per-protein metrics all come from them.
+
+    Args:
+        groups: ProteinID of every residue, for per-protein metrics
+        output_prefix: Also save the results as <prefix>.json and Parquet tables
+
+    Returns:
+        The result of evaluate_predictions
+    """
+    y = np.asarray(y).astype(int)
+    y_pred, y_prob = predict_probabilities(model, X)
+    result = evaluate_predictions(y, y_prob, groups=groups, n_bootstrap=n_bootstrap)
 
     file_obj.write(f"\n===== {set_name} Evaluation =====\n")
-    for name, value in metrics.items():
+    for name, value in result['metrics'].items():
         file_obj.write(f"{name}: {value:.4f}\n")
 
     file_obj.write("\nConfusion Matrix:\n")
-    file_obj.write(str(confusion_matrix(y, y_pred)))
+    file_obj.write(str(np.array(result['confusion_matrix'])))
 
     file_obj.write("\n\nClassification Report:\n")
-    file_obj.write(classification_report(y, y_pred))
\ No newline at end of file
+    file_obj.write(classification_report(y, y_pred))
+
+    if result['confidence_intervals']:
+        file_obj.write(f"\n{result['confidence']:.0%} bootstrap confidence intervals "
+                       f"({result['n_bootstrap']} resamples of {result['bootstrap_unit']}s):\n")
+        for name, (low, high) in result['confidence_intervals'].items():
+            file_obj.write(f"{name}: [{low:.4f}, {high:.4f}]\n")
+
+    best = result['best_threshold']
+    file_obj.write(f"\nBest threshold by MCC: {best['Threshold']:.2f} (MCC {best['MCC']:.4f})\n")
+
+    per_protein = result['per_protein']
+    if per_protein is not None:
+        file_obj.write(f"\nPer-protein metrics ({len(per_protein)} proteins, mean):\n")
+        for name in ("MCC", "AUC", "AUPRC"):
+            values = per_protein[name].dropna()
+            mean = f"{values.mean():.4f}" if len(values) else "n/a"
+            file_obj.write(f"{name}: {mean} ({len(values)} proteins)\n")
+
+    if output_prefix:
+        save_evaluation(result, output_prefix)
+    return result
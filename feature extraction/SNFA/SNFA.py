@@ -1,59 +1,370 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from sklearn.impute import SimpleImputer
 
-# Read all data from Excel file
-input_path = r'.\1WQW_Aall.xlsx'
-df = pd.read_excel(input_path, sheet_name='Sheet1')
+# Tables are read and written by table_io of the prediction pipeline, so the
+# extracted features are typed the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import read_table, write_table
 
-# Assume dataframe contains position coordinates 'x', 'y', 'z' and feature columns to process
-feature_columns = [
+# Features averaged over the spatial neighbourhood of every residue
+FEATURE_COLUMNS = [
     'NTE5', 'PRScol', 'PRSlin', 'ISPOCKET', 'Entropy',
     'Conservation Score', 'FrstIndex', 'ACC', 'NTECR_AVE',
-    'NTECR_MAX', 'NTECR_MIN', 'NTECR_MID','msf'
+    'NTECR_MAX', 'NTECR_MIN', 'NTECR_MID', 'msf'
 ]
 
-# Replace all non-numeric entries with NaN
-df[feature_columns] = df[feature_columns].apply(pd.to_numeric, errors='coerce')
+# Extra KD-tree candidates beyond the n + 1 needed, so that the n-th neighbour
+# can be told apart from everything outside the candidate set
+NEIGHBOR_MARGIN = 4
+# Residue-candidate pairs processed together, bounding the (rows, candidates,
+# features) temporaries whatever the neighbourhood size
+BLOCK_PAIRS = 2 ** 16
 
-# Now Imputer should work normally
-# Handle missing values
-imputer = SimpleImputer(strategy='mean')
-df[feature_columns] = imputer.fit_transform(df[feature_columns])
+# Statistics over a neighbourhood; 'wmean' is the mean weighted by 1 / distance
+AGGREGATORS = ('mean', 'max', 'std', 'wmean')
+# Coincident residues are weighted as if this far apart (Angstrom)
+MIN_WEIGHT_DISTANCE = 0.01
 
-grouped = df.groupby('ProteinID')
 
-# Calculate spatial features for n=7 nearest neighbors only
-n = 7
-all_new_features = []
+def load_table(input_path):
+    """
+    Read an Excel, CSV, Parquet or Feather table with table_io; Excel residues are on Sheet1
+    """
+    if os.path.splitext(input_path)[1].lower() in ('.xlsx', '.xls'):
+        return read_table(input_path, sheet_name='Sheet1')
+    return read_table(input_path)
 
-for protein_id, group in grouped:
-    coordinates = group[['x', 'y', 'z']].values
-    features = group[feature_columns].values
-    num_residues = len(coordinates)
 
+def _neighbor_mean_loop(coordinates, features, i, n):
+    # The original computation for residue i: full sort of the distances to all residues
+    distances = np.linalg.norm(coordinates - coordinates[i], axis=1)
+    nearest_indices = np.argsort(distances)[1:n + 1]  # Nearest n residues, excluding self
+    return features[nearest_indices].mean(axis=0)
+
+
+def neighbor_means_loop(coordinates, features, n=7):
+    """
+    Mean features of the n nearest residues of every residue, one full sort per residue
+
+    Reference implementation, O(n^2 log n) per protein.
+    """
     new_features = np.zeros_like(features)
+    for i in range(len(coordinates)):
+        new_features[i] = _neighbor_mean_loop(coordinates, features, i, n)
+    return new_features
+
+
+def _sorted_neighbor_blocks(coordinates, n, radius):
+    """
+    Yield (rows, neighbours, distances) for blocks of residues, neighbours sorted by distance
+
+    Column 0 is the residue itself, as in the full sort of neighbor_means_loop.
+    The columns cover at least the n nearest residues and every residue within
+    radius: one KD-tree query of that largest neighbourhood, plus
+    NEIGHBOR_MARGIN candidates. Their distances are recomputed exactly as
+    neighbor_means_loop computes them. A residue whose order is ambiguous
+    (equal distances among the nearest n + 1, which the full sort orders
+    arbitrarily, or an n-th neighbour not clearly closer than the residues
+    outside the candidates) takes its order from the full sort instead, so the
+    nearest-n sets match neighbor_means_loop exactly.
+    """
+    from scipy.spatial import cKDTree
+
+    num_residues = len(coordinates)
+    tree = cKDTree(coordinates)
+    k = n + 1 + NEIGHBOR_MARGIN
+    if radius > 0:
+        # Counting pass to size the query; the count includes the residue itself
+        counts = tree.query_ball_point(coordinates, radius * (1 + 1e-9), return_length=True)
+        k = max(k, int(counts.max()) + NEIGHBOR_MARGIN)
+    k = min(k, num_residues)
+
+    block_rows = max(1, BLOCK_PAIRS // k)
+    for start in range(0, num_residues, block_rows):
+        rows = np.arange(start, min(start + block_rows, num_residues))
+        tree_distances, candidates = tree.query(coordinates[rows], k=list(range(1, k + 1)))
+
+        # Same arithmetic as the loop, so equal distances compare equal
+        distances = np.linalg.norm(coordinates[candidates] - coordinates[rows][:, None, :], axis=2)
+        order = np.argsort(distances, axis=1, kind='stable')
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+
+        if k < n + 2:
+            # Every residue is a candidate, but the n + 1 nearest cannot be checked for ties
+            ambiguous = np.ones(len(rows), dtype=bool)
+        else:
+            ambiguous = np.any(distances[:, 1:n + 2] == distances[:, :n + 1], axis=1)
+        if k < num_residues:
+            # Residues outside the candidates are at least as far as the last one
+            ambiguous |= distances[:, n] >= tree_distances[:, -1] * (1 - 1e-9)
+
+        for row in np.flatnonzero(ambiguous):
+            full_distances = np.linalg.norm(coordinates - coordinates[rows[row]], axis=1)
+            full_order = np.argsort(full_distances)[:k]
+            candidates[row] = full_order
+            distances[row] = full_distances[full_order]
+
+        yield rows, candidates, distances
+
+
+def _prefix_statistics(values, distances, aggregators):
+    # Running statistics along the sorted neighbours (axis 1), so that the
+    # statistic of the nearest m is read at column m - 1 for any m
+    prefix = {}
+    # Sums of squares are taken about the nearest neighbour's value to limit cancellation
+    shift = values[:, :1, :]
+    if 'mean' in aggregators or 'std' in aggregators:
+        prefix['sum'] = np.cumsum(values - shift, axis=1)
+    if 'std' in aggregators:
+        prefix['squares'] = np.cumsum((values - shift) ** 2, axis=1)
+    if 'max' in aggregators:
+        prefix['max'] = np.maximum.accumulate(values, axis=1)
+    if 'wmean' in aggregators:
+        weights = 1.0 / np.maximum(distances, MIN_WEIGHT_DISTANCE)
+        prefix['weights'] = np.cumsum(weights, axis=1)[:, :, None]
+        prefix['weighted'] = np.cumsum(weights[:, :, None] * values, axis=1)
+    return prefix, shift[:, 0, :]
+
+
+def _prefix_aggregate(prefix, shift, sizes, aggregator):
+    # Statistic over the nearest sizes[row] neighbours of every row, NaN where sizes is 0
+    index = np.maximum(sizes - 1, 0)[:, None, None]
+
+    def at(name):
+        return np.take_along_axis(prefix[name], index, axis=1)[:, 0, :]
+
+    counts = sizes[:, None].astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if aggregator == 'mean':
+            result = shift + at('sum') / counts
+        elif aggregator == 'max':
+            result = at('max')
+        elif aggregator == 'std':
+            mean = at('sum') / counts
+            result = np.sqrt(np.maximum(at('squares') / counts - mean ** 2, 0.0))
+        else:
+            result = at('weighted') / at('weights')
+    return np.where(counts > 0, result, np.nan)
+
+
+def neighborhood_name(k=None, radius=None, aggregator='mean'):
+    """
+    Column suffix of a neighbourhood statistic: 7nn, 7nn_max, 8A, 8A_std, ...
+    """
+    name = f"{k}nn" if k is not None else f"{radius:g}A"
+    return name if aggregator == 'mean' else f"{name}_{aggregator}"
+
+
+def spatial_aggregates(coordinates, features, ks=(7,), radii=(), aggregators=('mean',)):
+    """
+    Statistics of the features over several neighbourhoods of every residue, in one pass
+
+    The residues are sorted by distance once per protein, up to the largest k
+    and radius, and every neighbourhood is a prefix of that order: the k
+    nearest residues, or all residues within the radius (the residue itself
+    excluded). Running sums and maxima along that order give the statistics of
+    all neighbourhoods at once. The mean of the k nearest is identical to
+    neighbor_means_loop; neighbourhoods without residues give NaN.
+
+    Args:
+        coordinates: (residues, 3) array of positions
+        features: (residues, features) array without missing values
+        ks: Numbers of nearest neighbours
+        radii: Neighbourhood radii in the unit of the coordinates (Angstrom)
+        aggregators: Statistics from AGGREGATORS; 'wmean' weighs every
+            neighbour by 1 / distance
+
+    Returns:
+        Dict of neighborhood_name -> (residues, features) array
+    """
+    for aggregator in aggregators:
+        if aggregator not in AGGREGATORS:
+            raise ValueError(f"Unknown aggregator '{aggregator}', expected one of {', '.join(AGGREGATORS)}")
+
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    features = np.asarray(features, dtype=np.float64)
+    results = {neighborhood_name(k=k, aggregator=aggregator): np.zeros_like(features)
+               for k in ks for aggregator in aggregators}
+    results.update({neighborhood_name(radius=radius, aggregator=aggregator): np.zeros_like(features)
+                    for radius in radii for aggregator in aggregators})
+
+    for rows, neighbors, distances in _sorted_neighbor_blocks(coordinates, max(ks, default=0),
+                                                              max(radii, default=0)):
+        # Column 0 is the residue itself; every neighbourhood is a prefix of the rest
+        neighbors, distances = neighbors[:, 1:], distances[:, 1:]
+        if neighbors.shape[1] == 0:
+            # A protein of a single residue has no neighbourhood
+            for name in results:
+                results[name][rows] = np.nan
+            continue
+        radius_sizes = {radius: (distances <= radius).sum(axis=1) for radius in radii}
+        width = max([min(k, neighbors.shape[1]) for k in ks] +
+                    [int(sizes.max(initial=0)) for sizes in radius_sizes.values()] + [1])
+        values = features[neighbors[:, :width]]
+        prefix, shift = _prefix_statistics(values, distances[:, :width], aggregators)
+
+        for k in ks:
+            sizes = np.full(len(rows), min(k, neighbors.shape[1]))
+            for aggregator in aggregators:
+                if aggregator == 'mean':
+                    # Summed in distance order like the loop, bit for bit
+                    result = values[:, :k].mean(axis=1)
+                else:
+                    result = _prefix_aggregate(prefix, shift, sizes, aggregator)
+                results[neighborhood_name(k=k, aggregator=aggregator)][rows] = result
+        for radius, sizes in radius_sizes.items():
+            for aggregator in aggregators:
+                results[neighborhood_name(radius=radius, aggregator=aggregator)][rows] = _prefix_aggregate(
+                    prefix, shift, sizes, aggregator)
+
+    return results
+
+
+def neighbor_means(coordinates, features, n=7):
+    """
+    Mean features of the n nearest residues of every residue (excluding itself)
+
+    Identical to neighbor_means_loop, bit for bit, see spatial_aggregates.
+    """
+    return spatial_aggregates(coordinates, features, ks=(n,))[neighborhood_name(k=n)]
+
+
+def neighborhood_names(ks=(7,), radii=(), aggregators=('mean',)):
+    """
+    Column suffixes of all statistics, in the order spatial_aggregates results are laid out
+    """
+    names = [neighborhood_name(k=k, aggregator=aggregator) for k in ks for aggregator in aggregators]
+    names += [neighborhood_name(radius=radius, aggregator=aggregator) for radius in radii
+              for aggregator in aggregators]
+    return names
+
+
+def _protein_block(coordinates, features, ks, radii, aggregators):
+    # All statistics of one protein side by side, one features-wide slice per neighborhood_names entry
+    results = spatial_aggregates(coordinates, features, ks, radii, aggregators)
+    return np.hstack([results[name] for name in neighborhood_names(ks, radii, aggregators)])
+
+
+# Neighbourhoods computed by each worker process, set once by the pool initializer
+_worker_settings = None
+
+
+def _init_worker(ks, radii, aggregators):
+    global _worker_settings
+    _worker_settings = (ks, radii, aggregators)
+
+
+def _worker_block(task):
+    coordinates, features = task
+    return _protein_block(coordinates, features, *_worker_settings)
+
+
+def add_spatial_features(df, feature_columns=FEATURE_COLUMNS, ks=(7,), radii=(), aggregators=('mean',),
+                         n_jobs=None):
+    """
+    Add space_<feature>_<neighbourhood> columns with statistics of the features
+    over the spatial neighbourhoods of every residue within its protein
+
+    Columns are named after neighborhood_name, so the default adds the
+    space_<feature>_7nn means. Non-numeric entries become NaN and missing
+    values are imputed with the column mean before aggregating. A table
+    without a ProteinID column is one protein.
+
+    Proteins are spread over n_jobs worker processes, largest first. Workers
+    receive only the coordinate and feature arrays of a protein and their
+    results are written into one preallocated array at the protein's rows, so
+    the row order of df is kept.
+
+    Args:
+        df: Residue table with 'x', 'y', 'z' and the feature columns
+        feature_columns: Features to aggregate
+        ks, radii, aggregators: Neighbourhoods and statistics, see spatial_aggregates
+        n_jobs: Worker processes (default: number of CPUs); 1 computes in this process
+
+    Returns:
+        A copy of df with the imputed features and the new columns
+    """
+    df = df.copy()
+    # Replace all non-numeric entries with NaN
+    df[feature_columns] = df[feature_columns].apply(pd.to_numeric, errors='coerce')
+
+    # Handle missing values
+    imputer = SimpleImputer(strategy='mean')
+    df[feature_columns] = imputer.fit_transform(df[feature_columns])
+
+    coordinates = df[['x', 'y', 'z']].to_numpy(dtype=np.float64)
+    features = df[feature_columns].to_numpy(dtype=np.float64)
+    if 'ProteinID' in df.columns:
+        groups = list(df.groupby('ProteinID', sort=False).indices.values())
+    else:
+        groups = [np.arange(len(df))]
+    # Largest proteins first, so that no worker is left with a large one at the end
+    groups.sort(key=len, reverse=True)
+
+    names = neighborhood_names(ks, radii, aggregators)
+    new_features = np.empty((len(df), len(names) * len(feature_columns)))
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(groups))
+    if n_jobs <= 1:
+        for positions in groups:
+            new_features[positions] = _protein_block(coordinates[positions], features[positions],
+                                                     ks, radii, aggregators)
+    else:
+        tasks = ((coordinates[positions], features[positions]) for positions in groups)
+        chunksize = max(1, len(groups) // (4 * n_jobs))
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(tuple(ks), tuple(radii), tuple(aggregators))) as executor:
+            for positions, block in zip(groups, executor.map(_worker_block, tasks, chunksize=chunksize)):
+                new_features[positions] = block
+
+    new_columns = [f'space_{col}_{name}' for name in names for col in feature_columns]
+    return pd.concat([df, pd.DataFrame(new_features, index=df.index, columns=new_columns)], axis=1)
+
+
+def run_snfa(data, output_path=None, feature_columns=FEATURE_COLUMNS, ks=(7,), radii=(), aggregators=('mean',),
+             n_jobs=None):
+    """
+    Spatial neighbourhood feature aggregation of a table or table file
+
+    Args:
+        data: DataFrame, or path of an Excel, CSV, Parquet or Feather table
+            with position coordinates 'x', 'y', 'z' and the feature columns
+        output_path: Save the result here as well (format by extension)
+        feature_columns, ks, radii, aggregators, n_jobs: See add_spatial_features
 
-    for i in range(num_residues):
-        distances = np.linalg.norm(coordinates - coordinates[i], axis=1)  # Calculate distances from current residue to all other residues
-        nearest_indices = np.argsort(distances)[1:n + 1]  # Sort and select nearest 7 residues (excluding self)
-        new_features[i] = features[nearest_indices].mean(axis=0)  # Calculate mean features of nearest 7 residues
+    Returns:
+        The table with the space_<feature>_<neighbourhood> columns added
+    """
+    df = load_table(data) if isinstance(data, (str, os.PathLike)) else data
+    df = add_spatial_features(df, feature_columns, ks, radii, aggregators, n_jobs)
 
-    new_features_df = pd.DataFrame(new_features, columns=feature_columns)
-    new_features_df['ProteinID'] = protein_id
-    new_features_df.index = group.index  # Maintain original index
+    if output_path is not None:
+        # Use .parquet/.feather for a typed binary table
+        write_table(df, output_path)
+        print(f"Generated file: {output_path}")
+    return df
 
-    all_new_features.append(new_features_df)
 
-# Combine all new features
-new_features_combined = pd.concat(all_new_features).sort_index()
-for col in feature_columns:
-    df[f'space_{col}_{n}nn'] = new_features_combined[col]
+def main():
+    parser = argparse.ArgumentParser(description="Spatial Neighborhood Feature Aggregation: add statistics of "
+                                                 "the features over the spatial neighbourhoods of every residue")
+    parser.add_argument("input", help="Residue table (.xlsx, .csv, .parquet or .feather), e.g. 1WQW_Aall.xlsx")
+    parser.add_argument("output", help="Output table, format by extension, e.g. 1WQW_A_allfeature.xlsx")
+    parser.add_argument("--ks", type=int, nargs="*", default=[7], help="Numbers of nearest neighbours (default: 7)")
+    parser.add_argument("--radii", type=float, nargs="*", default=[], help="Neighbourhood radii in Angstrom")
+    parser.add_argument("--aggregators", nargs="+", choices=AGGREGATORS, default=['mean'],
+                        help="Statistics of every neighbourhood (default: mean)")
+    parser.add_argument("--jobs", type=int, help="Worker processes (default: number of CPUs)")
+    args = parser.parse_args()
 
-# Save results to new Excel file
-output_path = rf'.\1WQW_A_allfeature{n}nn.xlsx'
-df.to_excel(output_path, index=False)
+    run_snfa(args.input, args.output, FEATURE_COLUMNS, args.ks, args.radii, args.aggregators, args.jobs)
+    print("Spatial feature engineering completed successfully!")
 
-print(f"Generated file: {output_path}")
 
-print("Spatial feature engineering completed successfully!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
-import pandas as pd
+import os
+import sys
+
+# Tables are read and written by table_io of the prediction pipeline, so the
+# extracted features are typed the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import read_table, write_table
 
 # 定义氨基酸三字母代码到单字母代码的映射
 three_to_one = {
@@ -76,9 +82,9 @@ def parse_aaindex1(aaindex1_file):
 
     return aaindex_dict
 
-# 读取Excel文件
+# 读取表格文件（Excel、CSV、Parquet 或 Feather）
 def read_excel(file_path):
-    return pd.read_excel(file_path)
+    return read_table(file_path)
 
 # 将残基序列连接成一个字符串，并确保数据清理
 def concatenate_sequence(df):
@@ -126,13 +132,13 @@ def main(aaindex1_file, input_excel, output_excel, index_keys):
         except ValueError as ve:
             print(ve)
 
-    result_df.to_excel(output_excel, index=False)
+    write_table(result_df, output_excel)
     print(f"结果已经成功保存到 {output_excel}")
 
 # 使用示例
 aaindex1_file = r'.\aaindex1.txt'
 input_excel = r'.\protein.xlsx'
-output_excel = r'.\aa.xlsx'
+output_excel = r'.\aa.xlsx'  # 也可以使用 .parquet / .feather / .csv
 
 index_keys = ['LEVM780105', 'HOPT810101', 'KYTJ820101', 'MONM990101', 'CHOP780215', 'CHOP780216', 'GRAR740102', 'JANJ790102',
               'ARGP820103', 'DAYM780201', 'DESM900102', 'HUTJ700101', 'KLEP840101', 'KRIW790103', 'NAKH920106', 'NAKH920107',
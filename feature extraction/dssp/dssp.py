@@ -1,11 +1,19 @@
 import os
+import sys
 import subprocess
 import pandas as pd
 
+# Tables are read and written by table_io of the prediction pipeline, so the
+# extracted features are typed the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import write_table
+
 # Define input folder containing PDB files
 input_folder = r"./Independent_test_set"#1WQW_A.pdb
 # Define output folder path
 output_folder = r"./Independent_test_set_result"#1WQW_A_dssp_result
+# Output table format: "xlsx", "csv", "parquet" or "feather"
+output_format = "xlsx"
 
 # Create output folder if it doesn't exist
 os.makedirs(output_folder, exist_ok=True)
@@ -70,12 +78,12 @@ for pdb_file in os.listdir(input_folder):
             # Add "seq" column
             df.insert(0, 'seq', range(1, len(df) + 1))
 
-            # Define output Excel file path for each protein
-            excel_file = os.path.join(output_folder, f"{file_name}.xlsx")
+            # Define output file path for each protein
+            output_file = os.path.join(output_folder, f"{file_name}.{output_format}")
 
-            # Write DataFrame to Excel file
-            df.to_excel(excel_file, index=False)
-            print(f"Created Excel file for {file_name} with sequence numbers 🗂️")
+            # Write DataFrame to the output file
+            write_table(df, output_file)
+            print(f"Created {output_format} file for {file_name} with sequence numbers 🗂️")
         else:
             print(f"Failed to process {pdb_file} 🚫")
             print(result.stderr)
@@ -0,0 +1,384 @@
+"""
+Gaussian network model dynamics of a protein: mean-square fluctuations and net transfer entropy
+
+Python port of matlab/MAIN_gnmte_zjl.m and GNM_sel_zjl.m, which need a MATLAB
+licence. For every PDB file the CA atoms are connected within a cutoff chosen
+from 5 to 18 Angstrom by the correlation of the fluctuations with the
+crystallographic B-factors, and the msf, NTE5 and NTE15 columns of the
+MATLAB output are computed from the modes of the Kirchhoff matrix:
+
+    python gnm.py 1WQW_A.pdb --output 1WQW_A_gnm.xlsx
+"""
+import os
+import sys
+import glob
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from scipy.linalg import eigh
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist, squareform
+
+# Tables are written by table_io of the prediction pipeline, so the msf and
+# NTE columns are typed like every other feature table
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import write_table
+
+# Cutoffs (Angstrom) tried by GNM_sel_zjl.m
+CUTOFFS = tuple(range(5, 19))
+# Time lags of the net transfer entropy columns NTE<tau>
+TAUS = (5, 15)
+# MAIN_gnmte_zjl.m warns below this B-factor correlation
+MIN_BFACTOR_CORRELATION = 0.5
+# Residues per side of the residue-pair tiles of net_transfer_entropy
+TE_BLOCK = 512
+
+
+def read_ca_atoms(pdb_path):
+    """
+    CA atoms of the first model of a PDB file
+
+    Only the first alternate location of an atom is kept. B-factors below 1
+    are multiplied by 100, as pdbread.m does for homology models.
+
+    Returns:
+        DataFrame with ResidueIndex, ResidueInfo, chain, x, y, z and bfactor
+    """
+    residues = []
+    seen = set()
+    with open(pdb_path, 'r') as file:
+        for line in file:
+            if line.startswith('END'):
+                break
+            if not line.startswith('ATOM') or line[12:16].strip() != 'CA':
+                continue
+            # Residue number with insertion code, per chain
+            key = (line[21], line[22:27])
+            if key in seen:
+                continue
+            seen.add(key)
+            bfactor = float(line[60:66])
+            residues.append({
+                'ResidueIndex': int(line[22:26]),
+                'ResidueInfo': line[17:20].strip(),
+                'chain': line[21].strip(),
+                'x': float(line[30:38]),
+                'y': float(line[38:46]),
+                'z': float(line[46:54]),
+                'bfactor': bfactor * 100 if bfactor < 1.0 else bfactor
+            })
+
+    if not residues:
+        raise ValueError(f"No CA atoms found in {pdb_path}")
+    return pd.DataFrame(residues)
+
+
+def kirchhoff_matrix(coordinates, cutoff, distances=None):
+    """
+    Kirchhoff (connectivity) matrix: -1 for residue pairs within cutoff, degrees on the diagonal
+
+    Args:
+        coordinates: (residues, 3) array of CA positions
+        cutoff: Contact distance in Angstrom, inclusive
+        distances: Condensed pairwise distances (scipy pdist) to reuse
+
+    Returns:
+        (residues, residues) float array
+    """
+    if distances is None:
+        distances = pdist(np.asarray(coordinates, dtype=np.float64))
+    kirchhoff = -squareform((distances <= cutoff).astype(np.float64))
+    kirchhoff[np.diag_indices_from(kirchhoff)] = -kirchhoff.sum(axis=1)
+    return kirchhoff
+
+
+def gnm_modes(kirchhoff):
+    """
+    Eigenvalues (ascending) and eigenvectors of the symmetric Kirchhoff matrix
+
+    The first mode is the zero-frequency translation and is left out of every
+    sum below, as in the MATLAB code.
+    """
+    return eigh(kirchhoff)
+
+
+def mean_square_fluctuations(eigenvalues, eigenvectors):
+    """
+    msf of every residue: sum over the non-zero modes k of V[i, k]^2 / lambda_k
+    """
+    return (eigenvectors[:, 1:] ** 2 / eigenvalues[1:]).sum(axis=1)
+
+
+def bfactor_correlation(msf, bfactors):
+    """
+    Pearson correlation of the B-factors with their least-squares fit by msf
+
+    That is |corr(msf, B-factors)|, the PCC_b of the MATLAB code.
+    """
+    return abs(np.corrcoef(bfactors, msf)[0, 1])
+
+
+def _blas_threads(n_threads):
+    # Limit the BLAS/LAPACK threads of every eigh when threadpoolctl is installed
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return contextlib.nullcontext()
+    return threadpool_limits(limits=n_threads)
+
+
+def sorted_contacts(coordinates, max_distance):
+    """
+    Residue pairs within max_distance ordered by distance, so the contacts of any smaller cutoff are a prefix
+
+    Candidate pairs come from a KD-tree with a small margin and are filtered
+    on the same Euclidean distances as kirchhoff_matrix, so the contacts are
+    the same at the cutoff boundary.
+
+    Returns:
+        (distances, i, j): ascending distances and the residue indices of each pair
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    pairs = cKDTree(coordinates).query_pairs(max_distance + 1e-6, output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    distances = np.sqrt(((coordinates[i] - coordinates[j]) ** 2).sum(axis=1))
+    order = np.argsort(distances, kind='stable')
+    order = order[distances[order] <= max_distance]
+    return distances[order], i[order], j[order]
+
+
+def _prefix_kirchhoff(n, i, j):
+    # Kirchhoff matrix of the contacts (i, j); same matrix as kirchhoff_matrix
+    kirchhoff = np.zeros((n, n))
+    kirchhoff[i, j] = -1.0
+    kirchhoff[j, i] = -1.0
+    kirchhoff[np.diag_indices(n)] = np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+    return kirchhoff
+
+
+def sweep_cutoffs(coordinates, bfactors, cutoffs=CUTOFFS, n_jobs=None):
+    """
+    Cutoff whose fluctuations correlate best with the B-factors, with its modes (GNM_sel_zjl.m)
+
+    The residue pairs within the largest cutoff are sorted by distance once;
+    the contacts of every cutoff are the prefix of that list up to the cutoff,
+    from which its Kirchhoff matrix is filled directly. The cutoffs are decomposed in parallel threads (LAPACK
+    releases the GIL) sharing n_jobs cores, and only the modes of the best
+    cutoff so far are kept, so at most n_jobs + 1 decompositions are in memory.
+    Ties go to the later cutoff in cutoffs, as in the MATLAB loop.
+
+    Args:
+        coordinates: (residues, 3) array of CA positions
+        bfactors: (residues,) crystallographic B-factors
+        cutoffs: Contact distances in Angstrom, inclusive
+        n_jobs: Total number of threads (default: number of CPUs)
+
+    Returns:
+        Dict with cutoff, correlations ({cutoff: correlation}), eigenvalues and
+        eigenvectors of the chosen cutoff
+    """
+    n = len(coordinates)
+    distances, i, j = sorted_contacts(coordinates, max(cutoffs))
+    ends = np.searchsorted(distances, cutoffs, side='right')
+
+    def evaluate(end):
+        eigenvalues, eigenvectors = gnm_modes(_prefix_kirchhoff(n, i[:end], j[:end]))
+        # Too small a cutoff leaves residues unconnected: extra zero modes, msf and correlation NaN
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = bfactor_correlation(mean_square_fluctuations(eigenvalues, eigenvectors), bfactors)
+        return correlation, eigenvalues, eigenvectors
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    n_workers = min(n_jobs, len(cutoffs))
+    correlations = {}
+    best = None
+    with _blas_threads(max(1, n_jobs // n_workers)), ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(evaluate, end): position for position, end in enumerate(ends)}
+        for future in as_completed(futures):
+            position = futures[future]
+            correlation, eigenvalues, eigenvectors = future.result()
+            correlations[cutoffs[position]] = correlation
+            # NaN correlations (no contacts) never win, as with >= in the MATLAB loop
+            if correlation >= 0.0 and (best is None or (correlation, position) > best[:2]):
+                best = (correlation, position, eigenvalues, eigenvectors)
+
+    if best is None:
+        raise ValueError("No cutoff gives fluctuations correlated with the B-factors")
+    return {'cutoff': cutoffs[best[1]], 'correlations': {cutoff: correlations[cutoff] for cutoff in cutoffs},
+            'eigenvalues': best[2], 'eigenvectors': best[3]}
+
+
+def select_cutoff(coordinates, bfactors, cutoffs=CUTOFFS, n_jobs=None):
+    """
+    Cutoff whose fluctuations correlate best with the B-factors (see sweep_cutoffs)
+
+    Returns:
+        (cutoff, {cutoff: correlation})
+    """
+    sweep = sweep_cutoffs(coordinates, bfactors, cutoffs, n_jobs)
+    return sweep['cutoff'], sweep['correlations']
+
+
+def transfer_entropy(eigenvalues, eigenvectors, tau):
+    """
+    Net transfer entropy between residues at time lag tau (Nte of MAIN_gnmte_zjl.m)
+
+    With the correlations A = sum_k V_k V_k^T / lambda_k and their decayed
+    counterpart A_tau = sum_k V_k V_k^T exp(-lambda_k tau) / lambda_k over the
+    non-zero modes, T[i, j] is the entropy transferred from i to j, netTE =
+    T - T^T, and the NTE<tau> feature is the row mean of netTE normalized by
+    its maximum.
+
+    Returns:
+        (norm_ave, net_te, norm_net_te): per-residue NTE and the two matrices
+    """
+    modes, frequencies = eigenvectors[:, 1:], eigenvalues[1:]
+    A = (modes / frequencies) @ modes.T
+    A_tau = (modes * (np.exp(-frequencies * tau) / frequencies)) @ modes.T
+
+    a = np.diag(A)
+    a_tau = np.diag(A_tau)
+    a_i, a_j, a_tau_j = a[:, None], a[None, :], a_tau[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        T = (0.5 * np.log(a_j * a_j - a_tau_j * a_tau_j)
+             - 0.5 * np.log(a_i * a_j * a_j + 2.0 * A * a_tau_j * A_tau - (A_tau * A_tau + A * A) * a_j
+                            - a_tau_j * a_tau_j * a_i)
+             - 0.5 * np.log(a_j)
+             + 0.5 * np.log(a_i * a_j - A * A))
+    T[np.diag_indices_from(T)] = 0.0
+
+    net_te = T - T.T
+    norm_net_te = net_te / net_te.max()
+    norm_ave = norm_net_te.sum(axis=1) / len(norm_net_te)
+    return norm_ave, net_te, norm_net_te
+
+
+def _log_transfer_term(a_i, a_j, a_tau_j, A, A_tau):
+    # log of the argument of the second logarithm of T[i, j]
+    return np.log(a_i * a_j * a_j + 2.0 * A * a_tau_j * A_tau - (A_tau * A_tau + A * A) * a_j
+                  - a_tau_j * a_tau_j * a_i)
+
+
+def net_transfer_entropy(eigenvalues, eigenvectors, taus=TAUS, block_size=TE_BLOCK):
+    """
+    NTE<tau> of every residue for several time lags, without the n x n matrices
+
+    Gives the norm_ave of transfer_entropy for every tau. Two things make it cheaper:
+    - In T[i, j] - T[j, i] the log(a_i a_j - A_ij^2) terms cancel and the
+      diagonal terms reduce to h_j - h_i, with
+      h = 0.5 log(a^2 - a_tau^2) - 0.5 log(a). What remains is computed over
+      block_size x block_size tiles of residue pairs i < j.
+    - Each tile's block of A, a V diag(1 / lambda) V^T product, is shared by
+      all taus; only the V diag(exp(-lambda tau) / lambda) V^T block is
+      computed per tau.
+    netTE is antisymmetric, so every tile adds its row sums to the rows of i
+    and subtracts its column sums from the rows of j, and its maximum is the
+    largest |netTE|. Memory is O(block_size^2) besides the modes.
+
+    Returns:
+        Dict of tau -> (residues,) array
+    """
+    modes, frequencies = eigenvectors[:, 1:], eigenvalues[1:]
+    n = len(modes)
+    weighted = modes / frequencies
+    decays = {tau: np.exp(-frequencies * tau) for tau in taus}
+    # Diagonals of A and A_tau straight from the modes
+    a = (modes * weighted).sum(axis=1)
+    a_tau = {tau: (modes * weighted) @ decay for tau, decay in decays.items()}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = {tau: 0.5 * np.log(a * a - a_tau[tau] ** 2) - 0.5 * np.log(a) for tau in taus}
+
+    row_sums = {tau: np.zeros(n) for tau in taus}
+    maxima = dict.fromkeys(taus, 0.0)
+    starts = range(0, n, block_size)
+    for start_i in starts:
+        rows = slice(start_i, min(start_i + block_size, n))
+        for start_j in starts[start_i // block_size:]:
+            cols = slice(start_j, min(start_j + block_size, n))
+            A = weighted[rows] @ modes[cols].T
+            a_i, a_j = a[rows, None], a[None, cols]
+            for tau in taus:
+                A_tau = (weighted[rows] * decays[tau]) @ modes[cols].T
+                a_tau_i, a_tau_j = a_tau[tau][rows, None], a_tau[tau][None, cols]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    net = (h[tau][None, cols] - h[tau][rows, None]
+                           - 0.5 * _log_transfer_term(a_i, a_j, a_tau_j, A, A_tau)
+                           + 0.5 * _log_transfer_term(a_j, a_i, a_tau_i, A, A_tau))
+                if start_i == start_j:
+                    np.fill_diagonal(net, 0.0)
+                    row_sums[tau][rows] += net.sum(axis=1)
+                else:
+                    row_sums[tau][rows] += net.sum(axis=1)
+                    row_sums[tau][cols] -= net.sum(axis=0)
+                maxima[tau] = max(maxima[tau], np.abs(net).max())
+
+    return {tau: row_sums[tau] / maxima[tau] / n for tau in taus}
+
+
+def gnm_dynamics(pdb_path, cutoff=None, taus=TAUS, n_jobs=None):
+    """
+    msf and NTE<tau> columns of one protein, as written by MAIN_gnmte_zjl.m
+
+    When the cutoff is chosen here, the modes of the chosen cutoff come from
+    the sweep instead of a second decomposition.
+
+    Args:
+        pdb_path: PDB file
+        cutoff: Contact cutoff in Angstrom (default: chosen by sweep_cutoffs)
+        taus: Time lags of the NTE columns
+        n_jobs: Threads of the cutoff sweep (default: number of CPUs)
+
+    Returns:
+        DataFrame with ResidueIndex, ResidueInfo, msf, NTE<tau>... and chain
+    """
+    residues = read_ca_atoms(pdb_path)
+    coordinates = residues[['x', 'y', 'z']].to_numpy(dtype=np.float64)
+    bfactors = residues['bfactor'].to_numpy(dtype=np.float64)
+    if cutoff is None:
+        sweep = sweep_cutoffs(coordinates, bfactors, n_jobs=n_jobs)
+        cutoff, eigenvalues, eigenvectors = sweep['cutoff'], sweep['eigenvalues'], sweep['eigenvectors']
+    else:
+        eigenvalues, eigenvectors = gnm_modes(kirchhoff_matrix(coordinates, cutoff))
+    msf = mean_square_fluctuations(eigenvalues, eigenvectors)
+    correlation = bfactor_correlation(msf, bfactors)
+    if correlation < MIN_BFACTOR_CORRELATION:
+        print(f"Warning: {os.path.basename(pdb_path)}: B-factor correlation {correlation:.3f} "
+              f"is below {MIN_BFACTOR_CORRELATION} (cutoff {cutoff})")
+
+    result = residues[['ResidueIndex', 'ResidueInfo']].copy()
+    result['msf'] = msf
+    for tau, norm_ave in net_transfer_entropy(eigenvalues, eigenvectors, taus).items():
+        result[f'NTE{tau}'] = norm_ave
+    result['chain'] = residues['chain']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GNM mean-square fluctuations and net transfer entropy")
+    parser.add_argument("input", help="PDB file, or a directory of PDB files")
+    parser.add_argument("--output", help="Output table for a single PDB file (default: <name>_gnm.xlsx)")
+    parser.add_argument("--output-dir", default=".", help="Directory of the <name>_gnm tables of a directory")
+    parser.add_argument("--format", default="xlsx", choices=["xlsx", "csv", "parquet", "feather"],
+                        help="Table format of --output-dir (default: xlsx)")
+    parser.add_argument("--cutoff", type=float, help="Contact cutoff in Angstrom (default: chosen per protein)")
+    parser.add_argument("--jobs", type=int, help="Threads of the cutoff sweep (default: number of CPUs)")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        pdb_files = sorted(glob.glob(os.path.join(args.input, '*.pdb')))
+        os.makedirs(args.output_dir, exist_ok=True)
+        outputs = [os.path.join(args.output_dir, f"{os.path.splitext(os.path.basename(path))[0]}_gnm.{args.format}")
+                   for path in pdb_files]
+    else:
+        pdb_files = [args.input]
+        outputs = [args.output or f"{os.path.splitext(os.path.basename(args.input))[0]}_gnm.xlsx"]
+
+    for pdb_path, output_path in zip(pdb_files, outputs):
+        write_table(gnm_dynamics(pdb_path, args.cutoff, n_jobs=args.jobs), output_path)
+        print(f"Generated file: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 import os
+import sys
 import glob
+import pandas as pd
 from openpyxl import Workbook
 
+# Tables are read and written by table_io of the prediction pipeline, so the
+# extracted features are typed the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import write_table
+
 
 # Function: Read residue information from PDB file
 def read_pdb_residues(pdb_file):
@@ -25,13 +32,14 @@ def read_pdb_residues(pdb_file):
 
 
 # Define main function
-def main(source_directory, target_directory):
+def main(source_directory, target_directory, output_format="xlsx"):
     """
     Main processing function
 
     Parameters:
     source_directory: Source directory containing subdirectories with PDB files
     target_directory: Target directory for output Excel files
+    output_format: "xlsx" (with blank separator rows), "csv", "parquet" or "feather"
     """
     # Create target directory if it doesn't exist
     os.makedirs(target_directory, exist_ok=True)
@@ -50,6 +58,7 @@ def main(source_directory, target_directory):
                 ws.append(["ProteinID", "File_Name", "Residue_Name", "Residue_Number"])  # Add header
 
                 collected_residues = set()  # Use set to track already added residues
+                rows = []  # Residue rows for non-Excel output
 
                 # Process each PDB file
                 for pdb_file in pdb_files:
@@ -61,15 +70,20 @@ def main(source_directory, target_directory):
                         unique_residue = (os.path.basename(subdir_path), file_name, res_name, res_num)
                         if unique_residue not in collected_residues:
                             ws.append(unique_residue)
+                            rows.append(unique_residue)
                             collected_residues.add(unique_residue)
 
                     # Add empty row as separator
                     ws.append([])
 
-                # Name output Excel file using subdirectory name
-                output_file = os.path.join(target_directory, f'{os.path.basename(subdir_path)}.xlsx')
-                wb.save(output_file)
-                print(f"Excel file saved: {output_file}")
+                # Name output file using subdirectory name
+                output_file = os.path.join(target_directory, f'{os.path.basename(subdir_path)}.{output_format}')
+                if output_format == "xlsx":
+                    wb.save(output_file)
+                else:
+                    write_table(pd.DataFrame(rows, columns=["ProteinID", "File_Name", "Residue_Name",
+                                                            "Residue_Number"]), output_file)
+                print(f"{output_format} file saved: {output_file}")
 
 
 # Call main function with directory settings
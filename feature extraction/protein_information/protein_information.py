@@ -1,15 +1,23 @@
 import pandas as pd
 import os
 import re
+import sys
 from pathlib import Path
 
+# Tables are read and written by table_io of the prediction pipeline, so the
+# extracted features are typed the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import write_table
 
-def parse_pdb_to_excel(pdb_file_path):
+
+def parse_pdb_to_excel(pdb_file_path, output_format="xlsx"):
     """
     Read PDB file and extract protein information, generate Excel file
 
     Parameters:
     pdb_file_path: PDB file path
+    output_format: "xlsx" (with statistics sheets), "csv", "parquet" or "feather";
+                   the non-Excel formats hold the residue table only
     """
 
     # Check if file exists
@@ -64,29 +72,34 @@ def parse_pdb_to_excel(pdb_file_path):
         if residue_data:
             df = pd.DataFrame(residue_data)
 
-            # Generate Excel filename
-            excel_filename = f"{protein_name}_protein_info.xlsx"
-
-            # Create Excel writer object
-            with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
-                # Write main data
-                df.to_excel(writer, sheet_name='Protein_Residue_Info', index=False)
-
-                # Create statistics table
-                stats_data = {
-                    'Statistics': ['Total_Residues', 'Chain_Count', 'Protein_Name', 'Source_File'],
-                    'Value': [len(df), len(df['Chain_Name'].unique()),
-                           protein_name, os.path.basename(pdb_file_path)]
-                }
-                stats_df = pd.DataFrame(stats_data)
-                stats_df.to_excel(writer, sheet_name='Statistics', index=False)
-
-                # Chain-grouped statistics
-                chain_stats = df.groupby('Chain_Name').size().reset_index()
-                chain_stats.columns = ['Chain_Name', 'Residue_Count']
-                chain_stats.to_excel(writer, sheet_name='Chain_Statistics', index=False)
-
-            print(f"Successfully generated Excel file: {excel_filename}")
+            if output_format != "xlsx":
+                output_filename = f"{protein_name}_protein_info.{output_format}"
+                write_table(df, output_filename)
+                print(f"Successfully generated {output_format} file: {output_filename}")
+            else:
+                # Generate Excel filename
+                excel_filename = f"{protein_name}_protein_info.xlsx"
+
+                # Create Excel writer object
+                with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
+                    # Write main data
+                    df.to_excel(writer, sheet_name='Protein_Residue_Info', index=False)
+
+                    # Create statistics table
+                    stats_data = {
+                        'Statistics': ['Total_Residues', 'Chain_Count', 'Protein_Name', 'Source_File'],
+                        'Value': [len(df), len(df['Chain_Name'].unique()),
+                               protein_name, os.path.basename(pdb_file_path)]
+                    }
+                    stats_df = pd.DataFrame(stats_data)
+                    stats_df.to_excel(writer, sheet_name='Statistics', index=False)
+
+                    # Chain-grouped statistics
+                    chain_stats = df.groupby('Chain_Name').size().reset_index()
+                    chain_stats.columns = ['Chain_Name', 'Residue_Count']
+                    chain_stats.to_excel(writer, sheet_name='Chain_Statistics', index=False)
+
+                print(f"Successfully generated Excel file: {excel_filename}")
             print(f"Total extracted {len(df)} residue information")
             print(f"Involving {len(df['Chain_Name'].unique())} protein chains: {', '.join(sorted(df['Chain_Name'].unique()))}")
 
@@ -1,8 +1,14 @@
 import os
+import sys
 import subprocess
 import pandas as pd
 from pathlib import Path
 
+# Tables are read and written by table_io of the prediction pipeline, so the
+# extracted features are typed the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from table_io import write_table
+
 # Try to import openpyxl, install if not available
 try:
     import openpyxl
@@ -11,7 +17,8 @@ except ImportError:
 
 
 class PSSMPipeline:
-    def __init__(self, query_dir, database, output_dir, excel_output_dir, num_threads=40, num_iterations=3):
+    def __init__(self, query_dir, database, output_dir, excel_output_dir, num_threads=40, num_iterations=3,
+                 output_format="xlsx"):
         """
         Initialize PSSM Pipeline
 
@@ -22,6 +29,7 @@ class PSSMPipeline:
         excel_output_dir: Directory for Excel output files
         num_threads: Number of threads for PSI-BLAST
         num_iterations: Number of PSI-BLAST iterations
+        output_format: Table format of the parsed PSSM ("xlsx", "csv", "parquet" or "feather")
         """
         self.query_dir = query_dir
         self.database = database
@@ -29,6 +37,7 @@ class PSSMPipeline:
         self.excel_output_dir = excel_output_dir
         self.num_threads = num_threads
         self.num_iterations = num_iterations
+        self.output_format = output_format
 
         # Create output directories
         os.makedirs(self.output_dir, exist_ok=True)
@@ -147,9 +156,9 @@ class PSSMPipeline:
                 pssm_df['seq'] = range(1, len(pssm_df) + 1)
 
                 # Save to Excel
-                excel_file_path = os.path.join(self.excel_output_dir, f"{protein_id}.xlsx")
-                pssm_df.to_excel(excel_file_path, index=False)
-                print(f"✅ Excel file saved: {protein_id}.xlsx")
+                excel_file_path = os.path.join(self.excel_output_dir, f"{protein_id}.{self.output_format}")
+                write_table(pssm_df, excel_file_path)
+                print(f"✅ Table saved: {protein_id}.{self.output_format}")
                 return excel_file_path
             else:
                 print(f"❌ No valid data found in PSSM file for {protein_id}")
@@ -230,9 +239,9 @@ class PSSMPipeline:
 
                 pssm_df['seq'] = range(1, len(pssm_df) + 1)
 
-                excel_file_path = os.path.join(self.excel_output_dir, f"{prefix}.xlsx")
-                pssm_df.to_excel(excel_file_path, index=False)
-                print(f"✅ Combined Excel file saved: {prefix}.xlsx")
+                excel_file_path = os.path.join(self.excel_output_dir, f"{prefix}.{self.output_format}")
+                write_table(pssm_df, excel_file_path)
+                print(f"✅ Combined table saved: {prefix}.{self.output_format}")
 
     def run_complete_pipeline(self):
         """
@@ -280,7 +289,8 @@ if __name__ == "__main__":
         output_dir=output_dir,
         excel_output_dir=excel_output_dir,
         num_threads=40,
-        num_iterations=3
+        num_iterations=3,
+        output_format="xlsx"
     )
 
     # Choose operation mode
@@ -0,0 +1,430 @@
+"""
+Array-backed inference for the soft-voting ensemble
+
+The fitted XGBoost, LightGBM and RandomForest members are exported into one set
+of flat node arrays. All trees are walked together, level by level, with
+vectorized numpy indexing, or in a multi-threaded numba kernel when numba is
+installed, and the soft-vote probability of every residue is
+computed in a single pass. Labels are derived from that same probability, so
+predicting labels and probabilities no longer runs the trees twice.
+"""
+import os
+import json
+import numpy as np
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# Members compare the features either as float32 (XGBoost, RandomForest) or as
+# float64 (LightGBM); both copies sit side by side in one input matrix
+FLOAT32_VIEW = 0
+FLOAT64_VIEW = 1
+
+
+class _TreeBuilder:
+    """
+    Collect the nodes of one tree
+
+    Every split is stored as "go left if x <= threshold", with the direction
+    of missing values in default_left. Leaves point to themselves with an
+    infinite threshold, so all trees can be walked for the same number of steps.
+    """
+
+    def __init__(self):
+        self.feature = []
+        self.threshold = []
+        self.left = []
+        self.right = []
+        self.default_left = []
+        self.zero_missing = []
+        self.value = []
+
+    def add_node(self):
+        for column in (self.feature, self.threshold, self.left, self.right,
+                       self.default_left, self.zero_missing, self.value):
+            column.append(None)
+        return len(self.feature) - 1
+
+    def set_split(self, node, feature, threshold, left, right, default_left, zero_missing=False):
+        self.feature[node] = feature
+        self.threshold[node] = threshold
+        self.left[node] = left
+        self.right[node] = right
+        self.default_left[node] = default_left
+        self.zero_missing[node] = zero_missing
+        self.value[node] = 0.0
+
+    def set_leaf(self, node, value):
+        self.set_split(node, 0, np.inf, node, node, True)
+        self.value[node] = value
+
+
+def _export_xgboost(estimator):
+    """
+    Export a fitted XGBClassifier with the binary:logistic objective
+    """
+    learner = json.loads(estimator.get_booster().save_raw('json'))['learner']
+    objective = learner['objective']['name']
+    if objective != 'binary:logistic':
+        raise ValueError(f"Unsupported XGBoost objective '{objective}'")
+    booster = learner['gradient_booster']
+    if booster['name'] != 'gbtree':
+        raise ValueError(f"Unsupported XGBoost booster '{booster['name']}'")
+
+    trees = []
+    for tree in booster['model']['trees']:
+        if any(tree['split_type']):
+            raise ValueError("Categorical XGBoost splits are not supported")
+
+        # XGBoost goes left on x < threshold with float32 inputs and thresholds,
+        # which is x <= the next float32 below the threshold
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        thresholds = np.nextafter(conditions, np.float32(-np.inf)).astype(np.float64)
+
+        builder = _TreeBuilder()
+        for node in range(len(tree['left_children'])):
+            builder.add_node()
+        for node, left in enumerate(tree['left_children']):
+            if left == -1:
+                builder.set_leaf(node, float(conditions[node]))
+            else:
+                builder.set_split(node, tree['split_indices'][node], thresholds[node], left,
+                                  tree['right_children'][node], bool(tree['default_left'][node]))
+        trees.append(builder)
+
+    # base_score is a probability, written as "[5E-1]" by recent versions
+    base_score = float(str(learner['learner_model_param']['base_score']).strip('[]'))
+    bias = float(np.log(base_score / (1.0 - base_score)))
+    return trees, {'view': FLOAT32_VIEW, 'output': 'sigmoid', 'bias': bias, 'scale': 1.0}
+
+
+def _add_lightgbm_node(builder, entry):
+    node = builder.add_node()
+    if 'split_feature' not in entry:
+        builder.set_leaf(node, entry['leaf_value'])
+        return node
+    if entry['decision_type'] != '<=':
+        raise ValueError("Categorical LightGBM splits are not supported")
+
+    threshold = entry['threshold']
+    missing_type = entry['missing_type']
+    # Without a missing type LightGBM compares NaN as zero
+    default_left = entry['default_left'] if missing_type != 'None' else 0.0 <= threshold
+    left = _add_lightgbm_node(builder, entry['left_child'])
+    right = _add_lightgbm_node(builder, entry['right_child'])
+    builder.set_split(node, entry['split_feature'], threshold, left, right,
+                      bool(default_left), missing_type == 'Zero')
+    return node
+
+
+def _export_lightgbm(estimator):
+    """
+    Export a fitted LGBMClassifier with the binary objective
+    """
+    model = estimator.booster_.dump_model()
+    objective = model['objective'].split()
+    if objective[0] != 'binary' or model['num_tree_per_iteration'] != 1:
+        raise ValueError(f"Unsupported LightGBM objective '{model['objective']}'")
+    scale = 1.0
+    for param in objective[1:]:
+        if param.startswith('sigmoid:'):
+            scale = float(param.split(':')[1])
+
+    trees = []
+    for tree_info in model['tree_info']:
+        builder = _TreeBuilder()
+        _add_lightgbm_node(builder, tree_info['tree_structure'])
+        trees.append(builder)
+
+    return trees, {'view': FLOAT64_VIEW, 'output': 'sigmoid', 'bias': 0.0, 'scale': scale}
+
+
+def _export_random_forest(estimator):
+    """
+    Export a fitted binary RandomForestClassifier
+    """
+    if estimator.n_classes_ != 2:
+        raise ValueError("Only binary RandomForest models are supported")
+
+    trees = []
+    for tree_estimator in estimator.estimators_:
+        tree = tree_estimator.tree_
+        # Leaf values are the class fractions, normalized as in predict_proba
+        values = tree.value[:, 0, :]
+        positive_fraction = values[:, 1] / values.sum(axis=1)
+        missing_go_to_left = getattr(tree, 'missing_go_to_left', np.ones(tree.node_count, dtype=bool))
+
+        builder = _TreeBuilder()
+        for node in range(tree.node_count):
+            builder.add_node()
+        for node in range(tree.node_count):
+            if tree.children_left[node] == -1:
+                builder.set_leaf(node, positive_fraction[node])
+            else:
+                builder.set_split(node, tree.feature[node], tree.threshold[node], tree.children_left[node],
+                                  tree.children_right[node], bool(missing_go_to_left[node]))
+        trees.append(builder)
+
+    return trees, {'view': FLOAT32_VIEW, 'output': 'mean', 'bias': 0.0, 'scale': 1.0}
+
+
+EXPORTERS = {
+    'XGBClassifier': _export_xgboost,
+    'LGBMClassifier': _export_lightgbm,
+    'RandomForestClassifier': _export_random_forest,
+}
+
+
+@lru_cache(maxsize=None)
+def _compiled_kernel():
+    """
+    Multi-threaded numba kernel for the per-member leaf sums, None without numba
+    """
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    @numba.njit(parallel=True, cache=True, nogil=True)
+    def member_sums(inputs, threshold, links, value, roots, tree_depth, tree_member, block_rows,
+                    check_missing, sums):
+        # Each thread takes a block of rows and moves all of them one level down
+        # a tree at a time, so the independent lookups of different rows overlap
+        n_rows = inputs.shape[0]
+        for block in numba.prange((n_rows + block_rows - 1) // block_rows):
+            start = block * block_rows
+            stop = min(n_rows, start + block_rows)
+            nodes = np.empty(stop - start, np.int32)
+            for tree in range(roots.shape[0]):
+                nodes[:] = roots[tree]
+                for _ in range(tree_depth[tree]):
+                    for i in range(stop - start):
+                        node = nodes[i]
+                        x = inputs[start + i, links[node, 0]]
+                        go_left = x <= threshold[node]
+                        if check_missing and (x != x or (links[node, 4] == 1 and x == 0.0)):
+                            go_left = links[node, 3] == 1
+                        nodes[i] = links[node, 2 - go_left]
+                member = tree_member[tree]
+                for i in range(stop - start):
+                    sums[start + i, member] += value[nodes[i]]
+
+    return member_sums
+
+
+class CompiledEnsemble:
+    """
+    Soft-voting ensemble of tree models stored as flat node arrays
+
+    Args:
+        members: List of (trees, info) pairs from the exporters
+        weights: Voting weights of the members (None for equal weights)
+        classes: The two class labels of the ensemble
+        n_features: Number of input features
+        n_jobs: Number of threads used by predict (default: number of CPUs)
+        block_rows: Rows walked through the trees together
+        use_numba: Use the numba kernel when numba is installed
+    """
+
+    def __init__(self, members, weights, classes, n_features, n_jobs=None, block_rows=256,
+                 use_numba=True):
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = n_features
+        self.n_jobs = n_jobs
+        self.block_rows = block_rows
+        self.use_numba = use_numba
+        self.weights = np.ones(len(members)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+        columns = {name: [] for name in ('feature', 'threshold', 'left', 'right',
+                                         'default_left', 'zero_missing', 'value')}
+        roots = []
+        self.members = []
+        offset = 0
+        for trees, info in members:
+            first_tree = len(roots)
+            for builder in trees:
+                roots.append(offset)
+                # Features of float64 members index the second half of the input matrix
+                columns['feature'].extend(feature + info['view'] * n_features for feature in builder.feature)
+                columns['left'].extend(node + offset for node in builder.left)
+                columns['right'].extend(node + offset for node in builder.right)
+                for name in ('threshold', 'default_left', 'zero_missing', 'value'):
+                    columns[name].extend(getattr(builder, name))
+                offset += len(builder.feature)
+            self.members.append(dict(info, trees=slice(first_tree, len(roots))))
+
+        # One row per node: feature, left child, right child, default left, zero is missing
+        self.links = np.ascontiguousarray(np.column_stack([
+            columns[name] for name in ('feature', 'left', 'right', 'default_left', 'zero_missing')
+        ]).astype(np.int32))
+        self.threshold = np.asarray(columns['threshold'], dtype=np.float64)
+        self.value = np.asarray(columns['value'], dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.tree_depth = self._tree_depths()
+        self.tree_member = np.zeros(len(roots), dtype=np.int32)
+        for index, member in enumerate(self.members):
+            self.tree_member[member['trees']] = index
+
+    # Arrays that fully describe a compiled ensemble, see to_arrays
+    ARRAYS = ('links', 'threshold', 'value', 'roots', 'tree_depth', 'tree_member', 'weights', 'classes_')
+
+    def to_arrays(self):
+        """
+        Split the ensemble into its node arrays and a JSON-serializable config
+
+        from_arrays rebuilds it from them, e.g. from memory-mapped .npy files.
+        """
+        config = {
+            'n_features': int(self.n_features_in_),
+            'block_rows': int(self.block_rows),
+            'members': [{'view': int(member['view']), 'output': member['output'], 'bias': float(member['bias']),
+                         'scale': float(member['scale']),
+                         'trees': [member['trees'].start, member['trees'].stop]}
+                        for member in self.members]
+        }
+        return {name: getattr(self, name) for name in self.ARRAYS}, config
+
+    @classmethod
+    def from_arrays(cls, arrays, config, n_jobs=None, use_numba=True):
+        """
+        Rebuild an ensemble from the output of to_arrays without copying the arrays
+        """
+        engine = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(engine, name, arrays[name])
+        engine.n_features_in_ = config['n_features']
+        engine.block_rows = config['block_rows']
+        engine.n_jobs = n_jobs
+        engine.use_numba = use_numba
+        engine.members = [dict(member, trees=slice(*member['trees'])) for member in config['members']]
+        return engine
+
+    def _tree_depths(self):
+        # Number of steps each tree needs to bring every row to a leaf
+        depths = np.zeros(len(self.roots), dtype=np.int32)
+        for tree, root in enumerate(self.roots):
+            frontier = np.array([root])
+            while True:
+                frontier = frontier[self.links[frontier, 1] != frontier]
+                if not frontier.size:
+                    break
+                frontier = self.links[frontier, 1:3].ravel()
+                depths[tree] += 1
+        return depths
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def backend(self):
+        return 'numba' if self.use_numba and _compiled_kernel() is not None else 'numpy'
+
+    @staticmethod
+    def _inputs(X):
+        # float32-rounded and float64 copies of the features side by side
+        return np.hstack([X.astype(np.float32).astype(np.float64), X])
+
+    def _check_missing(self, X):
+        # Missing-value directions only matter for NaN inputs or zero-as-missing splits
+        return bool(np.isnan(X).any() or self.links[:, 4].any())
+
+    def _member_sums_numpy(self, X):
+        # Same walk as the kernel, all trees at once with vectorized indexing
+        inputs = self._inputs(X)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        check_missing = self._check_missing(X)
+        for _ in range(self.tree_depth.max(initial=0)):
+            x = inputs[rows, self.links[nodes, 0]]
+            go_left = x <= self.threshold[nodes]
+            if check_missing:
+                missing = np.isnan(x) | ((self.links[nodes, 4] == 1) & (x == 0))
+                go_left = np.where(missing, self.links[nodes, 3] == 1, go_left)
+            nodes = np.where(go_left, self.links[nodes, 1], self.links[nodes, 2])
+
+        leaf_values = self.value[nodes]
+        return np.column_stack([leaf_values[:, member['trees']].sum(axis=1) for member in self.members])
+
+    def _member_sums_numba(self, X, n_jobs):
+        import numba
+        sums = np.zeros((len(X), len(self.members)))
+        previous_threads = numba.get_num_threads()
+        numba.set_num_threads(max(1, min(n_jobs, numba.config.NUMBA_NUM_THREADS)))
+        try:
+            _compiled_kernel()(self._inputs(X), self.threshold, self.links, self.value, self.roots,
+                               self.tree_depth, self.tree_member, self.block_rows,
+                               self._check_missing(X), sums)
+        finally:
+            numba.set_num_threads(previous_threads)
+        return sums
+
+    def _soft_vote(self, sums):
+        # Positive-class probability of each member, averaged with the voting weights
+        positive = np.zeros(len(sums))
+        for index, (member, weight) in enumerate(zip(self.members, self.weights)):
+            if member['output'] == 'sigmoid':
+                margin = member['bias'] + sums[:, index]
+                positive += weight / (1.0 + np.exp(-member['scale'] * margin))
+            else:
+                positive += weight * sums[:, index] / (member['trees'].stop - member['trees'].start)
+        return positive / self.weights.sum()
+
+    def predict_proba(self, X):
+        """
+        Averaged soft-vote probabilities, shape (rows, 2)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected input with {self.n_features_in_} features, got shape {X.shape}")
+
+        n_jobs = self.n_jobs or os.cpu_count() or 1
+        if self.backend == 'numba':
+            sums = self._member_sums_numba(X, n_jobs)
+        else:
+            # numpy releases the GIL in the large indexing operations
+            block_rows = 8 * self.block_rows
+            blocks = [X[start:start + block_rows] for start in range(0, len(X), block_rows)]
+            with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, len(blocks)))) as executor:
+                sums = list(executor.map(self._member_sums_numpy, blocks))
+            sums = np.concatenate(sums) if sums else np.zeros((0, len(self.members)))
+
+        positive = self._soft_vote(sums)
+        return np.column_stack([1.0 - positive, positive])
+
+    def predict_with_proba(self, X):
+        """
+        Labels and probabilities from a single pass through the trees
+        """
+        proba = self.predict_proba(X)
+        labels = self.classes_[np.argmax(proba, axis=1)]
+        return labels, proba
+
+    def predict(self, X):
+        return self.predict_with_proba(X)[0]
+
+
+def compile_ensemble(model, n_jobs=None):
+    """
+    Export a fitted soft-voting ensemble into a CompiledEnsemble
+
+    Args:
+        model: Fitted VotingClassifier (voting='soft') of XGBoost, LightGBM
+            and RandomForest classifiers
+        n_jobs: Number of threads used for prediction (default: number of CPUs)
+
+    Returns:
+        CompiledEnsemble giving the same probabilities as model.predict_proba
+    """
+    if type(model).__name__ != 'VotingClassifier' or model.voting != 'soft':
+        raise TypeError("Only soft-voting VotingClassifier models can be compiled")
+    if len(model.classes_) != 2:
+        raise ValueError("Only binary classifiers can be compiled")
+
+    members = []
+    for estimator in model.estimators_:
+        exporter = EXPORTERS.get(type(estimator).__name__)
+        if exporter is None:
+            raise TypeError(f"Unsupported ensemble member {type(estimator).__name__}")
+        members.append(exporter(estimator))
+
+    return CompiledEnsemble(members, model.weights, model.classes_, model.n_features_in_, n_jobs=n_jobs)
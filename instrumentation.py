@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import contextlib
+from collections import deque
+
+# Spans kept in memory; a long-running server drops the oldest
+MAX_SPANS = 100000
+
+_spans = deque(maxlen=MAX_SPANS)
+_local = threading.local()
+_origin = time.perf_counter()
+
+# Seconds between RSS samples while a main-thread span is open
+RSS_SAMPLE_SECONDS = 0.01
+
+# Open main-thread spans, which the sampler raises to the current RSS
+_main_spans = []
+_sampling = threading.Event()
+_sampler = None
+
+
+def _current_rss_mb():
+    # Resident set size now on Linux, None where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _process_peak_rss_mb():
+    # Peak RSS of the whole process; only read, never reset, so that peaks
+    # measured around the pipeline (e.g. by the benchmarks) stay valid
+    import resource
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _sample_rss():
+    while True:
+        _sampling.wait()
+        time.sleep(RSS_SAMPLE_SECONDS)
+        # Spans opened after the sample are not credited with it
+        open_spans = list(_main_spans)
+        rss = _current_rss_mb()
+        for record in open_spans:
+            record._peak = max(record._peak, rss)
+
+
+def _start_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_sample_rss, name="rss-sampler", daemon=True)
+        _sampler.start()
+    _sampling.set()
+
+
+def _forget_sampler():
+    # A forked child has no sampler thread and no open spans of its own
+    global _sampler
+    _sampler = None
+    _main_spans.clear()
+    _sampling.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_sampler)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class Span:
+    """
+    One timed section of a run; rows can be set while it is open
+    """
+    __slots__ = ("name", "parent", "depth", "thread", "start", "wall_seconds", "cpu_seconds",
+                 "peak_rss_mb", "rows", "_cpu_start", "_peak", "_main")
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.parent = None
+        self.depth = 0
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+
+    def to_dict(self):
+        rows_per_second = self.rows / self.wall_seconds if self.rows and self.wall_seconds else None
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "depth": self.depth,
+            "thread": self.thread,
+            "start": round(self.start, 6),
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            "rows": self.rows,
+            "rows_per_second": rows_per_second
+        }
+
+
+@contextlib.contextmanager
+def span(name, rows=None):
+    """
+    Record wall time, process CPU time, peak RSS and rows of a block
+
+    Spans nest: a span opened inside another records it as its parent, and
+    the parent's peak memory includes its children. Peak memory is tracked on
+    the main thread only, spans in worker threads record times and rows. On
+    Linux it is the largest RSS sampled every RSS_SAMPLE_SECONDS while the
+    span is open (and at its start and end), elsewhere the process peak; the
+    process counters themselves are never reset.
+    """
+    record = Span(name, rows)
+    stack = _stack()
+    record.thread = threading.current_thread().name
+    record._main = threading.current_thread() is threading.main_thread()
+    if stack:
+        record.parent = stack[-1].name
+        record.depth = len(stack)
+    record._peak = 0.0
+    if record._main:
+        rss = _current_rss_mb()
+        if rss is not None:
+            record._peak = rss
+            _main_spans.append(record)
+            _start_sampler()
+
+    stack.append(record)
+    record.start = time.perf_counter() - _origin
+    record._cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall_seconds = time.perf_counter() - _origin - record.start
+        record.cpu_seconds = time.process_time() - record._cpu_start
+        if record._main:
+            if _main_spans and _main_spans[-1] is record:
+                _main_spans.pop()
+                if not _main_spans:
+                    _sampling.clear()
+                record.peak_rss_mb = max(record._peak, _current_rss_mb() or 0.0)
+                for outer in _main_spans:
+                    outer._peak = max(outer._peak, record.peak_rss_mb)
+            else:
+                record.peak_rss_mb = _process_peak_rss_mb()
+        stack.pop()
+        _spans.append(record)
+
+
+def traced(name=None, rows=None, result_rows=None):
+    """
+    Decorator that runs a function inside a span
+
+    Args:
+        name: Span name (default: module.function)
+        rows: Function of the call's arguments returning the row count, e.g.
+            lambda df, *args, **kwargs: len(df)
+        result_rows: Function of the return value returning the row count
+    """
+    def decorator(function):
+        span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            n_rows = None
+            if rows is not None:
+                try:
+                    n_rows = rows(*args, **kwargs)
+                except Exception:
+                    n_rows = None
+            with span(span_name, n_rows) as record:
+                result = function(*args, **kwargs)
+                if result_rows is not None:
+                    try:
+                        record.rows = result_rows(result)
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return decorator
+
+
+def spans():
+    return [record.to_dict() for record in _spans]
+
+
+def reset():
+    _spans.clear()
+
+
+def write_trace(path, metadata=None):
+    """
+    Write the recorded spans as JSON, in the order they finished
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    trace = {
+        "metadata": {"pid": os.getpid(), "argv": sys.argv, "peak_per_span": _current_rss_mb() is not None,
+                     "rss_sample_seconds": RSS_SAMPLE_SECONDS, **(metadata or {})},
+        "spans": spans()
+    }
+    with open(path, "w") as f:
+        json.dump(trace, f, indent=2)
+    return path
+
+
+def summary_lines(max_depth=1):
+    """
+    One line per span up to max_depth, in the order they started
+    """
+    lines = []
+    for record in sorted(_spans, key=lambda record: record.start):
+        if record.depth > max_depth:
+            continue
+        peak = f"{record.peak_rss_mb:8.0f} MB" if record.peak_rss_mb is not None else " " * 11
+        rows = f"  {record.rows} rows" if record.rows else ""
+        lines.append(f"{'  ' * record.depth}{record.name:<{40 - 2 * record.depth}} {record.wall_seconds:9.3f}s "
+                     f"wall {record.cpu_seconds:9.3f}s cpu {peak}{rows}")
+    return lines
+
+
+@contextlib.contextmanager
+def profiled(path=None):
+    """
+    Run a block under cProfile and dump the statistics to path (no-op without a path)
+    """
+    if not path:
+        yield None
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        profiler.dump_stats(path)
+        print(f"Profile written to {path} (view with: python -m pstats {path})", file=sys.stderr)
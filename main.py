@@ -3,69 +3,166 @@ import sys
 import time
 import traceback
 import argparse
+import glob
 import pandas as pd
 import numpy as np
-from preprocessing import load_data, preprocess_data, oversample_data, feature_selection
-from modeling import build_models, train_evaluate_model
-from evaluation import evaluate_model
-from visualization import analyze_shap_values
+from concurrent.futures import ProcessPoolExecutor
+from preprocessing import preprocess_data, check_input_schema
+from table_io import TABLE_EXTENSIONS, read_table, write_table
+from instrumentation import traced, profiled, write_trace, summary_lines
 
+# Compiling the ensemble takes about a second, which a one-off prediction only
+# wins back on large inputs; the server and batch workers always compile
+COMPILE_MIN_ROWS = 20000
 
-def predict_single_file(model_path, feature_selector_path, input_file, output_file=None):
+# Bundle written by training next to the separate pickles
+DEFAULT_BUNDLE_PATH = "models/bundle"
+
+# Training stages in order; load, oversample, select, cv and shap are cached,
+# evaluate and save write files and are never cached
+TRAINING_STAGES = ("load", "oversample", "select", "cv", "evaluate", "shap", "save")
+# Tuning reuses the data stages of training
+TUNING_STAGES = ("load", "oversample", "select", "tune")
+DEFAULT_PARAMS_FILE = "models/tuned_params.yaml"
+# Part of every stage cache key; bump when the output of a stage changes
+STAGE_CACHE_VERSION = 2
+
+
+def default_preprocessor_path(feature_selector_path):
+    """
+    The preprocessor is saved next to the feature selector at training time
+    """
+    return os.path.join(os.path.dirname(feature_selector_path), "preprocessor.pkl")
+
+
+def model_available(model_path, feature_selector_path):
+    """
+    True if model_path is a model bundle or both pickles exist
+    """
+    from model_bundle import is_bundle
+    return is_bundle(model_path) or (os.path.exists(model_path) and os.path.exists(feature_selector_path))
+
+
+@traced("load_prediction_artifacts")
+def load_prediction_artifacts(model_path, feature_selector_path, preprocessor_path=None,
+                              compile_model=True):
+    """
+    Load the trained model, feature selector and fitted preprocessor
+
+    Models trained before the preprocessor was saved have no preprocessor file;
+    their inputs are then preprocessed with statistics fitted on the input itself.
+    With compile_model the soft-voting ensemble is exported to the array-backed
+    inference engine, falling back to the sklearn model if it cannot be compiled.
+    model_path can also be a model bundle directory, which holds all three and
+    an already compiled ensemble (used regardless of compile_model); the other
+    paths are then ignored and inputs are checked against its schema.
+    """
+    from model_bundle import is_bundle, load_bundle
+    if is_bundle(model_path):
+        bundle = load_bundle(model_path)
+        return bundle.model, bundle.selector, bundle.preprocessor
+
+    import joblib
+    model = joblib.load(model_path)
+    selector = joblib.load(feature_selector_path)
+
+    if compile_model:
+        from inference_engine import compile_ensemble
+        try:
+            model = compile_ensemble(model)
+        except (TypeError, ValueError) as e:
+            print(f"Warning: Using the sklearn model for prediction, it cannot be compiled: {str(e)}")
+
+    if preprocessor_path is None:
+        preprocessor_path = default_preprocessor_path(feature_selector_path)
+    if os.path.exists(preprocessor_path):
+        preprocessor = joblib.load(preprocessor_path)
+    else:
+        print(f"Warning: Preprocessor not found at {preprocessor_path}, "
+              "input will be scaled with its own statistics. Retrain to create it.")
+        preprocessor = None
+
+    return model, selector, preprocessor
+
+
+@traced("predict_dataframe", rows=lambda model, selector, df_input, *args, **kwargs: len(df_input))
+def predict_dataframe(model, selector, df_input, preprocessor=None):
+    """
+    Predict using an already loaded feature table
+
+    Args:
+        model: Trained ensemble model
+        selector: Fitted feature selector
+        df_input: DataFrame with the per-residue features
+        preprocessor: Preprocessor fitted at training time (optional)
+
+    Returns:
+        Copy of df_input with the predicted label and class probabilities
+    """
+    # Bundled models check the input columns before anything is computed
+    if preprocessor is not None:
+        check_input_schema(df_input, preprocessor)
+
+    # Preprocess input data (without labels)
+    X_input, _, feature_names = preprocess_data(df_input, has_labels=False, preprocessor=preprocessor)
+
+    # Apply feature selection
+    X_input_selected = selector.transform(np.asarray(X_input))
+
+    # Make predictions, labels come from the same probabilities
+    if hasattr(model, 'predict_with_proba'):
+        y_pred, y_pred_proba = model.predict_with_proba(X_input_selected)
+    else:
+        y_pred_proba = model.predict_proba(X_input_selected)
+        y_pred = model.classes_[np.argmax(y_pred_proba, axis=1)]
+
+    # Create results dataframe
+    results_df = df_input.copy()
+    results_df['Predicted_Label'] = y_pred
+    results_df['Prediction_Probability_Class_0'] = y_pred_proba[:, 0]
+    results_df['Prediction_Probability_Class_1'] = y_pred_proba[:, 1]
+
+    return results_df
+
+
+@traced("predict_single_file")
+def predict_single_file(model_path, feature_selector_path, input_file, output_file=None,
+                        preprocessor_path=None):
     """
     Predict using a single input file
 
     Args:
         model_path: Path to saved model
         feature_selector_path: Path to saved feature selector
-        input_file: Path to input CSV/Excel file
-        output_file: Path to output file (optional)
+        input_file: Path to input CSV/Excel/Parquet/Feather file
+        output_file: Path to output file (optional, format follows the extension)
+        preprocessor_path: Path to saved preprocessor (default: next to the feature selector)
     """
     try:
         print(f"Loading input file: {input_file}")
 
         # Load input data
-        if input_file.endswith('.csv'):
-            df_input = pd.read_csv(input_file)
-        elif input_file.endswith('.xlsx') or input_file.endswith('.xls'):
-            df_input = pd.read_excel(input_file)
-        else:
-            raise ValueError("Input file must be CSV or Excel format")
+        df_input = read_table(input_file)
 
         print(f"Loaded {len(df_input)} samples from {input_file}")
 
         # Load trained model and feature selector
-        import joblib
-        model = joblib.load(model_path)
-        selector = joblib.load(feature_selector_path)
+        model, selector, preprocessor = load_prediction_artifacts(
+            model_path, feature_selector_path, preprocessor_path,
+            compile_model=len(df_input) >= COMPILE_MIN_ROWS
+        )
 
         print("Loaded trained model and feature selector")
 
-        # Preprocess input data (without labels)
-        X_input, _, feature_names = preprocess_data(df_input, has_labels=False)
-
-        # Apply feature selection
-        X_input_selected = selector.transform(X_input)
-
-        # Make predictions
-        y_pred = model.predict(X_input_selected)
-        y_pred_proba = model.predict_proba(X_input_selected)
-
-        # Create results dataframe
-        results_df = df_input.copy()
-        results_df['Predicted_Label'] = y_pred
-        results_df['Prediction_Probability_Class_0'] = y_pred_proba[:, 0]
-        results_df['Prediction_Probability_Class_1'] = y_pred_proba[:, 1]
+        results_df = predict_dataframe(model, selector, df_input, preprocessor)
+        y_pred = results_df['Predicted_Label'].values
 
         # Save results
         if output_file is None:
             base_name = os.path.splitext(input_file)[0]
             output_file = f"{base_name}_predictions.xlsx"
 
-        if output_file.endswith('.csv'):
-            results_df.to_csv(output_file, index=False)
-        else:
-            results_df.to_excel(output_file, index=False)
+        write_table(results_df, output_file)
 
         print(f"Predictions saved to: {output_file}")
 
@@ -86,66 +183,337 @@ def predict_single_file(model_path, feature_selector_path, input_file, output_fi
         return None
 
 
-def train_model():
+# Model, selector and preprocessor held by each batch worker process
+_batch_model = None
+_batch_selector = None
+_batch_preprocessor = None
+
+
+def _init_batch_worker(model_path, feature_selector_path, preprocessor_path, n_threads):
+    global _batch_model, _batch_selector, _batch_preprocessor
+    _batch_model, _batch_selector, _batch_preprocessor = load_prediction_artifacts(
+        model_path, feature_selector_path, preprocessor_path
+    )
+
+    # Keep workers from oversubscribing the cores the pool already uses
+    if n_threads is not None:
+        if hasattr(_batch_model, 'n_jobs'):
+            _batch_model.n_jobs = n_threads
+        for estimator in getattr(_batch_model, 'estimators_', []):
+            if 'n_jobs' in estimator.get_params():
+                estimator.set_params(n_jobs=n_threads)
+
+
+def _predict_batch_file(input_file):
+    try:
+        df_input = read_table(input_file)
+        results_df = predict_dataframe(_batch_model, _batch_selector, df_input, _batch_preprocessor)
+        return input_file, results_df, None
+    except Exception:
+        return input_file, None, traceback.format_exc()
+
+
+def collect_input_files(input_path):
     """
-    Train the model using training and independent test data
+    Expand a directory or glob pattern into a sorted list of feature files
     """
-    start_time = time.time()
-    report_path = "training_report.txt"
+    if os.path.isdir(input_path):
+        candidates = glob.glob(os.path.join(input_path, '*'))
+    else:
+        candidates = glob.glob(input_path)
 
-    try:
-        # File path configuration
-        train_file = "./train.xlsx"
-        independent_test_file = "./independent_test.xlsx"
+    return sorted(path for path in candidates
+                  if path.lower().endswith(TABLE_EXTENSIONS) and not
+                  os.path.splitext(os.path.basename(path))[0].endswith('_predictions'))
+
+
+def summarize_predictions(results_df):
+    """
+    Per-protein counts of predicted positive and negative residues
+    """
+    summary = results_df.groupby('ProteinID', sort=False)['Predicted_Label'].agg(
+        Total='size', Predicted_Positive=lambda labels: int(np.sum(labels == 1))
+    )
+    summary['Predicted_Negative'] = summary['Total'] - summary['Predicted_Positive']
+    summary['Positive_Rate'] = summary['Predicted_Positive'] / summary['Total']
+    return summary.reset_index()
+
+
+@traced("predict_batch")
+def predict_batch(model_path, feature_selector_path, input_path, output_file=None, n_jobs=None,
+                  preprocessor_path=None):
+    """
+    Predict every feature file in a directory or glob with a worker pool
+
+    Args:
+        model_path: Path to saved model
+        feature_selector_path: Path to saved feature selector
+        input_path: Directory or glob pattern of input feature files
+        output_file: Path to the combined output file (optional)
+        n_jobs: Number of worker processes (default: number of CPUs)
+        preprocessor_path: Path to saved preprocessor (default: next to the feature selector)
+    """
+    input_files = collect_input_files(input_path)
+    if not input_files:
+        print(f"Error: No feature files ({', '.join(TABLE_EXTENSIONS)}) found for: {input_path}")
+        return None
 
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(input_files))
+    n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    print(f"Predicting {len(input_files)} files with {n_jobs} worker processes")
+
+    if output_file is None:
+        output_file = os.path.join("results", "batch_predictions.xlsx")
+    output_dir = os.path.dirname(output_file) or "."
+    per_protein_dir = os.path.join(output_dir, "per_protein")
+    os.makedirs(per_protein_dir, exist_ok=True)
+    extension = os.path.splitext(output_file)[1] or ".xlsx"
+
+    all_results = []
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_batch_worker,
+                             initargs=(model_path, feature_selector_path, preprocessor_path, n_threads)) as executor:
+        for input_file, results_df, error in executor.map(_predict_batch_file, input_files):
+            if error is not None:
+                print(f"Error predicting {input_file}:\n{error}")
+                continue
+
+            # Files without a ProteinID column are named after the file
+            if 'ProteinID' not in results_df.columns:
+                results_df.insert(0, 'ProteinID', os.path.splitext(os.path.basename(input_file))[0])
+
+            for protein_id, protein_df in results_df.groupby('ProteinID', sort=False):
+                write_table(protein_df, os.path.join(per_protein_dir, f"{protein_id}_predictions{extension}"))
+
+            print(f"Predicted {len(results_df)} samples from {input_file}")
+            all_results.append(results_df)
+
+    if not all_results:
+        print("Error: No file could be predicted")
+        return None
+
+    combined_df = pd.concat(all_results, ignore_index=True)
+    write_table(combined_df, output_file)
+    print(f"Combined predictions saved to: {output_file}")
+    print(f"Per-protein predictions saved to: {per_protein_dir}")
+
+    # Print summary
+    summary = summarize_predictions(combined_df)
+    positive_count = int(summary['Predicted_Positive'].sum())
+    total_count = int(summary['Total'].sum())
+    print("\nPrediction Summary:")
+    print(summary.to_string(index=False, formatters={'Positive_Rate': '{:.2%}'.format}))
+    print(f"\nTotal proteins: {len(summary)}")
+    print(f"Total samples: {total_count}")
+    print(f"Predicted positive: {positive_count}")
+    print(f"Predicted negative: {total_count - positive_count}")
+    print(f"Positive rate: {positive_count / total_count:.2%}")
+
+    return combined_df
+
+
+def _prepare_training_data(stages, train_file, independent_test_file, selection_backend, sampler, neighbors,
+                           n_jobs, lean=False):
+    """
+    Run the cached load, oversample and select stages shared by training and tuning
+
+    Returns:
+        Dict with the preprocessed data, the resampling function, the selected
+        training matrix and selector and the key of the select stage, or None
+        when the run stops before the end of feature selection
+    """
+    from preprocessing import load_data, fit_preprocessor, oversample_data, feature_selection
+    from caching import file_fingerprint
+    from functools import partial
+
+    def load():
         print("Loading and preprocessing training data...")
-        # Load and preprocess data
         df_train = load_data(train_file)
-        X_train, y_train, feature_names = preprocess_data(df_train)
+        preprocessor = fit_preprocessor(df_train, lean=lean)
+        X_train, y_train, feature_names = preprocess_data(df_train, preprocessor=preprocessor)
 
         print("Loading and preprocessing independent test data...")
         df_independent = load_data(independent_test_file)
-        X_independent, y_independent, _ = preprocess_data(df_independent)
+        X_independent, y_independent, _ = preprocess_data(df_independent, preprocessor=preprocessor)
+        return {
+            'preprocessor': preprocessor,
+            'X_train': X_train,
+            'y_train': y_train,
+            'feature_names': feature_names,
+            'groups': df_train['ProteinID'].astype(str).values,
+            'X_independent': X_independent,
+            'y_independent': y_independent,
+            'independent_groups': df_independent['ProteinID'].astype(str).values
+        }
+
+    load_key = stages.key("load", file_fingerprint(train_file), file_fingerprint(independent_test_file), lean)
+    data = stages.run("load", load_key, load)
+    if stages.stop_after("load"):
+        return None
+
+    resample = partial(oversample_data, sampler=sampler, neighbors=neighbors)
+
+    def oversample():
+        print(f"Applying oversampling ({sampler})...")
+        return resample(data['X_train'], data['y_train'], n_jobs=n_jobs or -1)
+
+    oversample_key = stages.key("oversample", load_key, sampler, neighbors)
+    X_train_res, y_train_res = stages.run("oversample", oversample_key, oversample)
+    if stages.stop_after("oversample"):
+        return None
 
-        print("Applying oversampling...")
-        X_train_res, y_train_res = oversample_data(X_train, y_train)
+    class_weight = "balanced" if sampler == "class_weight" else None
 
+    def select():
         print("Performing feature selection...")
-        X_train_selected, selected_features, selector = feature_selection(
-            X_train_res, y_train_res, feature_names
-        )
+        return feature_selection(X_train_res, y_train_res, data['feature_names'],
+                                 backend=selection_backend, n_jobs=n_jobs or -1,
+                                 class_weight=class_weight)
 
-        print("Building models...")
-        models = build_models()
-        ensemble_model = models["ensemble"]
+    select_key = stages.key("select", oversample_key, selection_backend, class_weight)
+    X_train_selected, selected_features, selector = stages.run("select", select_key, select)
+    if stages.stop_after("select"):
+        return None
+
+    return {
+        'data': data,
+        'resample': resample,
+        'y_train_res': y_train_res,
+        'X_train_selected': X_train_selected,
+        'selected_features': selected_features,
+        'selector': selector,
+        'select_key': select_key
+    }
+
+
+@traced("train_model")
+def train_model(train_file="./train.xlsx", independent_test_file="./independent_test.xlsx", n_jobs=None,
+                cache_dir="cache", selection_backend="rf", sampler="svmsmote", neighbors="auto",
+                from_stage=None, until_stage=None, shap_samples=1000, params_file=None, lean=False):
+    """
+    Train the model using training and independent test data
+
+    Training runs as the named stages in TRAINING_STAGES. The outputs of
+    load, oversample, select, cv and shap are cached under cache_dir, keyed by a
+    hash of the input files and every parameter upstream of the stage, so a
+    rerun only recomputes the stages whose inputs changed; evaluate and save
+    write files and are never cached. The report lists which stages were
+    cache hits.
 
-        print("Training and evaluating model...")
-        with open(report_path, "w") as report_file:
-            train_evaluate_model(
+    Args:
+        train_file: Path to the training table (CSV/Excel/Parquet/Feather)
+        independent_test_file: Path to the independent test table
+        n_jobs: Thread budget for cross-validation (default: number of CPUs)
+        cache_dir: Directory for cached stage outputs (None disables caching)
+        selection_backend: Importance estimator for Boruta, 'rf' or the faster 'lightgbm'
+        sampler: Oversampler, 'svmsmote', 'smote', 'borderline' or 'class_weight' (no synthetic residues)
+        neighbors: Nearest neighbour algorithm of the oversampler ('auto', 'kd_tree', 'ball_tree', 'brute')
+        from_stage: Recompute from this stage on, taking the earlier ones from the cache
+        until_stage: Stop after this stage
+        shap_samples: Real residues explained by SHAP (stratified sample)
+        params_file: YAML file with member hyperparameters written by the tune mode
+        lean: Keep the features as float32 arrays from preprocessing to inference
+            (about half the memory, see fit_preprocessor)
+    """
+    # Training-only modules are imported here to keep prediction startup light
+    from modeling import build_models, cross_validate_grouped, write_cv_report, balance_class_weights
+    from evaluation import evaluate_model
+    from caching import StageCache
+
+    start_time = time.time()
+    report_path = "training_report.txt"
+    open(report_path, "w").close()
+
+    try:
+        stages = StageCache(TRAINING_STAGES, cache_dir, from_stage, until_stage, STAGE_CACHE_VERSION)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return
+
+    try:
+        prepared = _prepare_training_data(stages, train_file, independent_test_file, selection_backend,
+                                          sampler, neighbors, n_jobs, lean)
+        if prepared is None:
+            return
+        data, resample = prepared['data'], prepared['resample']
+        X_train_selected, y_train_res = prepared['X_train_selected'], prepared['y_train_res']
+        selected_features, selector = prepared['selected_features'], prepared['selector']
+
+        print("Building models...")
+        ensemble_model = build_models(params_file)["ensemble"]
+        if sampler == "class_weight":
+            ensemble_model = balance_class_weights(ensemble_model, data['y_train'])
+
+        def cross_validate():
+            # Folds are grouped by protein and oversampled inside each training
+            # fold; the final model is fitted on the oversampled data in the same pass
+            print("Training and cross-validating model...")
+            return cross_validate_grouped(
                 ensemble_model,
-                X_train_selected,
-                y_train_res,
-                X_independent,
-                y_independent,
-                selector,
-                report_file
+                selector.transform(np.asarray(data['X_train'])),
+                data['y_train'],
+                data['groups'],
+                resample=None if sampler == "class_weight" else resample,
+                final_data=(X_train_selected, y_train_res),
+                n_jobs=n_jobs
             )
 
-        print("Analyzing SHAP values...")
-        os.makedirs("results", exist_ok=True)
-        analyze_shap_values(
-            ensemble_model,
-            X_train_selected,
-            selected_features,
-            "results/shap"
-        )
+        cv_key = stages.key("cv", prepared['select_key'], ensemble_model)
+        cv_result = stages.run("cv", cv_key, cross_validate)
+        ensemble_model = cv_result['final_model']
+        if stages.stop_after("cv"):
+            return
+
+        def evaluate():
+            print("Evaluating model...")
+            with open(report_path, "a") as report_file:
+                write_cv_report(cv_result, data['y_train'], report_file,
+                                cached=stages.status["cv"][0] == "cached")
+                evaluate_model(ensemble_model, selector.transform(np.asarray(data['X_independent'])),
+                               data['y_independent'], report_file, "Independent Test Set",
+                               groups=data['independent_groups'],
+                               output_prefix="results/evaluation/independent_test")
+
+        stages.run("evaluate", None, evaluate)
+        if stages.stop_after("evaluate"):
+            return
 
-        # Save trained model and feature selector
-        import joblib
-        os.makedirs("models", exist_ok=True)
-        joblib.dump(ensemble_model, "models/trained_model.pkl")
-        joblib.dump(selector, "models/feature_selector.pkl")
-        print("Model and feature selector saved to models/ directory")
+        from visualization import explain_ensemble, save_shap_values, plot_shap_values
+
+        def explain():
+            # Real residues only, the synthetic ones carry no information of their own
+            print(f"Analyzing SHAP values on up to {shap_samples} residues...")
+            return explain_ensemble(ensemble_model, selector.transform(np.asarray(data['X_train'])),
+                                    data['y_train'], selected_features, sample_size=shap_samples,
+                                    n_jobs=n_jobs)
+
+        shap_key = stages.key("shap", cv_key, shap_samples)
+        shap_result = stages.run("shap", shap_key, explain)
+        if shap_result is not None:
+            save_shap_values(shap_result, "results/shap/shap_values.npz")
+            plot_shap_values(shap_result, "results/shap")
+        if stages.stop_after("shap"):
+            return
+
+        def save():
+            # Save trained model and feature selector
+            import joblib
+            os.makedirs("models", exist_ok=True)
+            joblib.dump(ensemble_model, "models/trained_model.pkl")
+            joblib.dump(selector, "models/feature_selector.pkl")
+            joblib.dump(data['preprocessor'], "models/preprocessor.pkl")
+            print("Model, feature selector and preprocessor saved to models/ directory")
+
+            from model_bundle import save_bundle
+            save_bundle(DEFAULT_BUNDLE_PATH, ensemble_model, selector, data['preprocessor'], metadata={
+                'train_file': os.path.abspath(train_file),
+                'sampler': sampler,
+                'selection_backend': selection_backend,
+                'params_file': params_file,
+                'cv_mcc': float(np.mean(cv_result['fold_mcc']))
+            })
+            print(f"Model bundle saved to {DEFAULT_BUNDLE_PATH}")
+
+        stages.run("save", None, save)
 
     except Exception as e:
         with open(report_path, "a") as f:
@@ -153,9 +521,67 @@ def train_model():
         print(f"Error: {traceback.format_exc()}")
 
     finally:
+        stage_lines = stages.report()
+        with open(report_path, "a") as f:
+            f.write("\n===== Training Stages =====\n")
+            f.write("\n".join(stage_lines) + "\n")
+        print("Stages: " + ", ".join(f"{stage} {status[0]}" for stage, status in stages.status.items()))
         print(f"Total training time: {time.time() - start_time:.2f}s")
 
 
+@traced("tune_model")
+def tune_model(train_file="./train.xlsx", independent_test_file="./independent_test.xlsx", n_jobs=None,
+               cache_dir="cache", selection_backend="rf", sampler="svmsmote", neighbors="auto",
+               params_file=DEFAULT_PARAMS_FILE, method="halving", n_candidates=27, lean=False):
+    """
+    Tune the hyperparameters of the ensemble members and write them to a YAML file
+
+    The data stages are shared with (and cached like) train mode, so tuning
+    searches the same selected features the model is trained on. Each member
+    is searched with successive halving or Hyperband on protein-grouped folds,
+    trials running in parallel with one thread each under the n_jobs budget.
+
+    Args:
+        params_file: Output YAML file, read by train mode through --params-file
+        method: 'halving' or 'hyperband'
+        n_candidates: Random configurations per member
+        Other arguments as for train_model
+    """
+    from caching import StageCache
+    from tuning import tune_ensemble, write_params_file
+
+    start_time = time.time()
+    try:
+        stages = StageCache(TUNING_STAGES, cache_dir, version=STAGE_CACHE_VERSION)
+        prepared = _prepare_training_data(stages, train_file, independent_test_file, selection_backend,
+                                          sampler, neighbors, n_jobs, lean)
+        data, selector = prepared['data'], prepared['selector']
+
+        def tune():
+            return tune_ensemble(
+                selector.transform(np.asarray(data['X_train'])),
+                data['y_train'],
+                data['groups'],
+                n_candidates=n_candidates,
+                method=method,
+                resample=None if sampler == "class_weight" else prepared['resample'],
+                balance=sampler == "class_weight",
+                n_jobs=n_jobs
+            )
+
+        tune_key = stages.key("tune", prepared['select_key'], method, n_candidates)
+        results = stages.run("tune", tune_key, tune)
+        write_params_file(results, params_file, method)
+        print(f"Tuned parameters written to {params_file}")
+        print("Stages: " + ", ".join(f"{stage} {status[0]}" for stage, status in stages.status.items()))
+
+    except Exception:
+        print(f"Error: {traceback.format_exc()}")
+
+    finally:
+        print(f"Total tuning time: {time.time() - start_time:.2f}s")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Machine Learning Pipeline for Protein Analysis",
@@ -165,38 +591,90 @@ Examples:
   # Train the model
   python main.py --mode train
 
+  # Train from Parquet tables (convert existing xlsx files with table_io.py)
+  python table_io.py train.xlsx independent_test.xlsx --to parquet
+  python main.py --mode train --train-file train.parquet --test-file independent_test.parquet
+
+  # Faster Boruta feature selection with LightGBM importances
+  python main.py --mode train --selection-backend lightgbm
+
+  # Plain SMOTE with a KD-tree neighbour search, or class weights without synthetic residues
+  python main.py --mode train --sampler smote --neighbors kd_tree
+  python main.py --mode train --sampler class_weight
+
+  # Stop after feature selection, later rerun only cross-validation and the stages after it
+  python main.py --mode train --until-stage select
+  python main.py --mode train --from-stage cv
+
+  # Tune the ensemble members with Hyperband on 4 CPUs, then train with the tuned parameters
+  python main.py --mode tune --tune-method hyperband --jobs 4
+  python main.py --mode train --params-file models/tuned_params.yaml
+
   # Predict using a single file
   python main.py --mode predict --input ./Input_data/1WQW_A_feature.csv
 
   # Predict with custom output file
   python main.py --mode predict --input ./Input_data/1WQW_A_feature.csv --output ./results/predictions.xlsx
+
+  # Predict every feature file in a directory (or glob) with 4 worker processes
+  python main.py --mode batch --input ./Input_data --output ./results/batch_predictions.xlsx --jobs 4
+
+  # Stream a proteome-scale table in chunks of 50000 residues with constant memory
+  python main.py --mode stream --input ./proteome_features.parquet --output ./results/proteome_predictions.parquet
+
+  # Score inside a shell pipeline (CSV or JSON Lines on stdin and stdout)
+  zcat features.csv.gz | python main.py --mode stream --input - --output - | gzip > predictions.csv.gz
+
+  # Keep the model loaded in a local prediction server
+  python main.py --mode serve --port 8765
+  python prediction_client.py --input ./Input_data/1WQW_A_feature.csv --output ./results/predictions.csv
         """
     )
 
     parser.add_argument(
         "--mode",
-        choices=["train", "predict"],
+        choices=["train", "tune", "predict", "batch", "stream", "serve"],
         required=True,
-        help="Mode: 'train' to train the model, 'predict' to predict using existing model"
+        help="Mode: 'train' to train the model, 'tune' to search the model hyperparameters, "
+             "'predict' to predict using existing model, "
+             "'batch' to predict a directory or glob of files, 'stream' to predict a large table "
+             "in chunks, 'serve' to run a resident prediction server"
     )
 
     parser.add_argument(
         "--input",
         type=str,
-        help="Input file path for prediction (CSV or Excel format)"
+        help="Input file path for prediction (CSV, Excel, Parquet or Feather format); "
+             "a directory or glob pattern in batch mode; '-' reads stdin in stream mode"
     )
 
     parser.add_argument(
         "--output",
         type=str,
-        help="Output file path for predictions (optional)"
+        help="Output file path for predictions (optional); .csv, .xlsx, .parquet or .feather; "
+             "'-' writes stdout in stream mode"
+    )
+
+    parser.add_argument(
+        "--train-file",
+        type=str,
+        default="./train.xlsx",
+        help="Training table for train and tune modes (default: ./train.xlsx)"
+    )
+
+    parser.add_argument(
+        "--test-file",
+        type=str,
+        default="./independent_test.xlsx",
+        help="Independent test table for train and tune modes (default: ./independent_test.xlsx)"
     )
 
     parser.add_argument(
         "--model",
         type=str,
         default="models/trained_model.pkl",
-        help="Path to trained model file (default: models/trained_model.pkl)"
+        help="Path to trained model file or model bundle directory, e.g. models/bundle "
+             "(default: models/trained_model.pkl)"
     )
 
     parser.add_argument(
@@ -206,6 +684,135 @@ Examples:
         help="Path to feature selector file (default: models/feature_selector.pkl)"
     )
 
+    parser.add_argument(
+        "--preprocessor",
+        type=str,
+        help="Path to fitted preprocessor file (default: preprocessor.pkl next to the feature selector)"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of worker processes for batch prediction, or the thread budget of "
+             "cross-validation in train mode, parallel trials in tune mode (default: number of CPUs)"
+    )
+
+    parser.add_argument(
+        "--selection-backend",
+        choices=["rf", "lightgbm"],
+        default="rf",
+        help="Importance estimator for Boruta feature selection in train and tune modes (default: rf)"
+    )
+
+    parser.add_argument(
+        "--sampler",
+        choices=["svmsmote", "smote", "borderline", "class_weight"],
+        default="svmsmote",
+        help="Oversampler in train and tune modes; 'class_weight' adds no synthetic residues and weights "
+             "the classes in the models instead (default: svmsmote)"
+    )
+
+    parser.add_argument(
+        "--neighbors",
+        choices=["auto", "kd_tree", "ball_tree", "brute"],
+        default="auto",
+        help="Nearest neighbour algorithm of the oversampler (default: auto)"
+    )
+
+    parser.add_argument(
+        "--from-stage",
+        choices=TRAINING_STAGES,
+        help="Train mode: recompute from this stage on, taking the earlier stages from the cache"
+    )
+
+    parser.add_argument(
+        "--until-stage",
+        choices=TRAINING_STAGES,
+        help="Train mode: stop after this stage"
+    )
+
+    parser.add_argument(
+        "--shap-samples",
+        type=int,
+        default=1000,
+        help="Train mode: real residues explained by SHAP, a stratified sample (default: 1000)"
+    )
+
+    parser.add_argument(
+        "--params-file",
+        type=str,
+        help="YAML file of member hyperparameters: read in train mode, written in tune mode "
+             f"(default there: {DEFAULT_PARAMS_FILE})"
+    )
+
+    parser.add_argument(
+        "--tune-method",
+        choices=["halving", "hyperband"],
+        default="halving",
+        help="Tune mode: successive halving or Hyperband (default: halving)"
+    )
+
+    parser.add_argument(
+        "--tune-candidates",
+        type=int,
+        default=27,
+        help="Tune mode: random configurations per ensemble member (default: 27)"
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="cache",
+        help="Directory for cached training results, '' disables caching (default: cache)"
+    )
+
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=50000,
+        help="Residues per chunk in stream mode (default: 50000)"
+    )
+
+    parser.add_argument(
+        "--stream-format",
+        choices=["csv", "jsonl"],
+        default="csv",
+        help="Line format of stdin/stdout in stream mode (default: csv)"
+    )
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Interface for the prediction server to bind (default: 127.0.0.1)"
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port for the prediction server (default: 8765)"
+    )
+
+    parser.add_argument(
+        "--lean",
+        action="store_true",
+        help="Train on float32 feature arrays instead of float64 DataFrames to save memory; "
+             "predictions with the saved preprocessor use the same layout"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write the wall time, CPU time, peak memory and rows of every stage to this JSON file"
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Run under cProfile and write the statistics to this file"
+    )
+
     # Handle legacy command line format: python main.py input_file
     if len(sys.argv) == 2 and not sys.argv[1].startswith('--'):
         input_file = sys.argv[1]
@@ -215,7 +822,7 @@ Examples:
         model_path = "models/trained_model.pkl"
         selector_path = "models/feature_selector.pkl"
 
-        if not os.path.exists(model_path) or not os.path.exists(selector_path):
+        if not model_available(model_path, selector_path):
             print("Error: Trained model not found. Please train the model first:")
             print("python main.py --mode train")
             return
@@ -225,9 +832,32 @@ Examples:
 
     args = parser.parse_args()
 
+    try:
+        with profiled(args.profile):
+            run_mode(args, parser)
+    finally:
+        if args.trace:
+            write_trace(args.trace, {"mode": args.mode})
+            # The summary goes to stderr so that it never mixes with streamed predictions
+            print("\n".join(["===== Trace ====="] + summary_lines()), file=sys.stderr)
+            print(f"Trace written to {args.trace}", file=sys.stderr)
+
+
+def run_mode(args, parser):
+    """
+    Run the mode selected on the command line
+    """
     if args.mode == "train":
         print("Starting model training...")
-        train_model()
+        train_model(args.train_file, args.test_file, args.jobs, args.cache_dir or None, args.selection_backend,
+                    args.sampler, args.neighbors, args.from_stage, args.until_stage, args.shap_samples,
+                    args.params_file, args.lean)
+
+    elif args.mode == "tune":
+        print("Starting hyperparameter tuning...")
+        tune_model(args.train_file, args.test_file, args.jobs, args.cache_dir or None, args.selection_backend,
+                   args.sampler, args.neighbors, args.params_file or DEFAULT_PARAMS_FILE, args.tune_method,
+                   args.tune_candidates, args.lean)
 
     elif args.mode == "predict":
         if not args.input:
@@ -240,13 +870,72 @@ Examples:
             return
 
         # Check if model files exist
-        if not os.path.exists(args.model) or not os.path.exists(args.selector):
+        if not model_available(args.model, args.selector):
             print("Error: Trained model not found. Please train the model first:")
             print("python main.py --mode train")
             return
 
         print(f"Starting prediction for file: {args.input}")
-        predict_single_file(args.model, args.selector, args.input, args.output)
+        predict_single_file(args.model, args.selector, args.input, args.output, args.preprocessor)
+
+    elif args.mode == "batch":
+        if not args.input:
+            print("Error: --input argument is required for batch mode")
+            parser.print_help()
+            return
+
+        # Check if model files exist
+        if not model_available(args.model, args.selector):
+            print("Error: Trained model not found. Please train the model first:")
+            print("python main.py --mode train")
+            return
+
+        print(f"Starting batch prediction for: {args.input}")
+        predict_batch(args.model, args.selector, args.input, args.output, args.jobs, args.preprocessor)
+
+    elif args.mode == "stream":
+        if not args.input:
+            print("Error: --input argument is required for stream mode ('-' for stdin)")
+            parser.print_help()
+            return
+
+        if args.input != "-" and not os.path.exists(args.input):
+            print(f"Error: Input file does not exist: {args.input}")
+            return
+
+        # Check if model files exist
+        if not model_available(args.model, args.selector):
+            print("Error: Trained model not found. Please train the model first:", file=sys.stderr)
+            print("python main.py --mode train", file=sys.stderr)
+            sys.exit(1)
+
+        output_file = args.output
+        if output_file is None:
+            base_name, extension = os.path.splitext(args.input)
+            output_file = "-" if args.input == "-" else f"{base_name}_predictions{extension}"
+
+        from prediction_stream import predict_stream
+        try:
+            summary = predict_stream(args.model, args.selector, args.input, output_file, args.chunk_rows,
+                                     args.preprocessor, args.stream_format)
+        except Exception as e:
+            print(f"Error in stream prediction: {str(e)}", file=sys.stderr)
+            print(f"Traceback: {traceback.format_exc()}", file=sys.stderr)
+            sys.exit(1)
+
+        print(f"Streamed {summary['rows']} samples in {summary['chunks']} chunks, "
+              f"predicted positive: {summary['positive']}",
+              file=sys.stderr if output_file == "-" else sys.stdout)
+
+    elif args.mode == "serve":
+        # Check if model files exist
+        if not model_available(args.model, args.selector):
+            print("Error: Trained model not found. Please train the model first:")
+            print("python main.py --mode train")
+            return
+
+        from prediction_server import serve
+        serve(args.model, args.selector, args.host, args.port, args.preprocessor)
 
 
 if __name__ == "__main__":
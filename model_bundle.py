@@ -0,0 +1,259 @@
+"""
+Versioned model bundle: ensemble, feature selection and preprocessing in one directory
+
+    models/bundle/
+        manifest.json     format version, feature layout, input schema, training metadata
+        arrays/*.npy      preprocessing statistics, selected-feature mask and the
+                          compiled ensemble's node arrays, memory-mapped on load
+        ensemble.joblib   the fitted scikit-learn ensemble, only unpickled when
+                          the compiled ensemble is missing or not wanted
+
+Loading a bundle reads the manifest and maps the arrays, so it needs neither
+XGBoost, LightGBM nor the pickled Boruta object, and worker processes that
+load the same bundle share its pages. Convert existing pickles with:
+
+    python model_bundle.py models/trained_model.pkl models/feature_selector.pkl --output models/bundle
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+
+BUNDLE_FORMAT = "alloef-model-bundle"
+# Bump when the layout changes; loaders refuse bundles newer than they know
+BUNDLE_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+ENSEMBLE_FILE = "ensemble.joblib"
+
+PREPROCESSOR_ARRAYS = ('fill_values', 'scale', 'min')
+
+
+def is_bundle(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def _library_versions():
+    versions = {'python': sys.version.split()[0], 'numpy': np.__version__}
+    for name in ('sklearn', 'xgboost', 'lightgbm', 'pandas'):
+        module = sys.modules.get(name)
+        if module is not None:
+            versions[name] = getattr(module, '__version__', None)
+    return versions
+
+
+def required_columns(preprocessor, support):
+    """
+    Input columns behind the selected features, in preprocessed order
+
+    The one-hot STRUCTURE features all come from the STRUCTURE column; every
+    numerical feature is an input column of the same name.
+    """
+    structure_classes = preprocessor['structure_classes']
+    support = np.asarray(support, dtype=bool)
+    columns = ['STRUCTURE'] if support[:len(structure_classes)].any() else []
+    columns += [name for name, selected in zip(preprocessor['numerical_features'],
+                                               support[len(structure_classes):]) if selected]
+    return columns
+
+
+def save_bundle(path, model, selector, preprocessor, metadata=None):
+    """
+    Write a model bundle, replacing an existing one at path
+
+    Args:
+        path: Bundle directory
+        model: Fitted soft-voting ensemble
+        selector: Fitted FeatureMask (or anything with support_)
+        preprocessor: Dictionary from preprocessing.fit_preprocessor
+        metadata: Extra JSON-serializable training information for the manifest
+
+    Returns:
+        The manifest
+    """
+    import joblib
+    from inference_engine import compile_ensemble
+
+    support = np.asarray(selector.support_, dtype=bool)
+    feature_names = list(preprocessor['structure_classes']) + list(preprocessor['numerical_features'])
+    if len(support) != len(feature_names):
+        raise ValueError(f"The selector has {len(support)} features, the preprocessor produces {len(feature_names)}")
+
+    arrays = {f"preprocessor.{name}": np.asarray(preprocessor[name], dtype=np.float64)
+              for name in PREPROCESSOR_ARRAYS}
+    arrays["selector.support"] = support
+
+    engine_config = None
+    try:
+        engine_arrays, engine_config = compile_ensemble(model).to_arrays()
+        arrays.update({f"engine.{name}": np.ascontiguousarray(value) for name, value in engine_arrays.items()})
+    except (TypeError, ValueError) as e:
+        print(f"Warning: The bundle holds only the sklearn model, it cannot be compiled: {str(e)}")
+
+    # Write next to the target and swap it in, so a failed save leaves the old bundle intact
+    tmp_path = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_path, "arrays"))
+    for name, value in arrays.items():
+        np.save(os.path.join(tmp_path, "arrays", f"{name}.npy"), value, allow_pickle=False)
+    joblib.dump(model, os.path.join(tmp_path, ENSEMBLE_FILE))
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': BUNDLE_VERSION,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'libraries': _library_versions(),
+        'feature_names': feature_names,
+        'selected_features': [name for name, selected in zip(feature_names, support) if selected],
+        'preprocessor': {
+            'structure_classes': list(preprocessor['structure_classes']),
+            'numerical_features': list(preprocessor['numerical_features']),
+            'lean': bool(preprocessor.get('lean', False))
+        },
+        'input_schema': {'required_columns': required_columns(preprocessor, support)},
+        'engine': engine_config,
+        'arrays': {name: {'dtype': value.dtype.str, 'shape': list(value.shape)} for name, value in arrays.items()},
+        'metadata': metadata or {}
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return manifest
+
+
+class ModelBundle:
+    """
+    A loaded bundle; model, selector and preprocessor plug into main.predict_dataframe
+    """
+
+    def __init__(self, path, manifest, arrays, model, selector, preprocessor):
+        self.path = path
+        self.manifest = manifest
+        self.arrays = arrays
+        self.model = model
+        self.selector = selector
+        self.preprocessor = preprocessor
+
+    @property
+    def selected_features(self):
+        return self.manifest['selected_features']
+
+    @property
+    def required_columns(self):
+        return self.manifest['input_schema']['required_columns']
+
+    def check_schema(self, df):
+        """
+        Raise ValueError if df lacks an input column the selected features come from
+        """
+        from preprocessing import check_input_schema
+        check_input_schema(df, self.preprocessor)
+
+
+def _load_arrays(path, manifest, mmap):
+    arrays = {}
+    for name, spec in manifest['arrays'].items():
+        value = np.load(os.path.join(path, "arrays", f"{name}.npy"), mmap_mode='r' if mmap else None,
+                        allow_pickle=False)
+        if value.dtype.str != spec['dtype'] or list(value.shape) != spec['shape']:
+            raise ValueError(f"Array {name} of bundle {path} is {value.dtype.str} {list(value.shape)}, "
+                             f"the manifest says {spec['dtype']} {spec['shape']}")
+        arrays[name] = value
+    return arrays
+
+
+def load_bundle(path, mmap=True, use_engine=True, n_jobs=None):
+    """
+    Load a model bundle
+
+    Args:
+        path: Bundle directory
+        mmap: Memory-map the arrays instead of reading them
+        use_engine: Predict with the compiled ensemble stored in the bundle;
+            otherwise (or if it has none) the sklearn ensemble is unpickled
+        n_jobs: Threads of the compiled ensemble (default: number of CPUs)
+
+    Returns:
+        ModelBundle
+    """
+    from preprocessing import FeatureMask
+
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        raise ValueError(f"{path} is not a model bundle, {MANIFEST_FILE} is missing")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"{path} is not a model bundle (format {manifest.get('format')!r})")
+    if manifest.get('version', 0) > BUNDLE_VERSION:
+        raise ValueError(f"Bundle {path} has format version {manifest['version']}, this version of the "
+                         f"code reads up to {BUNDLE_VERSION}; update the code or re-export the bundle")
+
+    arrays = _load_arrays(path, manifest, mmap)
+
+    preprocessor = {
+        'structure_classes': manifest['preprocessor']['structure_classes'],
+        'numerical_features': manifest['preprocessor']['numerical_features'],
+        'required_columns': manifest['input_schema']['required_columns']
+    }
+    for name in PREPROCESSOR_ARRAYS:
+        preprocessor[name] = arrays[f"preprocessor.{name}"]
+    if manifest['preprocessor']['lean']:
+        preprocessor['lean'] = True
+
+    selector = FeatureMask(arrays["selector.support"])
+
+    if use_engine and manifest['engine'] is not None:
+        from inference_engine import CompiledEnsemble
+        engine_arrays = {name: arrays[f"engine.{name}"] for name in CompiledEnsemble.ARRAYS}
+        model = CompiledEnsemble.from_arrays(engine_arrays, manifest['engine'], n_jobs=n_jobs)
+    else:
+        import joblib
+        model = joblib.load(os.path.join(path, ENSEMBLE_FILE))
+
+    return ModelBundle(path, manifest, arrays, model, selector, preprocessor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert trained model pickles into a model bundle, "
+                                                 "or describe a bundle")
+    parser.add_argument("model", help="Trained model pickle, or a bundle directory to describe")
+    parser.add_argument("selector", nargs="?", help="Feature selector pickle")
+    parser.add_argument("--preprocessor", help="Preprocessor pickle (default: next to the feature selector)")
+    parser.add_argument("--output", default="models/bundle", help="Bundle directory (default: models/bundle)")
+    args = parser.parse_args()
+
+    if is_bundle(args.model):
+        bundle = load_bundle(args.model)
+        manifest = bundle.manifest
+        print(f"{args.model}: version {manifest['version']}, created {manifest['created']}")
+        print(f"{len(manifest['selected_features'])} of {len(manifest['feature_names'])} features selected, "
+              f"{len(bundle.required_columns)} input columns required")
+        if manifest['engine'] is not None:
+            print(f"Compiled ensemble: {len(bundle.arrays['engine.roots'])} trees")
+        else:
+            print("Compiled ensemble: none, predictions use the sklearn model")
+        print(f"Libraries: {', '.join(f'{name} {version}' for name, version in manifest['libraries'].items())}")
+        return
+
+    if args.selector is None:
+        sys.exit("Error: the feature selector pickle is required to build a bundle")
+
+    import joblib
+    preprocessor_path = args.preprocessor or os.path.join(os.path.dirname(args.selector), "preprocessor.pkl")
+    if not os.path.exists(preprocessor_path):
+        sys.exit(f"Error: Preprocessor not found at {preprocessor_path}; models trained before it was "
+                 "saved must be retrained to be bundled")
+
+    manifest = save_bundle(args.output, joblib.load(args.model), joblib.load(args.selector),
+                           joblib.load(preprocessor_path), metadata={'converted_from': args.model})
+    print(f"Bundle written to {args.output} ({len(manifest['selected_features'])} selected features)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,74 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
 from xgboost import XGBClassifier
 from lightgbm import LGBMClassifier
-from sklearn.model_selection import cross_val_score
-from sklearn.metrics import make_scorer, matthews_corrcoef
+from sklearn.model_selection import StratifiedGroupKFold
+from sklearn.metrics import matthews_corrcoef, roc_auc_score
+from instrumentation import traced
 
 
-def build_models():
-    xgb = XGBClassifier(
+# Hyperparameters of the ensemble members; a YAML file written by the tune
+# mode (member name -> parameters) overrides them
+DEFAULT_PARAMS = {
+    "xgb": dict(
         tree_method='hist', random_state=42,
         colsample_bytree=1.0, learning_rate=0.083,
         max_depth=10, n_estimators=200, subsample=1.0
-    )
-
-    lgbm = LGBMClassifier(
+    ),
+    "lgbm": dict(
         is_unbalance=True, random_state=42,
         colsample_bytree=0.72, learning_rate=0.1,
         max_depth=10, n_estimators=200, subsample=0.82
-    )
-
-    rf = RandomForestClassifier(
+    ),
+    "rf": dict(
         random_state=42, max_depth=14, min_samples_leaf=1,
         min_samples_split=2, n_estimators=198
     )
+}
+
+MEMBER_CLASSES = {"xgb": XGBClassifier, "lgbm": LGBMClassifier, "rf": RandomForestClassifier}
+
+
+def load_model_params(params_file):
+    """
+    Read member hyperparameters from a YAML file
+
+    Returns:
+        Dict of member name -> parameters overriding DEFAULT_PARAMS
+    """
+    import yaml
+    with open(params_file) as f:
+        config = yaml.safe_load(f) or {}
+
+    params = {}
+    for name, member_params in config.items():
+        if name not in DEFAULT_PARAMS:
+            # Other sections (e.g. the tuning scores) are informational
+            continue
+        if not isinstance(member_params, dict):
+            raise ValueError(f"{params_file}: parameters of '{name}' must be a mapping")
+        params[name] = member_params
+    return params
+
+
+def make_member(name, params=None):
+    return MEMBER_CLASSES[name](**{**DEFAULT_PARAMS[name], **(params or {})})
+
+
+def build_models(params_file=None):
+    """
+    Ensemble members and the soft-voting ensemble
+
+    Args:
+        params_file: YAML file with tuned parameters per member (default: DEFAULT_PARAMS)
+    """
+    params = load_model_params(params_file) if params_file else {}
+    xgb = make_member("xgb", params.get("xgb"))
+    lgbm = make_member("lgbm", params.get("lgbm"))
+    rf = make_member("rf", params.get("rf"))
 
     return {
         "xgb": xgb,
@@ -34,16 +81,129 @@ def build_models():
     }
 
 
-def train_evaluate_model(model, X_train, y_train,
-                         X_independent, y_independent, selector, report_file):
+def balance_class_weights(model, y):
+    """
+    Weight the minority class instead of oversampling it
+
+    XGBoost gets scale_pos_weight = negatives / positives, the RandomForest
+    balanced class weights; LightGBM already uses is_unbalance.
+    """
+    y = np.asarray(y).astype(int)
+    n_positive = max(int(np.sum(y == 1)), 1)
+    for _, estimator in getattr(model, 'estimators', [('model', model)]):
+        if isinstance(estimator, XGBClassifier):
+            estimator.set_params(scale_pos_weight=(len(y) - n_positive) / n_positive)
+        elif isinstance(estimator, RandomForestClassifier):
+            estimator.set_params(class_weight='balanced')
+        elif isinstance(estimator, LGBMClassifier):
+            estimator.set_params(is_unbalance=True)
+    return model
+
 
-    mcc_scorer = make_scorer(matthews_corrcoef)
-    cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring=mcc_scorer)
+def _set_threads(model, n_threads):
+    # Give every member of the ensemble the same thread count, both the unfitted
+    # templates and, once fitted, the members that predict
+    members = [estimator for _, estimator in getattr(model, 'estimators', [('model', model)])]
+    members += list(getattr(model, 'estimators_', []))
+    members += list(getattr(model, 'named_estimators_', {}).values())
+    for estimator in members:
+        if 'n_jobs' in estimator.get_params():
+            estimator.set_params(n_jobs=n_threads)
+    return model
+
+
+@traced("fit_fold", rows=lambda model, X_train, *args: len(X_train))
+def _fit_fold(model, X_train, y_train, resample, n_threads):
+    if resample is not None:
+        X_train, y_train = resample(X_train, y_train, n_jobs=n_threads)
+    fold_model = _set_threads(clone(model), n_threads)
+    fold_model.fit(np.asarray(X_train), np.asarray(y_train))
+    return fold_model
+
+
+@traced("cross_validate_grouped", rows=lambda model, X, *args, **kwargs: len(X))
+def cross_validate_grouped(model, X, y, groups, n_splits=5, resample=None, final_data=None,
+                           n_jobs=None, random_state=42):
+    """
+    Cross-validate with folds grouped by protein, all folds fitted in parallel
+
+    Every protein's residues fall into a single fold. Training folds are
+    oversampled with resample (if given) after the split, so synthetic residues
+    never mix proteins across folds; held-out folds keep only real residues.
+    The final model on final_data (default: all of X, y, resampled) is fitted
+    in the same parallel pass. Fold and final fits, resampling included, share
+    a budget of n_jobs threads.
+
+    Args:
+        model: Unfitted estimator (cloned for every fold)
+        X: Feature matrix of the real residues
+        y: Labels of the real residues
+        groups: ProteinID of every residue
+        n_splits: Number of folds
+        resample: Function (X, y, n_jobs) -> (X_res, y_res) applied to training
+            folds, e.g. oversample_data; n_jobs is the fold's share of the threads
+        final_data: (X, y) to fit the final model on, e.g. already oversampled data
+        n_jobs: Total number of threads (default: number of CPUs)
+
+    Returns:
+        Dict with folds, fold_models, fold_mcc, oof_proba and final_model
+    """
+    X = np.asarray(X)
+    y = np.asarray(y).astype(int)
+    groups = np.asarray(groups)
+
+    n_groups = len(np.unique(groups))
+    if n_groups < 2:
+        raise ValueError("Grouped cross-validation needs residues from at least two proteins")
+    n_splits = min(n_splits, n_groups)
+    splitter = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    folds = list(splitter.split(X, y, groups))
+
+    # Fit as many folds at once as the budget allows, splitting the rest of
+    # the threads between the members of each fit
+    n_jobs = n_jobs or os.cpu_count() or 1
+    n_tasks = len(folds) + 1
+    n_workers = min(n_tasks, n_jobs)
+    n_threads = max(1, n_jobs // n_workers)
+
+    if final_data is None:
+        final_X, final_y, final_resample = X, y, resample
+    else:
+        final_X, final_y, final_resample = final_data[0], final_data[1], None
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        final_future = executor.submit(_fit_fold, model, final_X, final_y, final_resample, n_threads)
+        fold_futures = [
+            executor.submit(_fit_fold, model, X[train_index], y[train_index], resample, n_threads)
+            for train_index, _ in folds
+        ]
+        fold_models = [future.result() for future in fold_futures]
+        final_model = final_future.result()
+
+    oof_proba = np.full(len(y), np.nan)
+    fold_mcc = []
+    for fold_model, (_, test_index) in zip(fold_models, folds):
+        oof_proba[test_index] = fold_model.predict_proba(X[test_index])[:, 1]
+        fold_mcc.append(matthews_corrcoef(y[test_index], (oof_proba[test_index] > 0.5).astype(int)))
+
+    return {
+        'folds': folds,
+        'fold_models': fold_models,
+        'fold_mcc': np.array(fold_mcc),
+        'oof_proba': oof_proba,
+        'final_model': _set_threads(final_model, None)
+    }
 
-    report_file.write(f"Cross-validation MCC: {np.mean(cv_scores):.4f}\n")
-    report_file.write(f"Scores: {cv_scores}\n")
 
-    model.fit(X_train, y_train)
+def write_cv_report(cv_result, y_train, report_file, cached=False):
+    # Fold and out-of-fold scores of a cross_validate_grouped result; cached
+    # marks a result taken from the stage cache
+    y_true = np.asarray(y_train).astype(int)
+    oof_proba = cv_result['oof_proba']
 
-    X_independent_selected = X_independent[:, selector.support_]
-    evaluate_model(model, X_independent_selected, y_independent, report_file, "Independent Test Set")
\ No newline at end of file
+    report_file.write(f"Cross-validation ({len(cv_result['folds'])} folds grouped by protein"
+                      f"{', cached' if cached else ''})\n")
+    report_file.write(f"Cross-validation MCC: {np.mean(cv_result['fold_mcc']):.4f}\n")
+    report_file.write(f"Scores: {cv_result['fold_mcc']}\n")
+    report_file.write(f"Out-of-fold MCC: {matthews_corrcoef(y_true, (oof_proba > 0.5).astype(int)):.4f}\n")
+    report_file.write(f"Out-of-fold AUC: {roc_auc_score(y_true, oof_proba):.4f}\n")
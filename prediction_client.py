@@ -0,0 +1,80 @@
+import sys
+import json
+import time
+import argparse
+import urllib.request
+import urllib.error
+
+
+def request_prediction(url, input_file):
+    """
+    Send a feature table to a running prediction server
+
+    Args:
+        url: Base URL of the prediction server
+        input_file: Path to input CSV/Excel/Parquet/Feather file
+
+    Returns:
+        (response body, server latency in ms, round-trip latency in ms)
+    """
+    if input_file.endswith('.csv'):
+        with open(input_file, 'rb') as f:
+            payload = f.read()
+    else:
+        # Other formats are converted locally, CSV needs no extra imports
+        from table_io import read_table
+        payload = read_table(input_file).to_csv(index=False).encode('utf-8')
+
+    request = urllib.request.Request(
+        url.rstrip('/') + '/predict',
+        data=payload,
+        headers={'Content-Type': 'text/csv'},
+        method='POST'
+    )
+
+    start_time = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+        server_latency = float(response.headers.get('X-Prediction-Latency-Ms', 'nan'))
+    round_trip = (time.perf_counter() - start_time) * 1000
+
+    return body, server_latency, round_trip
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thin client for the AlloEF prediction server")
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="Prediction server URL")
+    parser.add_argument("--input", help="Input file path for prediction (CSV, Excel, Parquet or Feather format)")
+    parser.add_argument("--output", help="Output CSV path (default: stdout)")
+    parser.add_argument("--health", action="store_true", help="Print server status and exit")
+    args = parser.parse_args()
+
+    try:
+        if args.health:
+            with urllib.request.urlopen(args.url.rstrip('/') + '/health') as response:
+                print(json.dumps(json.loads(response.read()), indent=2))
+            return
+
+        if not args.input:
+            parser.error("--input is required unless --health is given")
+
+        body, server_latency, round_trip = request_prediction(args.url, args.input)
+    except urllib.error.HTTPError as e:
+        print(f"Error: server returned {e.code}: {e.read().decode('utf-8', 'replace')}", file=sys.stderr)
+        sys.exit(1)
+    except urllib.error.URLError as e:
+        print(f"Error: could not reach prediction server at {args.url}: {e.reason}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(body)
+        print(f"Predictions saved to: {args.output}", file=sys.stderr)
+    else:
+        sys.stdout.write(body.decode('utf-8'))
+
+    print(f"Server latency: {server_latency:.1f} ms, round trip: {round_trip:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import io
+import json
+import time
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from main import load_prediction_artifacts, predict_dataframe
+
+
+class PredictionService:
+    def __init__(self, model_path, feature_selector_path, preprocessor_path=None):
+        """
+        Keep the trained ensemble, feature selector and preprocessor resident in memory
+
+        Args:
+            model_path: Path to saved model
+            feature_selector_path: Path to saved feature selector
+            preprocessor_path: Path to saved preprocessor (default: next to the feature selector)
+        """
+        start_time = time.perf_counter()
+        self.model_path = model_path
+        self.feature_selector_path = feature_selector_path
+        self.model, self.selector, self.preprocessor = load_prediction_artifacts(
+            model_path, feature_selector_path, preprocessor_path
+        )
+        self.load_seconds = time.perf_counter() - start_time
+        self.started_at = time.time()
+
+        self._stats_lock = threading.Lock()
+        self.request_count = 0
+        self.row_count = 0
+        self.total_latency = 0.0
+
+    def predict(self, df_input):
+        """
+        Predict a feature table and return (results_df, latency in seconds)
+        """
+        start_time = time.perf_counter()
+        results_df = predict_dataframe(self.model, self.selector, df_input, self.preprocessor)
+        latency = time.perf_counter() - start_time
+
+        with self._stats_lock:
+            self.request_count += 1
+            self.row_count += len(results_df)
+            self.total_latency += latency
+
+        return results_df, latency
+
+    def health(self):
+        with self._stats_lock:
+            mean_latency = self.total_latency / self.request_count if self.request_count else 0.0
+            return {
+                "status": "ok",
+                "model": self.model_path,
+                "selector": self.feature_selector_path,
+                "load_seconds": round(self.load_seconds, 4),
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "requests": self.request_count,
+                "rows": self.row_count,
+                "mean_latency_ms": round(mean_latency * 1000, 2)
+            }
+
+
+def make_handler(service):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type, headers=None):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, payload):
+            self._send(status, json.dumps(payload), "application/json")
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/health":
+                self._send_json(200, service.health())
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/predict":
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+                return
+
+            content_type = self.headers.get("Content-Type", "text/csv").split(";")[0].strip()
+            length = int(self.headers.get("Content-Length", 0))
+            payload = self.rfile.read(length)
+
+            # Feature tables are sent either as CSV text or as JSON records
+            try:
+                if content_type == "application/json":
+                    df_input = pd.DataFrame(json.loads(payload.decode("utf-8")))
+                else:
+                    df_input = pd.read_csv(io.BytesIO(payload))
+            except Exception as e:
+                self._send_json(400, {"error": f"Could not parse feature table: {e}"})
+                return
+
+            try:
+                results_df, latency = service.predict(df_input)
+            except Exception as e:
+                self.log_message("Prediction failed: %s", e)
+                traceback.print_exc()
+                self._send_json(500, {"error": str(e)})
+                return
+
+            headers = {
+                "X-Prediction-Latency-Ms": f"{latency * 1000:.2f}",
+                "X-Rows": str(len(results_df))
+            }
+            if content_type == "application/json":
+                self._send(200, results_df.to_json(orient="records"), "application/json", headers)
+            else:
+                self._send(200, results_df.to_csv(index=False), "text/csv", headers)
+
+            self.log_message("Predicted %d rows in %.1f ms", len(results_df), latency * 1000)
+
+    return PredictionHandler
+
+
+def serve(model_path, feature_selector_path, host="127.0.0.1", port=8765, preprocessor_path=None):
+    """
+    Run the resident prediction server until interrupted
+
+    Args:
+        model_path: Path to saved model
+        feature_selector_path: Path to saved feature selector
+        host: Interface to bind
+        port: TCP port to listen on
+        preprocessor_path: Path to saved preprocessor (default: next to the feature selector)
+    """
+    service = PredictionService(model_path, feature_selector_path, preprocessor_path)
+    print(f"Loaded trained model and feature selector in {service.load_seconds:.2f}s")
+
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Prediction server listening on http://{host}:{port} (POST /predict, GET /health)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down prediction server")
+    finally:
+        server.server_close()
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+
+from main import load_prediction_artifacts, predict_dataframe
+from preprocessing import _average_comma_cells
+
+# Inputs that can be read a chunk at a time; "-" reads stdin
+STREAM_INPUT_EXTENSIONS = ('.csv', '.jsonl', '.ndjson', '.parquet', '.feather')
+STREAM_OUTPUT_EXTENSIONS = ('.csv', '.jsonl', '.ndjson', '.parquet', '.feather')
+PREDICTION_COLUMNS = ('Predicted_Label', 'Prediction_Probability_Class_0', 'Prediction_Probability_Class_1')
+
+
+def _stream_format(path, stream_format):
+    # Line-delimited format of a path, stdin/stdout use stream_format
+    if path == '-':
+        return stream_format
+    extension = os.path.splitext(path)[1].lower()
+    return 'jsonl' if extension in ('.jsonl', '.ndjson') else extension.lstrip('.')
+
+
+def iter_table_chunks(input_path, chunk_rows, stream_format='csv'):
+    """
+    Yield a feature table as DataFrames of at most chunk_rows rows
+
+    CSV and JSON Lines are parsed incrementally, Parquet is read one batch of
+    rows at a time and Feather one memory-mapped record batch at a time.
+    """
+    input_format = _stream_format(input_path, stream_format)
+    source = sys.stdin if input_path == '-' else input_path
+
+    if input_format == 'csv':
+        yield from pd.read_csv(source, chunksize=chunk_rows)
+    elif input_format == 'jsonl':
+        yield from pd.read_json(source, lines=True, chunksize=chunk_rows)
+    elif input_format == 'parquet':
+        import pyarrow.parquet as pq
+        from table_io import missing_as_nan
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunk_rows):
+            yield missing_as_nan(batch.to_pandas())
+    elif input_format == 'feather':
+        import pyarrow as pa
+        from table_io import missing_as_nan
+        with pa.memory_map(input_path) as source_file:
+            reader = pa.ipc.open_file(source_file)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index)
+                for start in range(0, batch.num_rows, chunk_rows):
+                    yield missing_as_nan(batch.slice(start, chunk_rows).to_pandas())
+    else:
+        raise ValueError(f"Cannot stream '{input_path}', use one of {', '.join(STREAM_INPUT_EXTENSIONS)} "
+                         "or '-' for stdin (convert Excel files with table_io.py)")
+
+
+class ChunkWriter:
+    """
+    Append prediction chunks to CSV, JSON Lines, Parquet or Feather output
+
+    The first chunk fixes the columns (and, for Parquet and Feather, their
+    types); every chunk is written and flushed as soon as it is appended.
+    """
+
+    def __init__(self, output_path, stream_format='csv', promote_integers=False):
+        self.output_path = output_path
+        self.format = _stream_format(output_path, stream_format)
+        if self.format not in ('csv', 'jsonl', 'parquet', 'feather'):
+            raise ValueError(f"Cannot stream to '{output_path}', use one of "
+                             f"{', '.join(STREAM_OUTPUT_EXTENSIONS)} or '-' for stdout")
+        # Integer columns parsed from text may hold missing values in later chunks
+        self.promote_integers = promote_integers
+        self.columns = None
+        self.schema = None
+        self._header_written = False
+        self._file = None
+        self._writer = None
+
+    def _open(self, chunk):
+        self.columns = list(chunk.columns)
+        if self.output_path != '-':
+            os.makedirs(os.path.dirname(self.output_path) or '.', exist_ok=True)
+
+        if self.format in ('csv', 'jsonl'):
+            self._file = sys.stdout if self.output_path == '-' else open(self.output_path, 'w', newline='')
+            return
+
+        import pyarrow as pa
+        from table_io import infer_column_types
+        schema = pa.Table.from_pandas(infer_column_types(chunk), preserve_index=False).schema
+        if self.promote_integers:
+            schema = pa.schema([
+                field.with_type(pa.float64())
+                if pa.types.is_integer(field.type) and field.name not in PREDICTION_COLUMNS else field
+                for field in schema
+            ])
+        self.schema = schema.remove_metadata()
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.output_path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(self.output_path, self.schema)
+
+    def _to_arrow(self, chunk):
+        import pyarrow as pa
+        chunk = chunk.copy()
+        for field in self.schema:
+            values = chunk[field.name]
+            # pandas 3 holds text as StringDtype, which Arrow types as large_string
+            text_field = pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+            text_values = pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+            if text_field and not text_values:
+                chunk[field.name] = values.where(values.isna(), values.astype(str)).astype(object)
+            elif not text_field and text_values:
+                # Cells such as "0.1,0.3" are averaged, as preprocessing reads them
+                chunk[field.name] = _average_comma_cells(chunk[[field.name]], [field.name])[field.name]
+        return pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False)
+
+    def append(self, chunk):
+        if self.columns is None:
+            self._open(chunk)
+        elif list(chunk.columns) != self.columns:
+            raise ValueError("Chunk columns differ from the first chunk")
+
+        if self.format == 'csv':
+            chunk.to_csv(self._file, header=not self._header_written, index=False)
+            self._header_written = True
+            self._file.flush()
+        elif self.format == 'jsonl':
+            chunk.to_json(self._file, orient='records', lines=True)
+            self._file.flush()
+        elif self.format == 'parquet':
+            self._writer.write_table(self._to_arrow(chunk))
+        else:
+            for batch in self._to_arrow(chunk).to_batches():
+                self._writer.write_batch(batch)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+
+
+def predict_stream(model_path, feature_selector_path, input_path, output_path, chunk_rows=50000,
+                   preprocessor_path=None, stream_format='csv'):
+    """
+    Predict a large feature table chunk by chunk with constant memory
+
+    Each chunk goes through the fitted preprocessor, the feature selector and
+    the model, and is appended to the output before the next one is read.
+
+    Args:
+        model_path: Path to saved model
+        feature_selector_path: Path to saved feature selector
+        input_path: CSV, JSON Lines, Parquet or Feather file, or "-" for stdin
+        output_path: CSV, JSON Lines, Parquet or Feather file, or "-" for stdout
+        chunk_rows: Maximum number of residues per chunk
+        preprocessor_path: Path to saved preprocessor (default: next to the feature selector)
+        stream_format: Line format of stdin/stdout, "csv" or "jsonl"
+
+    Returns:
+        Dict with the number of chunks, residues and predicted positives
+    """
+    # Progress goes to stderr when the predictions themselves go to stdout
+    log_stream = sys.stderr if output_path == '-' else sys.stdout
+    with contextlib.redirect_stdout(log_stream):
+        model, selector, preprocessor = load_prediction_artifacts(
+            model_path, feature_selector_path, preprocessor_path
+        )
+    if preprocessor is None:
+        raise ValueError("Streaming needs the preprocessor fitted at training time, "
+                         "chunks cannot be scaled with their own statistics")
+
+    text_input = _stream_format(input_path, stream_format) in ('csv', 'jsonl')
+    writer = ChunkWriter(output_path, stream_format, promote_integers=text_input)
+    start_time = time.perf_counter()
+    chunk_count = row_count = positive_count = 0
+    try:
+        for df_chunk in iter_table_chunks(input_path, chunk_rows, stream_format):
+            with contextlib.redirect_stdout(log_stream):
+                results_df = predict_dataframe(model, selector, df_chunk, preprocessor)
+            writer.append(results_df)
+
+            chunk_count += 1
+            row_count += len(results_df)
+            positive_count += int(np.sum(results_df['Predicted_Label'] == 1))
+            elapsed = time.perf_counter() - start_time
+            print(f"Chunk {chunk_count}: {row_count} residues written "
+                  f"({row_count / elapsed:,.0f} residues/s)", file=log_stream, flush=True)
+    finally:
+        writer.close()
+
+    return {'chunks': chunk_count, 'rows': row_count, 'positive': positive_count}
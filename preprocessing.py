@@ -1,84 +1,368 @@
 import pandas as pd
 import numpy as np
 import string
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import MinMaxScaler, LabelEncoder
-from tensorflow.keras.utils import to_categorical
-from boruta import BorutaPy
-from sklearn.ensemble import RandomForestClassifier
-from imblearn.over_sampling import SVMSMOTE
+from table_io import read_table
+from instrumentation import traced
 
+# Training-only dependencies (BorutaPy, imblearn, RandomForest) are imported
+# inside the functions that use them so prediction does not load them.
+
+@traced("load_data", result_rows=len)
 def load_data(file_path):
-    return pd.read_excel(file_path)
+    return read_table(file_path)
+
+
+# Identifier, label and coordinate columns that are never used as features
+NON_NUMERICAL_COLUMNS = ['ProteinID', 'label', 'FirstLetter', 'STRUCTURE', 'x', 'y', 'z', 'ResidueInfo',
+                         'Residue Number']
+
+
+def _structure_first_letters(df):
+    # First letter of the DSSP STRUCTURE code, anything else becomes "Other"
+    first_letters = df['STRUCTURE'].astype(str).str[0]
+    return first_letters.where(first_letters.isin(list(string.ascii_letters)), "Other")
+
+
+def _average_comma_cells(df, columns):
+    # Cells such as "2,-0.2" hold several values and are replaced by their mean.
+    # Each text column (object, or StringDtype on pandas 3) is split once into
+    # a padded array of parts; numeric columns cannot hold commas and are left
+    # untouched.
+    df = df.copy()
+
+    for col in columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            continue
+
+        # Missing cells read as "nan", as they do in object columns
+        text = df[col].astype(object).where(df[col].notna(), 'nan').astype(str)
+        parts = text.str.split(',', expand=True)
+        padding = parts.isna().to_numpy()
+        values = parts.to_numpy(dtype=object)
+        values[padding] = 0.0
+        values = values.astype(np.float64)
+
+        counts = parts.shape[1] - padding.sum(axis=1)
+        df[col] = values.sum(axis=1) / counts
+
+    return df
+
+
+def _numerical_matrix(df, numerical_features):
+    # Columns missing from the input are left as NaN and filled by the imputer
+    present = [col for col in numerical_features if col in df.columns]
+    df = _average_comma_cells(df[present], present)
+    return df.reindex(columns=numerical_features).to_numpy(dtype=np.float64)
+
+
+# Numerical columns converted at a time, which bounds the float64 temporaries
+# of fitting and of lean mode to this many columns
+BLOCK_COLUMNS = 64
+
+
+def _numerical_blocks(df, numerical_features):
+    # (start, stop, float64 matrix) of consecutive blocks of numerical columns
+    numerical_features = list(numerical_features)
+    for start in range(0, len(numerical_features), BLOCK_COLUMNS):
+        stop = min(start + BLOCK_COLUMNS, len(numerical_features))
+        yield start, stop, _numerical_matrix(df, numerical_features[start:stop])
+
+
+@traced("fit_preprocessor", rows=lambda df, *args, **kwargs: len(df))
+def fit_preprocessor(df, lean=False):
+    """
+    Fit the STRUCTURE encoding, mean imputation and min-max scaling on a table
+
+    The returned dictionary is all that transform_features needs, so it can be
+    saved next to the feature selector and reused for inference. With lean the
+    features are produced as a float32 array instead of a float64 DataFrame,
+    for training and for every prediction made with this preprocessor.
+    """
+    numerical_features = df.columns.difference(NON_NUMERICAL_COLUMNS)
+    n_features = len(numerical_features)
+    fill_values, data_min, data_max = np.empty(n_features), np.empty(n_features), np.empty(n_features)
+
+    # Same statistics as SimpleImputer(strategy='mean') followed by MinMaxScaler(),
+    # column by column
+    for start, stop, values in _numerical_blocks(df, numerical_features):
+        with np.errstate(invalid='ignore'):
+            block_fill = np.nanmean(values, axis=0)
+        block_fill = np.where(np.isnan(block_fill), 0.0, block_fill)
+        values = np.where(np.isnan(values), block_fill, values)
+        fill_values[start:stop] = block_fill
+        data_min[start:stop] = values.min(axis=0)
+        data_max[start:stop] = values.max(axis=0)
+
+    data_range = data_max - data_min
+    data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1.0
+    scale = 1.0 / data_range
+
+    preprocessor = {
+        'structure_classes': np.unique(_structure_first_letters(df)).tolist(),
+        'numerical_features': list(numerical_features),
+        'fill_values': fill_values,
+        'scale': scale,
+        'min': -data_min * scale
+    }
+    if lean:
+        preprocessor['lean'] = True
+    return preprocessor
+
+
+def transform_features(df, preprocessor):
+    """
+    Apply a fitted preprocessor without refitting anything
+
+    The columns always follow the layout seen at fit time: one-hot STRUCTURE
+    letters (unseen letters encode as all zeros) followed by the scaled
+    numerical features.
+    """
+    structure_classes = preprocessor['structure_classes']
+    numerical_features = preprocessor['numerical_features']
+
+    missing = [col for col in numerical_features if col not in df.columns]
+    if missing:
+        print(f"Warning: {len(missing)} feature columns missing from input, filled with training means: "
+              f"{missing[:5]}{'...' if len(missing) > 5 else ''}")
+
+    # One-hot encode the first letter against the fitted classes
+    codes = pd.Categorical(_structure_first_letters(df), categories=structure_classes).codes
+    one_hot = (codes[:, None] == np.arange(len(structure_classes))).astype(np.float64)
+    one_hot_df = pd.DataFrame(one_hot, columns=structure_classes, index=df.index)
+
+    # Fill missing values with the training means and apply the min-max scale
+    values = _numerical_matrix(df, numerical_features)
+    values = np.where(np.isnan(values), preprocessor['fill_values'], values)
+    values *= preprocessor['scale']
+    values += preprocessor['min']
+    normalized_df = pd.DataFrame(values, columns=numerical_features, index=df.index)
+
+    return pd.concat([one_hot_df, normalized_df], axis=1)
+
+
+def transform_features_lean(df, preprocessor):
+    """
+    transform_features into a C-contiguous float32 array, without DataFrames
+
+    The numerical columns are scaled in float64 block by block and written
+    into the preallocated array, so the values are those of transform_features
+    rounded to float32 and no full-size float64 copy is ever made.
+    """
+    structure_classes = preprocessor['structure_classes']
+    numerical_features = preprocessor['numerical_features']
 
+    missing = [col for col in numerical_features if col not in df.columns]
+    if missing:
+        print(f"Warning: {len(missing)} feature columns missing from input, filled with training means: "
+              f"{missing[:5]}{'...' if len(missing) > 5 else ''}")
 
-def preprocess_data(df):
-    # Ensure STRUCTURE column is of string type
-    df['STRUCTURE'] = df['STRUCTURE'].astype(str)
+    n_classes = len(structure_classes)
+    X = np.zeros((len(df), n_classes + len(numerical_features)), dtype=np.float32)
 
-    # Extract the first letter
-    def extract_first_letter(structure):
-        first_letter = structure[0]
-        return first_letter if first_letter in string.ascii_letters else "Other"
+    # Unseen letters have code -1 and stay all zeros
+    codes = pd.Categorical(_structure_first_letters(df), categories=structure_classes).codes
+    known = np.flatnonzero(codes >= 0)
+    X[known, codes[known]] = 1.0
 
-    df['FirstLetter'] = df['STRUCTURE'].apply(extract_first_letter)
+    for start, stop, values in _numerical_blocks(df, numerical_features):
+        values = np.where(np.isnan(values), preprocessor['fill_values'][start:stop], values)
+        values *= preprocessor['scale'][start:stop]
+        values += preprocessor['min'][start:stop]
+        X[:, n_classes + start:n_classes + stop] = values
 
-    # Label encode and one-hot encode the first letter
-    label_encoder = LabelEncoder()
-    encoded_letters = label_encoder.fit_transform(df['FirstLetter'])
-    one_hot_encoded_letters = to_categorical(encoded_letters)
-    one_hot_columns = label_encoder.classes_
-    one_hot_df = pd.DataFrame(one_hot_encoded_letters, columns=one_hot_columns)
-    one_hot_df.index = df.index
+    return X
 
-    # Select numerical columns
-    non_numerical_columns = ['ProteinID', 'label', 'FirstLetter', 'STRUCTURE', 'x', 'y', 'z', 'ResidueInfo',
-                             'Residue Number']
-    numerical_features = df.columns.difference(non_numerical_columns)
 
-    def process_cell(cell):
-        if isinstance(cell, str) and "," in cell:
-            numbers = cell.split(',')
-            return [float(number.strip()) for number in numbers]
-        return [float(cell)]
+def check_input_schema(df, preprocessor):
+    """
+    Raise ValueError when a prediction input lacks a column the model uses
 
-    # Process columns with commas
-    comma_columns = [col for col in numerical_features if df[col].astype(str).str.contains(',').any()]
-    for col in comma_columns:
-        df[col] = df[col].astype(str).apply(process_cell)
-        df[col] = df[col].apply(lambda x: sum(x) / len(x) if len(x) > 1 else x[0])
+    Only preprocessors loaded from a model bundle list their required columns
+    (the inputs of the selected features). Other preprocessors are not checked,
+    and missing columns are then filled with the training means.
+    """
+    required = preprocessor.get('required_columns')
+    if not required:
+        return
+    missing = [col for col in required if col not in df.columns]
+    if missing:
+        raise ValueError(f"Input lacks {len(missing)} of the {len(required)} columns the model uses: "
+                         f"{missing[:10]}{'...' if len(missing) > 10 else ''}")
 
-    # Fill missing values with mean in features
-    imputer = SimpleImputer(strategy='mean')
-    df[numerical_features] = imputer.fit_transform(df[numerical_features])
 
-    # Normalize numerical features
-    scaler = MinMaxScaler()
-    normalized_features = scaler.fit_transform(df[numerical_features])
-    normalized_df = pd.DataFrame(normalized_features, columns=numerical_features)
-    normalized_df.index = df.index
+@traced("preprocess_data", rows=lambda df, *args, **kwargs: len(df))
+def preprocess_data(df, has_labels=True, preprocessor=None):
+    """
+    Encode, impute and scale a feature table
 
-    # Combine the DataFrame
-    final_df = pd.concat([df[['ProteinID']], df['label'].fillna(0), one_hot_df, normalized_df], axis=1)
+    Without a fitted preprocessor one is fitted on df itself. X is a
+    DataFrame, or a float32 array when the preprocessor was fitted lean.
+    """
+    if preprocessor is None:
+        preprocessor = fit_preprocessor(df)
 
-    X = final_df.drop(columns=["label", "ProteinID"])
-    y = df["label"].fillna(0)
+    # Unlabelled prediction inputs have no label column
+    y = df['label'].fillna(0) if has_labels else None
 
-    return X, y, final_df.columns.drop(["label", "ProteinID"])
+    if preprocessor.get('lean', False):
+        X = transform_features_lean(df, preprocessor)
+        return X, y, pd.Index(preprocessor['structure_classes'] + preprocessor['numerical_features'])
 
-def oversample_data(X_train, y_train, random_state=42):
-    svmsmote = SVMSMOTE(random_state=random_state, n_jobs=-1)
-    X_train_res, y_train_res = svmsmote.fit_resample(X_train, y_train)
-    return X_train_res, y_train_res
+    X = transform_features(df, preprocessor)
+    return X, y, X.columns
 
-def feature_selection(X_train_res, y_train_res, feature_names):
-    # 定义随机森林分类器用于 Boruta
-    rf = RandomForestClassifier(n_estimators=200, random_state=42, n_jobs=-1)
-    feat_selector = BorutaPy(rf, n_estimators='auto', random_state=42, max_iter=100)
+class FeatureMask:
+    """
+    Boolean feature mask with the transform interface of a fitted selector
 
-    # 确保 X_train_res 是一个 NumPy 数组
-    if isinstance(X_train_res, pd.DataFrame):
-        X_train_res = X_train_res.values
+    Saved in place of the fitted BorutaPy object so loading it for prediction
+    needs neither boruta nor the internal RandomForest.
+    """
+
+    def __init__(self, support):
+        self.support_ = np.asarray(support, dtype=bool)
+
+    def transform(self, X):
+        return np.asarray(X)[:, self.support_]
+
+
+# Oversamplers; 'class_weight' adds no synthetic residues and leaves the
+# imbalance to the class weights of the models
+SAMPLERS = ('svmsmote', 'smote', 'borderline', 'class_weight')
+NEIGHBOR_ALGORITHMS = ('auto', 'kd_tree', 'ball_tree', 'brute')
+
+
+def _make_sampler(sampler, random_state, neighbors, k_neighbors, m_neighbors, n_jobs):
+    from sklearn.neighbors import NearestNeighbors
+
+    # Neighbour searches include the query point itself, hence the +1
+    def neighbor_search(n_neighbors):
+        return NearestNeighbors(n_neighbors=n_neighbors + 1, algorithm=neighbors, n_jobs=n_jobs)
+
+    if sampler == 'svmsmote':
+        from imblearn.over_sampling import SVMSMOTE
+        return SVMSMOTE(random_state=random_state, k_neighbors=neighbor_search(k_neighbors),
+                        m_neighbors=neighbor_search(m_neighbors))
+    elif sampler == 'smote':
+        from imblearn.over_sampling import SMOTE
+        return SMOTE(random_state=random_state, k_neighbors=neighbor_search(k_neighbors))
+    elif sampler == 'borderline':
+        from imblearn.over_sampling import BorderlineSMOTE
+        return BorderlineSMOTE(random_state=random_state, k_neighbors=neighbor_search(k_neighbors),
+                               m_neighbors=neighbor_search(m_neighbors))
+    else:
+        raise ValueError(f"Unknown sampler '{sampler}', expected one of {', '.join(SAMPLERS)}")
+
+
+@traced("oversample_data", rows=lambda X_train, *args, **kwargs: len(X_train))
+def oversample_data(X_train, y_train, random_state=42, sampler='svmsmote', neighbors='auto',
+                    k_neighbors=5, m_neighbors=10, n_jobs=-1):
+    """
+    Oversample the minority class
+
+    Args:
+        X_train: Feature matrix (DataFrame or array)
+        y_train: Labels
+        sampler: 'svmsmote', 'smote', 'borderline' (borderline-1 SMOTE) or
+            'class_weight' (no synthetic residues, X and y returned as they are)
+        neighbors: Nearest neighbour algorithm of the sampler: 'auto',
+            'kd_tree', 'ball_tree' or 'brute' (all exact, so the result is the same)
+        k_neighbors: Neighbours used to generate synthetic residues
+        m_neighbors: Neighbours used to find borderline residues
+        n_jobs: Threads of the nearest neighbour search (-1: all CPUs)
+
+    Returns:
+        Resampled X and y
+    """
+    if sampler == 'class_weight':
+        return X_train, y_train
+
+    resampler = _make_sampler(sampler, random_state, neighbors, k_neighbors, m_neighbors, n_jobs)
+    return resampler.fit_resample(X_train, y_train)
+
+# Importance estimators Boruta can use; LightGBM's histogram trees are much
+# faster than the 200-tree RandomForest on large oversampled matrices
+SELECTION_BACKENDS = ('rf', 'lightgbm')
+
+
+class _FreshFitEstimator:
+    """
+    Fit a fresh clone of the estimator on every call
+
+    Boruta drops rejected features between iterations, and LightGBM refuses to
+    refit an estimator on a different number of features with scikit-learn < 1.6.
+    """
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+
+    def get_params(self, deep=True):
+        return self.estimator.get_params(deep)
+
+    def set_params(self, **params):
+        self.estimator.set_params(**params)
+        return self
+
+    def fit(self, X, y):
+        from sklearn.base import clone
+        self.fitted_ = clone(self.estimator).fit(X, y)
+        return self
+
+    @property
+    def feature_importances_(self):
+        return self.fitted_.feature_importances_
+
+
+def _selection_estimator(backend, random_state, n_jobs, class_weight=None):
+    if backend == 'rf':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(n_estimators=200, random_state=random_state, n_jobs=n_jobs,
+                                      class_weight=class_weight)
+    elif backend == 'lightgbm':
+        from lightgbm import LGBMClassifier
+        # Random forest mode (bagged histogram trees) keeps the importances close
+        # to the RandomForest's; boosted gain concentrates on a few features
+        return _FreshFitEstimator(LGBMClassifier(
+            boosting_type='rf', n_estimators=100, bagging_fraction=0.632, bagging_freq=1,
+            feature_fraction=0.1, num_leaves=127, max_depth=10, min_child_samples=1,
+            importance_type='gain', class_weight=class_weight, random_state=random_state, n_jobs=n_jobs,
+            verbose=-1
+        ))
+    else:
+        raise ValueError(f"Unknown feature selection backend '{backend}', expected one of "
+                         f"{', '.join(SELECTION_BACKENDS)}")
+
+
+@traced("feature_selection", rows=lambda X_train_res, *args, **kwargs: len(X_train_res))
+def feature_selection(X_train_res, y_train_res, feature_names, backend='rf', max_iter=100,
+                      early_stopping=None, n_iter_no_change=20, random_state=42, n_jobs=-1,
+                      class_weight=None):
+    """
+    Boruta feature selection
+
+    Boruta stops as soon as every feature is accepted or rejected; with
+    early_stopping it also stops once the decisions have not changed for
+    n_iter_no_change iterations (default: on for the lightgbm backend only, so
+    the rf backend selects exactly as before). Pass class_weight='balanced'
+    when the labels were not oversampled.
+
+    Returns:
+        Selected training matrix, selected feature names and a FeatureMask
+    """
+    from boruta import BorutaPy
+
+    # 确保 X_train_res 是一个 NumPy 数组 (float32 stays float32)
+    X_train_res = np.asarray(X_train_res)
+    y_train_res = np.asarray(y_train_res)
+
+    if early_stopping is None:
+        early_stopping = backend != 'rf'
+
+    # 定义 Boruta 使用的重要性估计器 (随机森林或 LightGBM)
+    estimator = _selection_estimator(backend, random_state, n_jobs, class_weight)
+    feat_selector = BorutaPy(estimator, n_estimators='auto' if backend == 'rf' else 100,
+                             random_state=random_state, max_iter=max_iter,
+                             early_stopping=early_stopping, n_iter_no_change=n_iter_no_change)
 
     # 训练 Boruta 特征选择器
     feat_selector.fit(X_train_res, y_train_res)
@@ -86,10 +370,14 @@ def feature_selection(X_train_res, y_train_res, feature_names):
     # 选出所有重要的特征
     selected_mask = feat_selector.support_
 
+    if not np.any(selected_mask):
+        raise ValueError("Boruta confirmed none of the features, the labels carry no signal "
+                         "the importance estimator can find")
+
     # 使用掩码选择实际特征
     selected_features = [feature_names[i] for i in range(len(feature_names)) if selected_mask[i]]
 
     # 创建选择后的训练集
     X_train_selected = X_train_res[:, selected_mask]
 
-    return X_train_selected, selected_features, feat_selector
+    return X_train_selected, selected_features, FeatureMask(selected_mask)
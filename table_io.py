@@ -0,0 +1,149 @@
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+from instrumentation import traced
+
+# Parquet and Feather need pyarrow; Excel stays available for reading by humans
+TABLE_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.parquet', '.feather')
+COLUMNAR_EXTENSIONS = ('.parquet', '.feather')
+
+
+@traced("read_table", result_rows=len)
+def read_table(path, **kwargs):
+    """
+    Read a table from CSV, Excel, Parquet or Feather depending on the file extension
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return pd.read_csv(path, **kwargs)
+    elif extension in ('.xlsx', '.xls'):
+        return pd.read_excel(path, **kwargs)
+    elif extension == '.parquet':
+        return missing_as_nan(pd.read_parquet(path, **kwargs))
+    elif extension == '.feather':
+        return missing_as_nan(pd.read_feather(path, **kwargs))
+    else:
+        raise ValueError(f"Unsupported table format '{extension}', expected one of {', '.join(TABLE_EXTENSIONS)}")
+
+
+def missing_as_nan(df):
+    """
+    Store missing values in text columns as NaN, as the Excel and CSV readers do
+
+    pyarrow returns missing strings as None.
+    """
+    object_columns = df.columns[df.dtypes == object]
+    if len(object_columns):
+        df[object_columns] = df[object_columns].where(df[object_columns].notna(), np.nan)
+    return df
+
+
+def infer_column_types(df):
+    """
+    Give text columns a real type before writing a typed (columnar) file
+
+    Excel and CSV readers leave numbers stored as text, and columns mixing text
+    with numbers, as object columns. Columns whose values are all numeric become
+    numeric, mixed columns become strings (missing values stay missing) and
+    everything else is left as it is.
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        values = df[col]
+        non_null = values.dropna()
+        if non_null.empty:
+            continue
+
+        numeric = pd.to_numeric(non_null, errors='coerce')
+        if numeric.notna().all():
+            df[col] = pd.to_numeric(values, errors='coerce')
+        elif not non_null.map(type).eq(str).all():
+            df[col] = values.where(values.isna(), values.astype(str))
+
+    return df
+
+
+@traced("write_table", rows=lambda df, *args, **kwargs: len(df))
+def write_table(df, path):
+    """
+    Write a table as CSV, Excel, Parquet or Feather depending on the file extension
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        df.to_csv(path, index=False)
+    elif extension in ('.xlsx', '.xls'):
+        df.to_excel(path, index=False)
+    elif extension == '.parquet':
+        infer_column_types(df).to_parquet(path, index=False)
+    elif extension == '.feather':
+        # Feather keeps no index, so the rows are renumbered
+        infer_column_types(df).reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"Unsupported table format '{extension}', expected one of {', '.join(TABLE_EXTENSIONS)}")
+
+
+def convert_table(input_path, output_format='parquet', output_dir=None):
+    """
+    Convert a table file to another format, one output file per Excel sheet
+
+    Returns:
+        List of written file paths
+    """
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    output_dir = output_dir or os.path.dirname(input_path) or '.'
+    os.makedirs(output_dir, exist_ok=True)
+
+    if input_path.endswith(('.xlsx', '.xls')):
+        sheets = pd.read_excel(input_path, sheet_name=None)
+    else:
+        sheets = {None: read_table(input_path)}
+
+    written = []
+    for sheet_name, df in sheets.items():
+        suffix = f"_{sheet_name}" if len(sheets) > 1 else ""
+        output_path = os.path.join(output_dir, f"{base_name}{suffix}.{output_format}")
+        write_table(df, output_path)
+        written.append(output_path)
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert feature tables (e.g. existing xlsx files) to Parquet, Feather, CSV or Excel",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Convert the training tables to Parquet next to the originals
+  python table_io.py train.xlsx independent_test.xlsx --to parquet
+
+  # Convert every Excel file in a folder to Feather in another folder
+  python table_io.py ./Input_data --to feather --output-dir ./Input_data_feather
+        """
+    )
+    parser.add_argument("inputs", nargs="+", help="Table files, directories or glob patterns")
+    parser.add_argument("--to", dest="output_format", choices=["parquet", "feather", "csv", "xlsx"],
+                        default="parquet", help="Output format (default: parquet)")
+    parser.add_argument("--output-dir", help="Output directory (default: next to each input file)")
+    args = parser.parse_args()
+
+    input_files = []
+    for pattern in args.inputs:
+        if os.path.isdir(pattern):
+            input_files.extend(sorted(glob.glob(os.path.join(pattern, '*.xls*'))))
+        else:
+            input_files.extend(sorted(glob.glob(pattern)))
+
+    if not input_files:
+        print("Error: No input tables found")
+        return
+
+    for input_file in input_files:
+        for output_file in convert_table(input_file, args.output_format, args.output_dir):
+            print(f"Converted {input_file} -> {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import os
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.model_selection import StratifiedGroupKFold, StratifiedKFold
+from sklearn.metrics import roc_auc_score
+from modeling import DEFAULT_PARAMS, make_member, balance_class_weights
+
+TUNING_METHODS = ('halving', 'hyperband')
+
+# Boosting rounds (trees for the RandomForest) given to the best candidates;
+# the boosted members stop earlier when the validation proteins stop improving
+MAX_RESOURCE = {"xgb": 1000, "lgbm": 1000, "rf": 400}
+EARLY_STOPPING_ROUNDS = 30
+# 1 / VALIDATION_SPLITS of the training proteins of every fold are set aside
+# for early stopping, so the held-out fold is only used for scoring
+VALIDATION_SPLITS = 5
+
+
+def _log_uniform(rng, low, high):
+    return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+
+
+def sample_params(name, rng):
+    """
+    Draw one configuration from the search space of an ensemble member
+    """
+    if name == "xgb":
+        return {
+            'learning_rate': _log_uniform(rng, 0.01, 0.3),
+            'max_depth': int(rng.integers(3, 13)),
+            'min_child_weight': _log_uniform(rng, 0.5, 10.0),
+            'subsample': float(rng.uniform(0.5, 1.0)),
+            'colsample_bytree': float(rng.uniform(0.3, 1.0)),
+            'reg_lambda': _log_uniform(rng, 0.1, 10.0)
+        }
+    elif name == "lgbm":
+        return {
+            'learning_rate': _log_uniform(rng, 0.01, 0.3),
+            'max_depth': int(rng.integers(3, 13)),
+            'num_leaves': int(rng.integers(15, 256)),
+            'min_child_samples': int(rng.integers(5, 60)),
+            'subsample': float(rng.uniform(0.5, 1.0)),
+            'subsample_freq': 1,
+            'colsample_bytree': float(rng.uniform(0.3, 1.0)),
+            'reg_lambda': _log_uniform(rng, 0.1, 10.0)
+        }
+    elif name == "rf":
+        return {
+            'max_depth': int(rng.integers(6, 31)),
+            'min_samples_leaf': int(rng.integers(1, 11)),
+            'min_samples_split': int(rng.integers(2, 11)),
+            'max_features': str(rng.choice(['sqrt', 'log2'])) if rng.random() < 0.7
+            else float(rng.uniform(0.2, 0.6))
+        }
+    raise ValueError(f"Unknown ensemble member '{name}', expected one of {', '.join(DEFAULT_PARAMS)}")
+
+
+def _lightgbm_eval_kwargs(X_valid, y_valid):
+    # LightGBM 4.6 renamed eval_set to eval_X/eval_y and warns on every fit
+    import inspect
+    from lightgbm import LGBMClassifier
+    if 'eval_X' in inspect.signature(LGBMClassifier.fit).parameters:
+        return {'eval_X': (X_valid,), 'eval_y': (y_valid,)}
+    return {'eval_set': [(X_valid, y_valid)]}
+
+
+def _fit_trial(name, params, resource, fold, balance):
+    # Fit one candidate on one fold with resource rounds (or trees), one thread;
+    # boosted members stop early on the validation residues, never on the test ones
+    X_train, y_train, X_valid, y_valid, X_test, y_test, _ = fold
+    model = make_member(name, {**params, 'n_estimators': resource, 'n_jobs': 1})
+    if balance:
+        balance_class_weights(model, y_train)
+
+    if name == "xgb":
+        model.set_params(early_stopping_rounds=EARLY_STOPPING_ROUNDS, eval_metric='logloss')
+        model.fit(X_train, y_train, eval_set=[(X_valid, y_valid)], verbose=False)
+        n_used = model.best_iteration + 1
+    elif name == "lgbm":
+        import lightgbm
+        model.set_params(verbose=-1)
+        model.fit(X_train, y_train, **_lightgbm_eval_kwargs(X_valid, y_valid),
+                  callbacks=[lightgbm.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+        n_used = model.best_iteration_ or resource
+    else:
+        model.fit(X_train, y_train)
+        n_used = resource
+    return model.predict_proba(X_test)[:, 1], n_used
+
+
+def _evaluate_rung(name, candidates, resource, folds, y, executor, balance):
+    # Out-of-fold AUC and rounds used of every candidate at this resource
+    futures = [[executor.submit(_fit_trial, name, params, resource, fold, balance) for fold in folds]
+               for params in candidates]
+    results = []
+    for params, fold_futures in zip(candidates, futures):
+        oof_proba = np.empty(len(y))
+        n_used = []
+        for fold, future in zip(folds, fold_futures):
+            test_index = fold[-1]
+            proba, rounds = future.result()
+            oof_proba[test_index] = proba
+            n_used.append(rounds)
+        results.append((roc_auc_score(y, oof_proba), int(round(np.mean(n_used)))))
+    return results
+
+
+def successive_halving(name, candidates, folds, y, executor, n_rungs, max_resource, eta=3,
+                       balance=False, log=print):
+    """
+    Keep the best 1/eta of the candidates at every rung, multiplying their resource by eta
+
+    The last of the n_rungs rungs gives the survivors max_resource.
+
+    Returns:
+        (score, params, rounds used) of the best candidate at the last rung
+    """
+    for rung in range(n_rungs):
+        resource = max(1, int(round(max_resource / eta ** (n_rungs - 1 - rung))))
+        results = _evaluate_rung(name, candidates, resource, folds, y, executor, balance)
+        order = np.argsort([-score for score, _ in results], kind='stable')
+        log(f"  {name}: {len(candidates)} candidates at {resource} rounds, best AUC {results[order[0]][0]:.4f}")
+        if rung == n_rungs - 1 or len(candidates) == 1:
+            break
+        candidates = [candidates[i] for i in order[:max(1, len(candidates) // eta)]]
+    best_score, best_rounds = results[order[0]]
+    return best_score, candidates[order[0]], best_rounds
+
+
+def tune_member(name, folds, y, n_candidates=27, method='halving', eta=3, n_jobs=None, balance=False,
+                random_state=42, log=print):
+    """
+    Search the hyperparameters of one ensemble member
+
+    'halving' runs one successive halving bracket over n_candidates random
+    configurations plus the current defaults; 'hyperband' runs brackets that
+    trade the number of candidates against their starting resource. Boosted
+    members stop early on validation proteins set aside from each training
+    fold, and their tuned n_estimators is the mean number of rounds actually
+    used; every candidate is scored on the held-out folds only.
+
+    Returns:
+        Dict with the best params (including n_estimators), its out-of-fold AUC
+        and the number of candidates tried
+    """
+    if method not in TUNING_METHODS:
+        raise ValueError(f"Unknown tuning method '{method}', expected one of {', '.join(TUNING_METHODS)}")
+    rng = np.random.default_rng(random_state)
+    max_resource = MAX_RESOURCE[name]
+    tunable = set(sample_params(name, np.random.default_rng(0))) | {'n_estimators'}
+    defaults = {key: value for key, value in DEFAULT_PARAMS[name].items() if key in tunable}
+
+    # Brackets of (candidates, rungs); the first one starts the most candidates
+    # at the smallest resource, max_resource / eta^s_max
+    s_max = int(math.floor(math.log(max(n_candidates, 1), eta) + 1e-9))
+    if method == 'halving':
+        brackets = [(n_candidates, s_max + 1)]
+    else:
+        brackets = [(int(math.ceil((s_max + 1) / (s + 1) * eta ** s)), s + 1) for s in range(s_max, -1, -1)]
+
+    n_workers = n_jobs or os.cpu_count() or 1
+    best = None
+    n_tried = 0
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for bracket, (n_configs, n_rungs) in enumerate(brackets):
+            candidates = [sample_params(name, rng) for _ in range(n_configs)]
+            if bracket == 0:
+                candidates[0] = {key: value for key, value in defaults.items() if key != 'n_estimators'}
+            n_tried += len(candidates)
+            score, params, rounds = successive_halving(name, candidates, folds, y, executor, n_rungs,
+                                                       max_resource, eta, balance, log)
+            if best is None or score > best[0]:
+                best = (score, params, rounds)
+
+    score, params, rounds = best
+    return {'params': {**params, 'n_estimators': rounds}, 'score': float(score), 'candidates': n_tried}
+
+
+def _validation_split(y, groups, random_state):
+    # (fit, validation) indices of a training fold: stratified, and grouped by
+    # protein unless the fold holds a single protein
+    n_groups = len(np.unique(groups))
+    if n_groups >= 2:
+        splitter = StratifiedGroupKFold(n_splits=min(VALIDATION_SPLITS, n_groups), shuffle=True,
+                                        random_state=random_state)
+        return next(splitter.split(np.zeros(len(y)), y, groups))
+    splitter = StratifiedKFold(n_splits=VALIDATION_SPLITS, shuffle=True, random_state=random_state)
+    return next(splitter.split(np.zeros(len(y)), y))
+
+
+def make_tuning_folds(X, y, groups, n_splits=3, resample=None, random_state=42, n_jobs=None):
+    """
+    Protein-grouped folds with the training part oversampled once for all trials
+
+    Validation residues for early stopping are split off the real training
+    residues of every fold before oversampling, so neither synthetic residues
+    nor the held-out fold take part in choosing the number of rounds.
+
+    Returns:
+        List of (X_train, y_train, X_valid, y_valid, X_test, y_test, test_index) per fold
+    """
+    X = np.asarray(X)
+    y = np.asarray(y).astype(int)
+    groups = np.asarray(groups)
+    n_splits = min(n_splits, len(np.unique(groups)))
+    if n_splits < 2:
+        raise ValueError("Tuning needs residues from at least two proteins")
+    splitter = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+
+    folds = []
+    for train_index, test_index in splitter.split(X, y, groups):
+        fit_index, valid_index = _validation_split(y[train_index], groups[train_index], random_state)
+        fit_index, valid_index = train_index[fit_index], train_index[valid_index]
+        X_train, y_train = X[fit_index], y[fit_index]
+        if resample is not None:
+            X_train, y_train = resample(X_train, y_train, n_jobs=n_jobs or -1)
+        folds.append((np.asarray(X_train), np.asarray(y_train).astype(int), X[valid_index], y[valid_index],
+                      X[test_index], y[test_index], test_index))
+    return folds
+
+
+def tune_ensemble(X, y, groups, members=("xgb", "lgbm", "rf"), n_candidates=27, method='halving', eta=3,
+                  n_splits=3, resample=None, balance=False, n_jobs=None, random_state=42, log=print):
+    """
+    Tune every ensemble member on protein-grouped folds
+
+    Args:
+        X: Selected features of the real training residues
+        y: Labels
+        groups: ProteinID of every residue
+        members: Members to tune, the others keep their parameters
+        n_candidates: Random configurations per member (per bracket size for hyperband)
+        method: 'halving' or 'hyperband'
+        eta: Fraction of candidates kept per rung is 1/eta
+        n_splits: Grouped folds
+        resample: Function (X, y, n_jobs) -> (X_res, y_res) applied to the training folds
+        balance: Weight the classes instead of resampling (sampler 'class_weight')
+        n_jobs: CPU budget; trials run in parallel with one thread each
+
+    Returns:
+        Dict of member name -> result of tune_member
+    """
+    folds = make_tuning_folds(X, y, groups, n_splits, resample, random_state, n_jobs)
+    y = np.asarray(y).astype(int)
+    results = {}
+    for name in members:
+        log(f"Tuning {name} ({method})...")
+        results[name] = tune_member(name, folds, y, n_candidates, method, eta, n_jobs, balance,
+                                    random_state, log)
+        log(f"{name}: out-of-fold AUC {results[name]['score']:.4f} "
+            f"after {results[name]['candidates']} candidates")
+    return results
+
+
+def write_params_file(results, params_file, method=None):
+    """
+    Write tuned parameters in the format modeling.build_models reads
+    """
+    import yaml
+
+    def plain(value):
+        return value.item() if isinstance(value, np.generic) else value
+
+    config = {name: {key: plain(value) for key, value in result['params'].items()}
+              for name, result in results.items()}
+    config['tuning'] = {
+        'method': method,
+        'scores': {name: round(result['score'], 6) for name, result in results.items()},
+        'candidates': {name: result['candidates'] for name, result in results.items()}
+    }
+    os.makedirs(os.path.dirname(params_file) or '.', exist_ok=True)
+    with open(params_file, 'w') as f:
+        f.write("# Tuned ensemble parameters: python main.py --mode train --params-file <this file>\n")
+        yaml.safe_dump(config, f, sort_keys=False)
+    return params_file
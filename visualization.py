@@ -1,29 +1,196 @@
 import os
+import sys
+import argparse
+import numpy as np
 import shap
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import traced
 
 
-def analyze_shap_values(model, X, feature_names, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
+def sample_residues(X, y, sample_size, random_state=42):
+    """
+    Stratified sample of residues, keeping the share of allosteric residues
+
+    Returns:
+        Sorted row indices of the sample (all rows when sample_size covers them)
+    """
+    n_rows = len(X)
+    if sample_size is None or sample_size >= n_rows:
+        return np.arange(n_rows)
+
+    from sklearn.model_selection import train_test_split
+    index, _ = train_test_split(np.arange(n_rows), train_size=sample_size, random_state=random_state,
+                                stratify=np.asarray(y).astype(int))
+    return np.sort(index)
+
+
+def _member_shap(name, estimator, X, background):
+    # Interventional TreeSHAP of the class 1 probability; RandomForest leaves
+    # already hold probabilities, the boosters' margins go through the sigmoid
+    model_output = 'raw' if name == 'rf' else 'probability'
+    explainer = shap.TreeExplainer(estimator, data=background, feature_perturbation='interventional',
+                                   model_output=model_output)
+    values = np.asarray(explainer.shap_values(X, check_additivity=False))
+    base_value = np.atleast_1d(explainer.expected_value)
+    if values.ndim == 3:
+        values, base_value = values[..., 1], base_value[1]
+    else:
+        base_value = base_value[-1]
+    return values, float(base_value)
+
+
+@traced("explain_ensemble", result_rows=lambda shap_result: len(shap_result['X']))
+def explain_ensemble(model, X, y, feature_names, sample_size=1000, background_size=100, n_jobs=None,
+                     random_state=42):
+    """
+    TreeSHAP attributions of every ensemble member and of the soft vote
+
+    A stratified sample of real residues is explained against a background
+    sample of the same residues, in probability space for every member, so the
+    soft-vote attributions are the vote-weighted mean of the member attributions
+    and add up to the ensemble's predicted probability. Members are explained
+    in parallel worker processes.
+
+    Args:
+        model: Fitted soft-voting classifier
+        X: Selected features of real (not oversampled) residues
+        y: Labels of X, used to stratify the samples
+        feature_names: Names of the columns of X
+        sample_size: Residues to explain
+        background_size: Residues the missing features are integrated over
+        n_jobs: Worker processes (default: one per member, at most the number of CPUs)
+
+    Returns:
+        Dict of arrays: X, y, sample_index, feature_names, members, weights,
+        member_values (members x residues x features), member_base, values, base_value
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y).astype(int)
+    sample_index = sample_residues(X, y, sample_size, random_state)
+    background_index = sample_residues(X, y, background_size, random_state + 1)
+    X_sample, background = X[sample_index], X[background_index]
+
+    members = [name for name, _ in model.estimators]
+    weights = np.ones(len(members)) if model.weights is None else np.asarray(model.weights, dtype=float)
+    estimators = [model.named_estimators_[name] for name in members]
+
+    n_workers = min(len(members), n_jobs or os.cpu_count() or 1)
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_member_shap, name, estimator, X_sample, background)
+                       for name, estimator in zip(members, estimators)]
+            results = [future.result() for future in futures]
+    else:
+        results = [_member_shap(name, estimator, X_sample, background)
+                   for name, estimator in zip(members, estimators)]
+
+    member_values = np.stack([values for values, _ in results])
+    member_base = np.array([base_value for _, base_value in results])
+    share = weights / weights.sum()
+    return {
+        'X': X_sample,
+        'y': y[sample_index],
+        'sample_index': sample_index,
+        'feature_names': np.asarray(feature_names, dtype=str),
+        'members': np.asarray(members, dtype=str),
+        'weights': weights,
+        'member_values': member_values,
+        'member_base': member_base,
+        'values': np.tensordot(share, member_values, axes=1),
+        'base_value': np.float64(share @ member_base)
+    }
+
+
+def save_shap_values(shap_result, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, **shap_result)
+    return path
 
 
-    explainer = shap.Explainer(model.named_estimators['xgb'])
-    shap_values = explainer(X)
+def load_shap_values(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
 
 
+@traced("plot_shap_values", rows=lambda shap_result, *args, **kwargs: len(shap_result['X']))
+def plot_shap_values(shap_result, output_dir, max_display=20):
+    """
+    Draw the summary, waterfall and member comparison plots from saved attributions
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    X = shap_result['X']
+    feature_names = list(shap_result['feature_names'])
+    explanation = shap.Explanation(
+        values=shap_result['values'],
+        base_values=np.full(len(X), float(shap_result['base_value'])),
+        data=X,
+        feature_names=feature_names
+    )
+
     plt.figure()
-    shap.summary_plot(shap_values, X, feature_names=feature_names, plot_type="bar", show=False)
+    shap.summary_plot(explanation.values, X, feature_names=feature_names, plot_type="bar",
+                      max_display=max_display, show=False)
     plt.savefig(os.path.join(output_dir, "shap_summary_bar.png"), bbox_inches='tight')
     plt.close()
 
-
     plt.figure()
-    shap.summary_plot(shap_values, X, feature_names=feature_names, show=False)
+    shap.summary_plot(explanation.values, X, feature_names=feature_names, max_display=max_display, show=False)
     plt.savefig(os.path.join(output_dir, "shap_summary.png"), bbox_inches='tight')
     plt.close()
 
-
+    # Residue with the highest predicted allosteric probability
+    top_residue = int(np.argmax(explanation.base_values + explanation.values.sum(axis=1)))
     plt.figure()
-    shap.plots.waterfall(shap_values[0], show=False)
+    shap.plots.waterfall(explanation[top_residue], max_display=max_display, show=False)
     plt.savefig(os.path.join(output_dir, "shap_waterfall.png"), bbox_inches='tight')
     plt.close()
+
+    # Mean |SHAP| of the top features for every member and the soft vote
+    importance = np.vstack([np.abs(shap_result['member_values']).mean(axis=1),
+                            np.abs(shap_result['values']).mean(axis=0)])
+    labels = list(shap_result['members']) + ['ensemble']
+    order = np.argsort(importance[-1])[::-1][:max_display][::-1]
+    positions = np.arange(len(order))
+    height = 0.8 / len(labels)
+    plt.figure(figsize=(8, 0.4 * len(order) + 1.5))
+    for row, label in enumerate(labels):
+        plt.barh(positions + row * height, importance[row, order], height=height, label=label)
+    plt.yticks(positions + 0.4 - height / 2, [feature_names[i] for i in order])
+    plt.xlabel("mean(|SHAP value|) on the allosteric probability")
+    plt.legend()
+    plt.savefig(os.path.join(output_dir, "shap_members_bar.png"), bbox_inches='tight')
+    plt.close()
+
+
+def analyze_shap_values(model, X, feature_names, output_dir, y=None, sample_size=1000, n_jobs=None):
+    """
+    Explain the ensemble on a sample of residues, save the raw arrays and plot them
+
+    Returns:
+        The attributions of explain_ensemble, also saved as output_dir/shap_values.npz
+    """
+    y = np.zeros(len(X), dtype=int) if y is None else y
+    shap_result = explain_ensemble(model, X, y, feature_names, sample_size=sample_size, n_jobs=n_jobs)
+    save_shap_values(shap_result, os.path.join(output_dir, "shap_values.npz"))
+    plot_shap_values(shap_result, output_dir)
+    return shap_result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redraw the SHAP plots from saved attributions")
+    parser.add_argument("values", nargs="?", default="results/shap/shap_values.npz",
+                        help="shap_values.npz written at training time")
+    parser.add_argument("--output-dir", help="Directory for the plots (default: next to the values)")
+    parser.add_argument("--max-display", type=int, default=20, help="Features shown per plot")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.values):
+        sys.exit(f"Error: {args.values} does not exist, train the model first")
+    output_dir = args.output_dir or os.path.dirname(args.values) or '.'
+    plot_shap_values(load_shap_values(args.values), output_dir, args.max_display)
+    print(f"SHAP plots written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()